@@ -0,0 +1,345 @@
+"""
+Create a matrix of setups for one insert in a single run
+
+The insert data, its geometry and the unit conversion are loaded once
+and shared by every variant.
+
+Variants are either given explicitly:
+    --variant cfpdes:static:Axi:thelec:mean --variant cfpdes:static:Axi:thmag:grad:nonlinear
+
+or as the cartesian product of:
+    --method cfpdes CG HDG --geom Axi 3D --model thelec thmag --cooling mean grad --linear linear nonlinear
+
+Unsupported combinations (see magnetsetup.json) are skipped.
+Output files are named as in setup, with the cooling appended.
+
+Several inputs (--datafile and/or --magnet) are processed in a pool of
+-j worker processes. Each input is written to its own output directory
+(named after the input) with a log of the generation, and one failing
+input does not abort the others.
+"""
+
+from typing import List, Optional, Tuple
+
+import os
+import sys
+import time
+import itertools
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .setup import appenv, loadconfig, load_object, load_object_from_db, load_geometry, convert_data
+from .setup import setup_name, create_setup, geometry_files
+from .model import magnet_data
+from . import units
+
+
+def supported(AppCfg: dict, method_data: List[str], nonlinear: bool, template_path: Optional[str] = None):
+    """
+    Check if method_data is defined in magnetsetup.json
+
+    template_path: also check that the templates exist in this directory (see loadtemplates)
+    """
+    [method, time, geom, model, cooling] = method_data
+    try:
+        cfg = AppCfg[method][time][geom][model]
+    except KeyError:
+        return False
+
+    keys = ["cfg", "model", "insulator"]
+    if nonlinear:
+        keys.append("conductor-nonlinear")
+        if geom == "3D":
+            keys.append("model-nonlinear")
+    else:
+        keys.append("conductor-linear")
+    if model != "mag":
+        keys += ["cooling", "cooling-post", "stats_T", "stats_Power"]
+
+    if not all(key in cfg for key in keys):
+        return False
+    if model != "mag" and not cooling in cfg["cooling"]:
+        return False
+
+    if template_path is not None:
+        templates = [cfg["cfg"], cfg["model-nonlinear"] if nonlinear and geom == "3D" else cfg["model"],
+                     cfg["conductor-nonlinear"] if nonlinear else cfg["conductor-linear"], cfg["insulator"]]
+        if model != "mag":
+            templates += [cfg["cooling"][cooling], cfg["cooling-post"][cooling], cfg["stats_T"], cfg["stats_Power"]]
+        directory = os.path.join(template_path, method, geom, model)
+        if not all(os.path.isfile(os.path.join(directory, template)) for template in templates):
+            return False
+    return True
+
+
+def parse_variant(variant: str):
+    """
+    Convert method:time:geom:model:cooling[:nonlinear] into (method_data, nonlinear)
+    """
+    items = variant.split(":")
+    if len(items) == 5:
+        return (items, False)
+    if len(items) == 6 and items[5] in ["linear", "nonlinear"]:
+        return (items[:5], items[5] == "nonlinear")
+    raise ValueError("variant %s: expected method:time:geom:model:cooling[:nonlinear]" % variant)
+
+
+def variants(AppCfg: dict, methods: List[str], times: List[str], geoms: List[str], models: List[str],
+             coolings: List[str], linearities: List[str], template_path: Optional[str] = None,
+             debug: bool = False):
+    """
+    Return the supported variants of the cartesian product
+
+    template_path: skip the variants whose templates are missing in this directory
+    """
+    res = []
+    for (method, time, geom, model, cooling, linear) in itertools.product(methods, times, geoms, models, coolings, linearities):
+        method_data = [method, time, geom, model, cooling]
+        nonlinear = (linear == "nonlinear")
+        if model == "mag" and cooling != coolings[0]:
+            # cooling is not used for mag
+            continue
+        if not supported(AppCfg, method_data, nonlinear, template_path):
+            if debug:
+                print("skip unsupported variant:", method_data, linear)
+            continue
+        res.append((method_data, nonlinear))
+    return res
+
+
+def generate(MyEnv: appenv, AppCfg: dict, confdata: dict, basename: str,
+             variants: List[Tuple[List[str], bool]], distance_unit: str = "meter",
+             wd: str = "", outdir: str = None, cache: bool = True, compact: bool = False, shared: bool = False,
+             debug: bool = False):
+    """
+    Create setups for all variants of one insert
+
+    inputs are read from wd, outputs are written to outdir (default: wd)
+    geometry and unchanged setups are restored from the caches, unless cache is False
+    compact: write json models without indentation
+    shared: define one material per helix in Axi (see create_materials)
+
+    returns a list of (method_data, nonlinear, files, error)
+    """
+    if outdir is None:
+        outdir = wd
+
+    yamlfile = confdata["geom"]
+    geom = "3D" if any(method_data[2] == "3D" for (method_data, nonlinear) in variants) else "Axi"
+    (cad, gdata, insulators) = load_geometry(yamlfile, geom, basedir=wd, debug=debug, cache=cache)
+    (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
+    mu0 = units.mu0
+    h = units.h
+
+    print("Insert: %s" % cad.name, "NHelices=%d NRings=%d NChannels=%d" % (NHelices, NRings, NChannels))
+    confdata, gdata, h, mu0 = convert_data(distance_unit, magnet_data(confdata), gdata, h, mu0)
+    sources = geometry_files(cad, yamlfile, basedir=wd)
+    output_cache = MyEnv.output_cache(debug) if cache else None
+
+    results = []
+    for (method_data, nonlinear) in variants:
+        suffix = "" if method_data[3] == "mag" else "-" + method_data[4]
+        jsonfile = setup_name(basename, method_data, nonlinear, suffix)
+        try:
+            files = create_setup(MyEnv, AppCfg, method_data, nonlinear, cad, yamlfile, gdata, confdata, h, mu0,
+                                 jsonfile, outdir, debug, output_cache, sources, compact, shared)
+            results.append((method_data, nonlinear, files, None))
+        except Exception as e:
+            print("failed to create %s: %s" % (jsonfile, e))
+            results.append((method_data, nonlinear, [], e))
+
+    return results
+
+
+def run_input(mtype: str, name: str, variants: List[Tuple[List[str], bool]], distance_unit: str = "meter",
+              wd: str = "", outdir: str = None, cache: bool = True, compact: bool = False, shared: bool = False,
+              debug: bool = False):
+    """
+    Create all variants for one input (a datafile or a magnet from magnetdb)
+
+    mtype: "datafile" or "magnet"
+
+    stdout is redirected to outdir/magnetsetup.log when outdir is given,
+    errors are reported in the returned dict instead of being raised.
+    """
+
+    start = time.perf_counter()
+    result = {"input": name, "type": mtype, "outdir": outdir if outdir is not None else wd,
+              "status": "ok", "files": [], "failed": [], "error": None}
+
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+        log = open(os.path.join(outdir, "magnetsetup.log"), "w")
+    else:
+        log = contextlib.nullcontext(sys.stdout)
+
+    with log as out, contextlib.redirect_stdout(out):
+        try:
+            MyEnv = appenv()
+            AppCfg = loadconfig()
+            if mtype == "datafile":
+                confdata = load_object(MyEnv, os.path.join(wd, name), debug)
+                basename = os.path.basename(name).replace("-data.json","")
+            else:
+                confdata = load_object_from_db(MyEnv, "magnet", name, debug)
+                basename = name
+
+            for (method_data, nonlinear, files, error) in generate(MyEnv, AppCfg, confdata, basename, variants,
+                                                                   distance_unit, wd, outdir, cache, compact,
+                                                                   shared, debug):
+                variant = ":".join(method_data) + (":nonlinear" if nonlinear else "")
+                if error:
+                    result["failed"].append({"variant": variant, "error": str(error)})
+                else:
+                    result["files"] += files
+        except (Exception, SystemExit) as e:
+            traceback.print_exc(file=out)
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+
+    if result["error"] or result["failed"]:
+        result["status"] = "failed"
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def output_dirs(inputs: List[Tuple[str, str]], output: str):
+    """
+    Return the output directory of each input, named after the input
+
+    inputs with the same name (eg. HL-34-data.json of two directories, or a datafile
+    and a magnet) get a numeric suffix: HL-34, HL-34-2...
+    """
+    res = []
+    for (mtype, name) in inputs:
+        basename = os.path.basename(name).replace("-data.json","")
+        outdir = os.path.join(output, basename)
+        n = 1
+        while outdir in res:
+            n += 1
+            outdir = os.path.join(output, "%s-%d" % (basename, n))
+        res.append(outdir)
+    return res
+
+
+def run_inputs(inputs: List[Tuple[str, str]], variants: List[Tuple[List[str], bool]], distance_unit: str = "meter",
+               wd: str = "", output: str = None, jobs: int = 1, cache: bool = True, compact: bool = False,
+               shared: bool = False, debug: bool = False):
+    """
+    Create all variants for several inputs, using a pool of jobs processes
+
+    inputs: list of ("datafile", filename) or ("magnet", name)
+    each input is written in its own directory of output (default: wd), see output_dirs
+
+    returns the list of run_input results, in the order of inputs
+    """
+
+    if output is None:
+        output = wd
+
+    tasks = []
+    for ((mtype, name), outdir) in zip(inputs, output_dirs(inputs, output)):
+        tasks.append((mtype, name, variants, distance_unit, wd, outdir, cache, compact, shared, debug))
+
+    if jobs <= 1:
+        return [run_input(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_input, *task) for task in tasks]
+        results = []
+        for (task, future) in zip(tasks, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # eg. worker killed
+                results.append({"input": task[1], "type": task[0], "outdir": task[5], "status": "failed",
+                                "files": [], "failed": [], "error": "%s: %s" % (type(e).__name__, e), "time": 0})
+    return results
+
+
+def main():
+    """
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create a matrix of json model files for Feelpp/HiFiMagnet simu")
+    parser.add_argument("--datafile", help="input data files (ex. HL-34-data.json)", type=str, nargs="+", default=[])
+    parser.add_argument("--wd", help="set a working directory", type=str, default="")
+    parser.add_argument("--magnet", help="Magnet names from magnetdb (ex. HL-34)", type=str, nargs="+", default=[])
+    parser.add_argument("--output", help="output directory for several inputs (default is wd)", type=str, default=None)
+    parser.add_argument("-j", "--jobs", help="number of worker processes", type=int, default=1)
+    parser.add_argument("--report", help="save per input results to a json file", type=str, default=None)
+
+    parser.add_argument("--variant", help="add a variant (method:time:geom:model:cooling[:nonlinear])", type=str,
+                    action="append", default=[])
+    parser.add_argument("--method", help="choose methods", type=str, nargs="+",
+                    choices=['cfpdes', 'CG', 'HDG', 'CRB'], default=['cfpdes'])
+    parser.add_argument("--time", help="choose time types", type=str, nargs="+",
+                    choices=['static', 'transient'], default=['static'])
+    parser.add_argument("--geom", help="choose geom types", type=str, nargs="+",
+                    choices=['Axi', '3D'], default=['Axi'])
+    parser.add_argument("--model", help="choose model types", type=str, nargs="+",
+                    choices=['thelec', 'mag', 'thmag', 'thmagel'], default=['thelec', 'mag', 'thmag', 'thmagel'])
+    parser.add_argument("--cooling", help="choose cooling types", type=str, nargs="+",
+                    choices=['mean', 'grad'], default=['mean'])
+    parser.add_argument("--linear", help="choose linear and/or nonlinear", type=str, nargs="+",
+                    choices=['linear', 'nonlinear'], default=['linear'])
+    parser.add_argument("--distance_unit", help="distance's unit", type=str,
+                    choices=['meter','millimeter'], default='meter')
+
+    parser.add_argument("--no-cache", help="do not use the cache of geometries and generated setups", dest="cache", action='store_false')
+    parser.add_argument("--compact", help="write json models without indentation", action='store_true')
+    parser.add_argument("--shared-materials", help="define one material per helix for all its sections (Axi)",
+                        dest="shared", action='store_true')
+
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        print(args)
+
+    AppCfg = loadconfig()
+
+    if args.variant:
+        vlist = [parse_variant(v) for v in args.variant]
+    else:
+        vlist = variants(AppCfg, args.method, args.time, args.geom, args.model, args.cooling, args.linear,
+                         appenv().template_path(), args.debug)
+    if not vlist:
+        print("no supported variant selected")
+        return 1
+
+    inputs = [("datafile", f) for f in args.datafile] + [("magnet", m) for m in args.magnet]
+    if not inputs:
+        print("expected --datafile or --magnet")
+        return 1
+
+    if len(inputs) == 1 and args.jobs <= 1:
+        result = run_input(inputs[0][0], inputs[0][1], vlist, args.distance_unit, args.wd, args.output, args.cache,
+                           args.compact, args.shared, args.debug)
+        results = [result]
+    else:
+        results = run_inputs(inputs, vlist, args.distance_unit, args.wd, args.output, args.jobs, args.cache,
+                             args.compact, args.shared, args.debug)
+
+    print("\n\n=== Generated setups ===")
+    status = 0
+    for result in results:
+        print("%-30s %-6s %8.3f s  %3d files  %s" % (result["input"], result["status"], result["time"],
+                                                    len(result["files"]), result["outdir"]))
+        if result["error"]:
+            print("    error:", result["error"])
+        for failed in result["failed"]:
+            print("    %s FAILED %s" % (failed["variant"], failed["error"]))
+        if result["status"] != "ok":
+            status = 1
+
+    if args.report:
+        import json
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=4)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""
+Benchmark of the setup pipeline
+
+Times the stages of the setup (entry, convert_data, create_params,
+create_bcs, create_materials, create_json and the whole create_setup)
+for every combination of magnetsetup.json, on synthetic inserts built
+in code with 1 to 64 helices and 1 to 1000 sections per helix.
+
+With --datafile, the end-to-end setup (main: loading of the data and of
+the insert yaml files, resources, create_setup with file writes) is also
+timed on a copy of the datafile and its yaml files (python_magnetgeo
+is required).
+
+Results are saved as json and may be compared with a previous run:
+
+python -m python_magnetsetup.benchmark --output bench-new.json --compare bench-old.json
+python -m python_magnetsetup.benchmark --datafile HL-34-data.json --wd data --select Axi --output bench.json
+"""
+
+from typing import List, Optional
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+from . import __version__
+from .setup import appenv, loadconfig, loadtemplates, convert_data, entry, Merge
+from .setup import create_markers, create_params, create_bcs, create_materials, create_post, create_json
+from .setup import create_setup, setup_name, load_object, load_geometry, geometry_files
+from .batch import supported
+from . import units
+
+default_helices = [1, 8, 64]
+default_sections = [1, 10, 100, 1000]
+
+# copper like properties in SI
+material = {
+    "ThermalConductivity": 380, "Young": 127.e+9, "VolumicMass": 9000.,
+    "ElectricalConductivity": 53.e+6, "Rpe": 481.e+6, "alpha": 3.6e-3, "Tref": 293,
+    "MagnetPermeability": 1, "Poisson": 0.33, "CoefDilatation": 18.e-6
+}
+
+
+class SyntheticInsert():
+    """
+    Insert like object with nhelices helices and nhelices-1 rings
+    """
+
+    def __init__(self, nhelices: int, nsections: int):
+        self.name = "bench-H%d-S%d" % (nhelices, nsections)
+        self.Helices = ["H%d" % (i+1) for i in range(nhelices)]
+        self.Rings = ["R%d" % (i+1) for i in range(nhelices-1)]
+        self.CurrentLeads = ["iL1", "oL2"]
+        self.nsections = nsections
+
+
+def synthetic_insert(nhelices: int, nsections: int):
+    """
+    returns cad, gdata and confdata of a synthetic insert (lengths in mm)
+    """
+    cad = SyntheticInsert(nhelices, nsections)
+
+    R1 = [ 20. + 10.*i for i in range(nhelices) ]
+    R2 = [ r + 8. for r in R1 ]
+    Z1 = [ -150. - 5.*i for i in range(nhelices) ]
+    Z2 = [ -z for z in Z1 ]
+    Zmin = [ -200. ] * (nhelices+1)
+    Zmax = [ 200. ] * (nhelices+1)
+    Dh = [ 2. ] * (nhelices+1)
+    Sh = [ 2. * math.pi * r for r in R1 + [R2[-1]] ]
+    gdata = (nhelices, len(cad.Rings), nhelices+1, [nsections] * nhelices, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh)
+
+    confdata = {
+        "geom": cad.name + ".yaml",
+        "Helix": [ {"material": dict(material), "insulator": dict(material)} for i in range(nhelices) ],
+        "Ring": [ {"material": dict(material)} for i in range(len(cad.Rings)) ],
+        "Lead": [ {"material": dict(material)} for i in range(2) ]
+    }
+    return (cad, gdata, confdata)
+
+
+def combinations(AppCfg: dict, template_path: Optional[str] = None):
+    """
+    returns the supported (method_data, nonlinear) of AppCfg
+
+    template_path: skip the combinations whose templates are missing in this directory
+    """
+    res = []
+    for method in AppCfg:
+        for time in AppCfg[method]:
+            for geom in AppCfg[method][time]:
+                for model in AppCfg[method][time][geom]:
+                    cfg = AppCfg[method][time][geom][model]
+                    coolings = list(cfg["cooling"]) if "cooling" in cfg else ["mean"]
+                    for cooling in coolings:
+                        for nonlinear in [False, True]:
+                            method_data = [method, time, geom, model, cooling]
+                            if supported(AppCfg, method_data, nonlinear, template_path):
+                                res.append((method_data, nonlinear))
+    return res
+
+
+def measure(func, repeat: int = 3):
+    """
+    returns the timings (in s) of repeat calls to func
+    """
+    timings = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def stages(MyEnv: appenv, AppCfg: dict, method_data: List[str], nonlinear: bool, cad, gdata: tuple, confdata: dict,
+           wd: str):
+    """
+    returns the stages to time as a dict of name: function
+    """
+    mu0 = units.mu0
+    h = units.h
+    [method, time, geom, model, cooling] = method_data
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        templates = loadtemplates(MyEnv, AppCfg, method_data, (not nonlinear))
+        (cconfdata, cgdata, ch, cmu0) = convert_data("meter", confdata, gdata, h, mu0)
+        markers = create_markers(cad, cgdata, geom)
+        params_data = create_params(cgdata, ch, cmu0, method_data)
+        bcs_args = [markers[key] for key in ["boundary_meca", "boundary_maxwell", "boundary_electric",
+                                             "boundary_Therm_Neu", "boundary_Electric_Neu"]]
+        bcs_data = create_bcs(*bcs_args, cgdata, cconfdata, templates, method_data)
+        main_data = {
+            "part_thermic": markers["part_thermic"],
+            "part_electric": markers["part_electric"],
+            "index_electric": markers["index_electric"],
+            "index_V0": markers["boundary_electric"],
+            "temperature_initfile": "tini.h5",
+            "V_initfile": "Vini.h5"
+        }
+        mdict = Merge(Merge(main_data, params_data), bcs_data)
+        mpost = create_post(cad, cgdata, markers, geom)
+        mmat = create_materials(cgdata, markers["index_Insulators"], cconfdata, templates, method_data)
+
+    jsonfile = setup_name(cad.name, method_data, nonlinear)
+
+    def setup():
+        (sconfdata, sgdata, sh, smu0) = convert_data("meter", confdata, gdata, h, mu0)
+        create_setup(MyEnv, AppCfg, method_data, nonlinear, cad, cconfdata["geom"], sgdata, sconfdata, sh, smu0,
+                     jsonfile, wd)
+
+    return {
+        "entry": lambda: entry(templates["conductor"], Merge({'name': "H1_Cu1"}, cconfdata["Helix"][0]["material"])),
+        "convert_data": lambda: convert_data("meter", confdata, gdata, h, mu0),
+        "create_params": lambda: create_params(cgdata, ch, cmu0, method_data),
+        "create_bcs": lambda: create_bcs(*bcs_args, cgdata, cconfdata, templates, method_data),
+        "create_materials": lambda: create_materials(cgdata, markers["index_Insulators"], cconfdata, templates,
+                                                     method_data),
+        "create_json": lambda: create_json(os.path.join(wd, jsonfile), mdict, mmat, mpost, templates, method_data),
+        "setup": setup
+    }
+
+
+def end_to_end(datafile: str, wd: str, method_data: List[str], nonlinear: bool):
+    """
+    returns a function running setup main for datafile in wd (without caches)
+    """
+    from . import setup
+
+    [method, time, geom, model, cooling] = method_data
+    argv = ["setup", "--datafile", datafile, "--wd", wd, "--method", method, "--time", time, "--geom", geom,
+            "--model", model, "--cooling", cooling, "--no-cache"] + (["--nonlinear"] if nonlinear else [])
+
+    def main():
+        saved = sys.argv
+        sys.argv = argv
+        try:
+            setup.main()
+        finally:
+            sys.argv = saved
+    return main
+
+
+def copy_insert(datafile: str, basedir: str, wd: str):
+    """
+    copy datafile and the yaml files of its insert from basedir to wd, returns the insert yaml file
+    """
+    MyEnv = appenv()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        confdata = load_object(MyEnv, os.path.join(basedir, datafile))
+    yamlfile = confdata["geom"]
+    (cad, gdata, insulators) = load_geometry(yamlfile, "Axi", basedir=basedir, cache=False)
+    shutil.copy(os.path.join(basedir, datafile), wd)
+    for filename in geometry_files(cad, yamlfile, basedir):
+        shutil.copy(filename, wd)
+    return yamlfile
+
+
+def run(helices: List[int] = default_helices, sections: List[int] = default_sections, repeat: int = 3,
+        select: Optional[List[str]] = None, datafile: Optional[str] = None, basedir: str = "",
+        debug: bool = False):
+    """
+    returns the list of benchmark results
+
+    select: only run combinations containing all these items (ex. ["Axi", "thelec"])
+    datafile: time the end-to-end setup of this insert (in basedir) instead of synthetic inserts
+    """
+    MyEnv = appenv()
+    AppCfg = loadconfig()
+
+    results = []
+    wd = tempfile.mkdtemp(prefix="magnetsetup-bench-")
+    try:
+        if datafile is not None:
+            yamlfile = copy_insert(datafile, basedir, wd)
+        for (method_data, nonlinear) in combinations(AppCfg, MyEnv.template_path()):
+            if select and not all(item in method_data + ["nonlinear" if nonlinear else "linear"] for item in select):
+                continue
+            combination = ":".join(method_data + ["nonlinear" if nonlinear else "linear"])
+
+            if datafile is not None:
+                (cad, gdata, insulators) = load_geometry(yamlfile, method_data[2], basedir=wd, cache=False)
+                timings = measure(end_to_end(os.path.basename(datafile), wd, method_data, nonlinear), repeat)
+                results.append({"combination": combination, "helices": gdata[0], "sections": max(gdata[3]),
+                                "stage": "main", "insert": cad.name, "min": min(timings),
+                                "median": statistics.median(timings), "repeat": repeat})
+                print("%s %s: main %.6f s" % (combination, cad.name, results[-1]["min"]))
+                continue
+
+            for nhelices in helices:
+                for nsections in sections:
+                    (cad, gdata, confdata) = synthetic_insert(nhelices, nsections)
+                    try:
+                        funcs = stages(MyEnv, AppCfg, method_data, nonlinear, cad, gdata, confdata, wd)
+                    except Exception as e:
+                        print("%s H%d S%d: failed (%s)" % (combination, nhelices, nsections, e))
+                        results.append({"combination": combination, "helices": nhelices, "sections": nsections,
+                                        "error": str(e)})
+                        continue
+
+                    for (stage, func) in funcs.items():
+                        timings = measure(func, repeat)
+                        results.append({"combination": combination, "helices": nhelices, "sections": nsections,
+                                        "stage": stage, "min": min(timings), "median": statistics.median(timings),
+                                        "repeat": repeat})
+                        if debug:
+                            print("%s H%d S%d %s: %.6f s" % (combination, nhelices, nsections, stage, min(timings)))
+                    print("%s H%d S%d: setup %.6f s" % (combination, nhelices, nsections, results[-1]["min"]))
+    finally:
+        shutil.rmtree(wd, ignore_errors=True)
+    return results
+
+
+def commit():
+    """
+    returns the git commit of the sources if available
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def key(result: dict):
+    return (result["combination"], result["helices"], result["sections"], result.get("stage"))
+
+
+def compare(old: dict, new: dict, threshold: float = 0.2):
+    """
+    print ratio of new/old timings, returns the list of regressions over threshold
+    """
+    reference = { key(result): result for result in old["results"] if "min" in result }
+    regressions = []
+    for result in new["results"]:
+        if not "min" in result or not key(result) in reference:
+            continue
+        ratio = result["min"] / reference[key(result)]["min"] if reference[key(result)]["min"] else 1.
+        flag = ""
+        if ratio > 1. + threshold:
+            flag = "REGRESSION"
+            regressions.append(result)
+        print("%-45s H%-3d S%-5d %-17s %10.6f s %6.2fx %s" % (result["combination"], result["helices"],
+                                                               result["sections"], result["stage"], result["min"],
+                                                               ratio, flag))
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the setup pipeline on synthetic inserts")
+    parser.add_argument("--helices", help="numbers of helices", type=int, nargs="+", default=default_helices)
+    parser.add_argument("--sections", help="numbers of sections per helix", type=int, nargs="+",
+                        default=default_sections)
+    parser.add_argument("--repeat", help="number of timings per stage", type=int, default=3)
+    parser.add_argument("--select", help="only run combinations with these items (ex. Axi thelec)", type=str,
+                        nargs="+", default=None)
+    parser.add_argument("--output", help="save results to json file", type=str, default="benchmark.json")
+    parser.add_argument("--datafile", help="time the end-to-end setup of this insert (ex. HL-34-data.json)",
+                        type=str, default=None)
+    parser.add_argument("--wd", help="directory of datafile and of the insert yaml files", type=str, default="")
+    parser.add_argument("--compare", help="compare to results of a previous run", type=str, default=None)
+    parser.add_argument("--threshold", help="relative slow down reported as a regression", type=float, default=0.2)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    data = {
+        "version": __version__,
+        "commit": commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": run(args.helices, args.sections, args.repeat, args.select, args.datafile, args.wd, args.debug)
+    }
+    with open(args.output, "w") as f:
+        json.dump(data, f, indent=4)
+    print("results saved to %s" % args.output)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            old = json.load(f)
+        regressions = compare(old, data, args.threshold)
+        print("%d regressions over %d%%" % (len(regressions), int(args.threshold * 100)))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
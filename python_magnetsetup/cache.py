@@ -0,0 +1,93 @@
+"""
+Process-wide cache of compiled templates
+
+Templates are read and compiled once, then kept in memory.
+Entries are keyed by absolute path, file mtime and compiler,
+so that an edited template is transparently reloaded.
+The cache is bounded and evicts the least recently used entry.
+"""
+
+from typing import Callable, Optional
+
+import os
+import threading
+from collections import OrderedDict
+
+import chevron
+
+
+def tokenize(text: str):
+    """
+    Compile a mustache template into a list of chevron tokens
+    """
+    return list(chevron.tokenizer.tokenize(text))
+
+
+class TemplateCache():
+    """
+    Bounded LRU cache of compiled templates with hit/miss counters
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template: str, compiler: Callable = tokenize, debug: bool = False):
+        """
+        Return compiled template, loading it on a miss
+        """
+        path = os.path.abspath(template)
+        key = (path, os.stat(path).st_mtime_ns, compiler)
+
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        if debug:
+            print("TemplateCache/loading %s" % path)
+        with open(path, "r") as f:
+            compiled = compiler(f.read())
+
+        with self._lock:
+            # drop stale versions of the same template
+            for stale in [k for k in self._entries if k[0] == path and k[2] == compiler]:
+                del self._entries[stale]
+            self._entries[key] = compiled
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        """
+        Remove all entries and reset counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return cache statistics
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+template_cache = TemplateCache()
+
+
+def render(template: str, rdata: dict, cache: Optional[TemplateCache] = None, debug: bool = False):
+    """
+    Render a mustache template file using its cached tokens
+    """
+    if cache is None:
+        cache = template_cache
+    tokens = cache.get(template, tokenize, debug)
+    return chevron.render(tokens, rdata)
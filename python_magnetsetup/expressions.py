@@ -0,0 +1,601 @@
+"""
+Optimization of the expressions of json models
+
+Feel++ expressions are written as "expr:symbol1:symbol2..." and evaluated
+(GiNaC) at every quadrature point. The optimizer parses these strings in
+the rendered model and applies the passes:
+
+* fold: fold constants, including the Parameters marked as constant
+  (eg. "1*mu0:mu0" -> "mu0:mu0", "2*pi*phi/x*(U/2/pi):phi:U:x" -> "phi/x*U:phi:U:x")
+* compare: canonical comparisons (a>b -> b<a), products of a comparison
+  by itself, 1-(a<b) -> (b<=a)
+* cse: subexpressions only depending on Parameters (eg. Tw1+dTw1) are
+  computed once as new Parameters, shared by all the expressions using them
+* prune: drop the symbols an expression does not use
+
+Each rewritten expression is evaluated against the original one at
+random points; on mismatch, or when a symbol it uses is no longer
+declared, the original expression is kept.
+
+ex:
+stats = optimize_model(model, constants=["T0"])
+"""
+
+from typing import Dict, List, Optional
+
+import re
+import math
+import random
+
+passes = ["fold", "compare", "cse", "prune"]
+
+functions = {
+    "abs": abs, "sqrt": math.sqrt, "exp": math.exp, "log": math.log,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan, "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh, "atan2": math.atan2, "pow": math.pow,
+    "min": min, "max": max,
+}
+
+comparisons = {
+    "<": lambda a, b: a < b, "<=": lambda a, b: a <= b, ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+    "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+}
+swapped = {">": "<", ">=": "<=", "<": "<", "<=": "<=", "==": "==", "!=": "!="}
+negated = {"<": ">=", "<=": ">", "==": "!=", "!=": "=="}
+
+# symbols defined by Feel++, used without being declared
+builtins = ["x", "y", "z", "t", "pi"]
+
+identifier = re.compile(r"[A-Za-z_%][A-Za-z0-9_%]*$")
+
+token = re.compile(r"\s*(?:(?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|(?P<sym>[A-Za-z_%][A-Za-z0-9_%]*)"
+                   r"|(?P<op><=|>=|==|!=|\*\*|[-+*/^()<>,{}]))")
+
+# precedences
+CMP, ADD, MUL, NEG, POW, ATOM = range(1, 7)
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+# Nodes are tuples:
+# ("num", value, text), ("sym", name), ("add", ((sign, term), ...)), ("mul", ((power, factor), ...)),
+# ("neg", a), ("pow", a, b), ("cmp", op, a, b), ("call", name, (args, ...)), ("vec", (items, ...))
+
+def num(value: float, text: Optional[str] = None):
+    if text is None:
+        if value == int(value) and abs(value) < 1.e+15:
+            text = str(int(value))
+        else:
+            text = repr(value)
+    return ("num", value, text)
+
+
+class Parser():
+    """
+    Parser of GiNaC like expressions
+    """
+
+    def __init__(self, text: str):
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = token.match(text, pos)
+            if m is None or m.end() == pos:
+                raise ExpressionError("unexpected %r in %s" % (text[pos:pos+10], text))
+            self.tokens.append((m.lastgroup, m.group(m.lastgroup)))
+            pos = m.end()
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def expect(self, op: str):
+        if self.next() != ("op", op):
+            raise ExpressionError("expected %s" % op)
+
+    def parse(self):
+        node = self.comparison()
+        if self.pos != len(self.tokens):
+            raise ExpressionError("unexpected %s" % self.peek()[1])
+        return node
+
+    def comparison(self):
+        node = self.sum()
+        while self.peek()[0] == "op" and self.peek()[1] in comparisons:
+            op = self.next()[1]
+            node = ("cmp", op, node, self.sum())
+        return node
+
+    def sum(self):
+        terms = [(1, self.product())]
+        while self.peek() in [("op", "+"), ("op", "-")]:
+            sign = 1 if self.next()[1] == "+" else -1
+            terms.append((sign, self.product()))
+        return terms[0][1] if len(terms) == 1 else ("add", tuple(terms))
+
+    def product(self):
+        factors = [(1, self.unary())]
+        while self.peek() in [("op", "*"), ("op", "/")]:
+            power = 1 if self.next()[1] == "*" else -1
+            factors.append((power, self.unary()))
+        return factors[0][1] if len(factors) == 1 else ("mul", tuple(factors))
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.next()
+            return ("neg", self.unary())
+        if self.peek() == ("op", "+"):
+            self.next()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() in [("op", "^"), ("op", "**")]:
+            self.next()
+            return ("pow", base, self.unary())
+        return base
+
+    def atom(self):
+        (kind, value) = self.next()
+        if kind == "num":
+            return num(float(value), value)
+        if kind == "sym":
+            if self.peek() == ("op", "("):
+                if not value in functions:
+                    raise ExpressionError("unknown function %s" % value)
+                self.next()
+                args = [self.comparison()]
+                while self.peek() == ("op", ","):
+                    self.next()
+                    args.append(self.comparison())
+                self.expect(")")
+                return ("call", value, tuple(args))
+            if value == "pi":
+                return num(math.pi, "pi")
+            return ("sym", value)
+        if (kind, value) == ("op", "("):
+            node = self.comparison()
+            self.expect(")")
+            return node
+        if (kind, value) == ("op", "{"):
+            items = [self.comparison()]
+            while self.peek() == ("op", ","):
+                self.next()
+                items.append(self.comparison())
+            self.expect("}")
+            return ("vec", tuple(items))
+        raise ExpressionError("unexpected %s" % value)
+
+
+def parse(text: str):
+    """
+    Return the tree of expression text
+    """
+    return Parser(text).parse()
+
+
+def precedence(node):
+    kind = node[0]
+    if kind == "num":
+        return NEG if node[1] < 0 else ATOM
+    return {"sym": ATOM, "call": ATOM, "vec": ATOM, "add": ADD, "mul": MUL, "neg": NEG, "pow": POW,
+            "cmp": CMP}[kind]
+
+
+def _wrap(node, parens: bool):
+    text = to_string(node)
+    return "(" + text + ")" if parens else text
+
+
+def to_string(node):
+    """
+    Return the expression text of node
+    """
+    kind = node[0]
+    if kind == "num":
+        return node[2]
+    if kind == "sym":
+        return node[1]
+    if kind == "add":
+        text = ""
+        for (i, (sign, term)) in enumerate(node[1]):
+            parens = precedence(term) <= ADD or (i > 0 and precedence(term) == NEG)
+            text += ("-" if sign < 0 else ("+" if i else "")) + _wrap(term, parens)
+        return text
+    if kind == "mul":
+        text = ""
+        for (i, (power, factor)) in enumerate(node[1]):
+            parens = precedence(factor) <= (MUL if power < 0 else ADD) or (i > 0 and precedence(factor) == NEG)
+            text += ("/" if power < 0 else ("*" if i else "")) + _wrap(factor, parens)
+            if i == 0 and power < 0:
+                text = "1" + text
+        return text
+    if kind == "neg":
+        return "-" + _wrap(node[1], precedence(node[1]) <= ADD)
+    if kind == "pow":
+        return _wrap(node[1], precedence(node[1]) <= POW) + "^" + _wrap(node[2], precedence(node[2]) < ATOM)
+    if kind == "cmp":
+        return _wrap(node[2], precedence(node[2]) <= CMP) + node[1] + _wrap(node[3], precedence(node[3]) <= CMP)
+    if kind == "call":
+        return node[1] + "(" + ",".join(to_string(arg) for arg in node[2]) + ")"
+    if kind == "vec":
+        return "{" + ",".join(to_string(item) for item in node[1]) + "}"
+    raise ExpressionError("unknown node %s" % kind)
+
+
+def evaluate(node, env: Dict[str, float]):
+    """
+    Return the value of node with symbols values taken from env
+    """
+    kind = node[0]
+    if kind == "num":
+        return node[1]
+    if kind == "sym":
+        return env[node[1]]
+    if kind == "add":
+        return sum(sign * evaluate(term, env) for (sign, term) in node[1])
+    if kind == "mul":
+        value = 1.
+        for (power, factor) in node[1]:
+            value = value * evaluate(factor, env) if power > 0 else value / evaluate(factor, env)
+        return value
+    if kind == "neg":
+        return -evaluate(node[1], env)
+    if kind == "pow":
+        return math.pow(evaluate(node[1], env), evaluate(node[2], env))
+    if kind == "cmp":
+        return 1. if comparisons[node[1]](evaluate(node[2], env), evaluate(node[3], env)) else 0.
+    if kind == "call":
+        return float(functions[node[1]](*[evaluate(arg, env) for arg in node[2]]))
+    if kind == "vec":
+        return tuple(evaluate(item, env) for item in node[1])
+    raise ExpressionError("unknown node %s" % kind)
+
+
+def symbols(node, res: Optional[list] = None):
+    """
+    Return the symbols used in node, in order of appearance
+    """
+    if res is None:
+        res = []
+    kind = node[0]
+    if kind == "sym":
+        if not node[1] in res:
+            res.append(node[1])
+    elif kind in ["add", "mul"]:
+        for (s, child) in node[1]:
+            symbols(child, res)
+    elif kind == "neg":
+        symbols(node[1], res)
+    elif kind == "pow":
+        symbols(node[1], res)
+        symbols(node[2], res)
+    elif kind == "cmp":
+        symbols(node[2], res)
+        symbols(node[3], res)
+    elif kind in ["call", "vec"]:
+        for child in node[-1]:
+            symbols(child, res)
+    return res
+
+
+def substitute(node, values: Dict):
+    """
+    Return node with the symbols in values replaced by values nodes
+    """
+    kind = node[0]
+    if kind == "num":
+        return node
+    if kind == "sym":
+        return values.get(node[1], node)
+    if kind in ["add", "mul"]:
+        return (kind, tuple((s, substitute(child, values)) for (s, child) in node[1]))
+    if kind == "neg":
+        return ("neg", substitute(node[1], values))
+    if kind == "pow":
+        return ("pow", substitute(node[1], values), substitute(node[2], values))
+    if kind == "cmp":
+        return ("cmp", node[1], substitute(node[2], values), substitute(node[3], values))
+    return (kind,) + node[1:-1] + (tuple(substitute(child, values) for child in node[-1]),)
+
+
+def fold(node, compare: bool = True):
+    """
+    Return node with constants folded (and comparisons simplified if compare)
+    """
+    kind = node[0]
+    if kind in ["num", "sym"]:
+        return node
+
+    if kind == "neg":
+        a = fold(node[1], compare)
+        if a[0] == "num":
+            return num(-a[1])
+        if a[0] == "neg":
+            return a[1]
+        return ("neg", a)
+
+    if kind == "add":
+        terms = []
+        constant = 0.
+        for (sign, term) in node[1]:
+            term = fold(term, compare)
+            if term[0] == "neg":
+                (sign, term) = (-sign, term[1])
+            if term[0] == "add":
+                terms += [(sign * s, t) for (s, t) in term[1]]
+            elif term[0] == "num":
+                constant += sign * term[1]
+            else:
+                terms.append((sign, term))
+        if compare and len(terms) == 1 and terms[0][0] < 0 and terms[0][1][0] == "cmp" and constant == 1. \
+           and terms[0][1][1] in negated:
+            # 1-(a<b) -> b<=a
+            (op, a, b) = terms[0][1][1:]
+            return fold(("cmp", negated[op], a, b), compare)
+        if constant != 0. or not terms:
+            terms.append((1 if constant >= 0 else -1, num(abs(constant))))
+        if len(terms) == 1:
+            return terms[0][1] if terms[0][0] > 0 else fold(("neg", terms[0][1]), compare)
+        return ("add", tuple(terms))
+
+    if kind == "mul":
+        factors = []
+        coefficient = 1.
+        for (power, factor) in node[1]:
+            factor = fold(factor, compare)
+            while factor[0] == "neg":
+                coefficient = -coefficient
+                factor = factor[1]
+            if factor[0] == "mul":
+                for (p, f) in factor[1]:
+                    if f[0] == "num":
+                        coefficient = coefficient * f[1] if p * power > 0 else coefficient / f[1]
+                    else:
+                        factors.append((p * power, f))
+            elif factor[0] == "num":
+                coefficient = coefficient * factor[1] if power > 0 else coefficient / factor[1]
+            else:
+                factors.append((power, factor))
+        if compare:
+            # comparisons are 0 or 1: c*c -> c
+            unique = []
+            for (power, factor) in factors:
+                if power > 0 and factor[0] == "cmp" and (power, factor) in unique:
+                    continue
+                unique.append((power, factor))
+            factors = unique
+        if coefficient == 0. or not factors:
+            return num(coefficient)
+        if abs(coefficient) != 1.:
+            factors.insert(0, (1, num(abs(coefficient))))
+        res = factors[0][1] if len(factors) == 1 and factors[0][0] > 0 else ("mul", tuple(factors))
+        return res if coefficient > 0 else ("neg", res)
+
+    if kind == "pow":
+        (a, b) = (fold(node[1], compare), fold(node[2], compare))
+        if b[0] == "num" and b[1] == 1.:
+            return a
+        if a[0] == "num" and b[0] == "num":
+            try:
+                return num(math.pow(a[1], b[1]))
+            except (ValueError, OverflowError):
+                pass
+        return ("pow", a, b)
+
+    if kind == "cmp":
+        (op, a, b) = (node[1], fold(node[2], compare), fold(node[3], compare))
+        if a[0] == "num" and b[0] == "num":
+            return num(1. if comparisons[op](a[1], b[1]) else 0.)
+        if compare and op in [">", ">="]:
+            (op, a, b) = (swapped[op], b, a)
+        return ("cmp", op, a, b)
+
+    if kind == "call":
+        args = tuple(fold(arg, compare) for arg in node[2])
+        if all(arg[0] == "num" for arg in args):
+            try:
+                return num(float(functions[node[1]](*[arg[1] for arg in args])))
+            except (ValueError, OverflowError, ZeroDivisionError):
+                pass
+        return ("call", node[1], args)
+
+    if kind == "vec":
+        return ("vec", tuple(fold(item, compare) for item in node[1]))
+    raise ExpressionError("unknown node %s" % kind)
+
+
+def hoist(node, parameters, hoisted: Dict, reserved):
+    """
+    Return node with its largest subexpressions only depending on parameters
+    replaced by new symbols (recorded in hoisted: subexpression -> name)
+
+    the operands of a sum (or a product) only depending on parameters are
+    grouped before being hoisted
+    """
+    def invariant(node):
+        names = symbols(node)
+        return node[0] != "vec" and len(names) > 0 and all(name in parameters for name in names)
+
+    def name(node):
+        if not node in hoisted:
+            i = len(hoisted)
+            while "cse%d" % i in reserved or "cse%d" % i in hoisted.values():
+                i += 1
+            hoisted[node] = "cse%d" % i
+        return ("sym", hoisted[node])
+
+    kind = node[0]
+    if kind in ["num", "sym"]:
+        return node
+    if invariant(node):
+        return name(node)
+    if kind in ["add", "mul"]:
+        group = tuple((s, child) for (s, child) in node[1] if invariant(child))
+        rest = tuple((s, hoist(child, parameters, hoisted, reserved)) for (s, child) in node[1] if not invariant(child))
+        if len(group) > 1:
+            return (kind, ((1, name((kind, group))),) + rest)
+        return (kind, tuple((s, hoist(child, parameters, hoisted, reserved)) for (s, child) in node[1]))
+    if kind == "neg":
+        return ("neg", hoist(node[1], parameters, hoisted, reserved))
+    if kind == "pow":
+        return ("pow", hoist(node[1], parameters, hoisted, reserved), hoist(node[2], parameters, hoisted, reserved))
+    if kind == "cmp":
+        return ("cmp", node[1], hoist(node[2], parameters, hoisted, reserved),
+                hoist(node[3], parameters, hoisted, reserved))
+    return (kind,) + node[1:-1] + (tuple(hoist(child, parameters, hoisted, reserved) for child in node[-1]),)
+
+
+def split_expr(text: str):
+    """
+    Return the expression and the symbols of a Feel++ expression string
+    """
+    items = text.split(":")
+    return (items[0], items[1:])
+
+
+def join_expr(expr: str, names: List[str]):
+    return ":".join([expr] + names)
+
+
+def equivalent(a, b, names: List[str], env: Dict = {}, points: int = 8, seed: int = 0, rtol: float = 1.e-9):
+    """
+    Check that a and b evaluate to the same values at random points
+    """
+    rng = random.Random(seed)
+    for i in range(points):
+        values = dict(env)
+        for name in names:
+            if not name in values:
+                values[name] = rng.uniform(1., 2.)
+        try:
+            va = evaluate(a, values)
+        except (ValueError, ZeroDivisionError, OverflowError):
+            continue
+        try:
+            vb = evaluate(b, values)
+        except (ValueError, ZeroDivisionError, OverflowError, KeyError):
+            return False
+        for (x, y) in zip(va if isinstance(va, tuple) else [va], vb if isinstance(vb, tuple) else [vb]):
+            if not math.isclose(x, y, rel_tol=rtol, abs_tol=rtol * 1.e-3):
+                return False
+    return True
+
+
+def _walk(data):
+    """
+    yield (container, key) of the expression strings of data
+
+    markers and index ranges (eg. "index1": "0:6") are skipped
+    """
+    items = data.items() if isinstance(data, dict) else enumerate(data) if isinstance(data, list) else []
+    for (key, value) in items:
+        if isinstance(key, str) and (key == "markers" or key.startswith("index")):
+            continue
+        if isinstance(value, str):
+            if ":" in value:
+                yield (data, key)
+        else:
+            yield from _walk(value)
+
+
+def optimize_model(model: dict, constants: List[str] = [], passes: List[str] = passes, debug: bool = False):
+    """
+    Optimize the expressions of the json model (in place)
+
+    constants: Parameters whose values may be folded into the expressions
+
+    returns statistics of the optimization
+    """
+    stats = {"expressions": 0, "rewritten": 0, "symbols_dropped": 0, "parameters_added": 0, "rejected": 0}
+    parameters = model.get("Parameters", {})
+
+    values = {}
+    for name in constants:
+        if not name in parameters:
+            raise ValueError("%s: no such parameter" % name)
+        try:
+            value = fold(parse(split_expr(str(parameters[name]))[0]))
+        except ExpressionError as e:
+            raise ValueError("parameter %s: %s" % (name, e))
+        if value[0] != "num":
+            raise ValueError("parameter %s is not a constant: %s" % (name, parameters[name]))
+        values[name] = value
+    env = {name: value[1] for (name, value) in values.items()}
+
+    # parse and fold
+    exprs = []
+    for (container, key) in _walk(model):
+        (text, names) = split_expr(container[key])
+        try:
+            original = parse(text)
+        except ExpressionError as e:
+            if debug:
+                print("optimize/skip %s: %s" % (container[key], e))
+            continue
+        node = original
+        if "fold" in passes:
+            node = substitute(node, values)
+        if "fold" in passes or "compare" in passes:
+            node = fold(node, "compare" in passes)
+        exprs.append([container, key, original, node, names, container is parameters])
+    stats["expressions"] = len(exprs)
+
+    # hoist the subexpressions only depending on Parameters
+    hoisted = {}
+    if "cse" in passes:
+        known = set(parameters) - set(constants)
+        for expr in exprs:
+            if not expr[5]:
+                expr[3] = hoist(expr[3], known, hoisted, parameters)
+
+    # check and write back
+    definitions = {name: sub for (sub, name) in hoisted.items()}
+    used = set()
+    for (container, key, original, node, names, is_parameter) in exprs:
+        cse_names = [name for name in symbols(node) if name in definitions]
+        if node != original:
+            # hoisted parameters are evaluated from their definitions
+            check = substitute(node, {name: definitions[name] for name in cse_names})
+            if not equivalent(original, check, symbols(original), env):
+                stats["rejected"] += 1
+                if debug:
+                    print("optimize/reject %s -> %s" % (container[key], to_string(node)))
+                continue
+            text = to_string(node)
+        else:
+            text = split_expr(container[key])[0]
+
+        # entries that are not symbols (eg. "Zmin%1%,Zmax%1%") are kept
+        new_names = [name for name in names
+                     if not "prune" in passes or name in symbols(node) or not identifier.match(name)]
+        new_names += [name for name in cse_names if not name in new_names]
+        undeclared = [name for name in symbols(node) if not name in new_names and not name in builtins]
+        if undeclared and (node != original or new_names != names):
+            stats["rejected"] += 1
+            if debug:
+                print("optimize/reject %s: %s not declared" % (container[key], ", ".join(undeclared)))
+            continue
+        used.update(cse_names)
+
+        if node != original or new_names != names:
+            if debug:
+                print("optimize/%s -> %s" % (container[key], join_expr(text, new_names)))
+            stats["rewritten"] += 1
+            stats["symbols_dropped"] += len([name for name in names if not name in new_names])
+            container[key] = join_expr(text, new_names)
+
+    for (sub, name) in hoisted.items():
+        if name in used:
+            parameters[name] = join_expr(to_string(sub), symbols(sub))
+            stats["parameters_added"] += 1
+    return stats
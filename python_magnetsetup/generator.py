@@ -0,0 +1,101 @@
+"""
+In-process setup generation
+
+SetupGenerator holds the app config and the loaded templates so that
+setups can be generated repeatedly (eg. from a service) without
+spawning a new interpreter, changing the working directory or parsing
+command line arguments.
+
+ex:
+generator = SetupGenerator()
+setup = generator.generate(["cfpdes", "static", "Axi", "thelec", "mean"], False, confdata, cad)
+setup["cfg"], setup["model"], setup["materials"]
+generator.write(setup, "/path/to/output")
+"""
+
+from typing import Dict, List, Optional
+
+import threading
+
+from .setup import appenv, loadconfig, loadtemplates, convert_data, load_geometry
+from .setup import setup_name, setup_data, write_setup
+from . import units
+
+
+class SetupGenerator():
+    """
+    Generate setups in memory
+
+    MyEnv: app settings (default: appenv())
+    AppCfg: app config (default: loadconfig())
+    distance_unit: unit used in generated setups
+
+    A generator may be shared between threads.
+    """
+
+    def __init__(self, MyEnv: Optional[appenv] = None, AppCfg: Optional[dict] = None,
+                 distance_unit: str = "meter", debug: bool = False):
+        self.env = MyEnv if MyEnv is not None else appenv()
+        self.appcfg = AppCfg if AppCfg is not None else loadconfig()
+        self.distance_unit = distance_unit
+        self.debug = debug
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def templates(self, method_data: List[str], nonlinear: bool):
+        """
+        returns templates for method_data, loaded on first call
+        """
+        key = (tuple(method_data), nonlinear)
+        with self._lock:
+            if not key in self._templates:
+                self._templates[key] = loadtemplates(self.env, self.appcfg, method_data, (not nonlinear), self.debug)
+            return self._templates[key]
+
+    def generate(self, method_data: List[str], nonlinear: bool, confdata: dict, cad,
+                 yamlfile: Optional[str] = None, basename: Optional[str] = None, gdata: Optional[tuple] = None,
+                 h: float = units.h, mu0: float = units.mu0, suffix: str = "",
+                 distance_unit: Optional[str] = None, shared: bool = False,
+                 optimize: Optional[List[str]] = None, constants: Optional[List[str]] = None, production: bool = False,
+                 np: Optional[int] = None, init: Optional[Dict[str, str]] = None, basedir: str = "",
+                 dofs: Optional[int] = None):
+        """
+        returns the setup (see setup_data) of insert cad for method_data
+
+        confdata: insert data (see load_object)
+        cad: Insert object
+        yamlfile: name of the insert yaml file (default: cad.name + ".yaml")
+        basename: basename of the setup files (default: cad.name)
+        gdata: insert characteristics (default: computed from yamlfile, see load_geometry)
+        h, mu0: in SI units
+        distance_unit: unit used in the setup (default: self.distance_unit)
+        shared: define one material per helix in Axi (see create_materials)
+        optimize, constants: expressions optimization (see setup_data)
+        production: solver options without monitors (see solver_data)
+        np: number of MPI processes (see resources.estimate)
+        init: init files of the fields (see warmstart)
+        basedir: directory of the insert yaml files
+        dofs: number of dofs for the choice of the solver (see resources.estimate)
+        """
+        if yamlfile is None:
+            yamlfile = cad.name + ".yaml"
+        if basename is None:
+            basename = cad.name
+        if gdata is None:
+            (_, gdata, insulators) = load_geometry(yamlfile, method_data[2], basedir, self.debug)
+
+        if distance_unit is None:
+            distance_unit = self.distance_unit
+        confdata, gdata, h, mu0 = convert_data(distance_unit, confdata, gdata, h, mu0)
+        jsonfile = setup_name(basename, method_data, nonlinear, suffix)
+        templates = self.templates(method_data, nonlinear)
+        return setup_data(self.env, self.appcfg, method_data, nonlinear, cad, yamlfile, gdata, confdata, h, mu0,
+                          jsonfile, templates, self.debug, shared, optimize, constants, production, np, init, dofs)
+
+    def write(self, setup: dict, outdir: str, compact: bool = False):
+        """
+        write setup files in outdir
+
+        returns the list of created files
+        """
+        return write_setup(setup, outdir, compact, self.debug)
@@ -0,0 +1,162 @@
+"""
+Loading of insert geometries
+
+Yaml files are parsed with the libyaml based loader when available.
+The helices yaml files (needed in 3D for the insulators) are parsed
+concurrently.
+
+The loaded geometry (cad, gdata, insulators) is stored in an on-disk
+cache keyed by the content of the insert yaml file and checked against
+the content of the helices, rings and leads yaml files. Repeated runs
+on the same geometry skip parsing and get_main_characteristics.
+"""
+
+from typing import List, Optional
+
+import os
+import copy
+import pickle
+import hashlib
+import threading
+
+_loader = None
+_lock = threading.Lock()
+
+
+def yaml_loader():
+    """
+    Return the yaml loader for python_magnetgeo objects
+
+    CFullLoader (libyaml) with the constructors registered on FullLoader
+    if available, FullLoader otherwise
+    """
+    global _loader
+    import yaml
+
+    with _lock:
+        if _loader is None:
+            if hasattr(yaml, "CFullLoader"):
+                class Loader(yaml.CFullLoader):
+                    pass
+                # python_magnetgeo objects register their constructors on FullLoader
+                Loader.yaml_constructors = dict(yaml.CFullLoader.yaml_constructors)
+                Loader.yaml_constructors.update(yaml.FullLoader.yaml_constructors)
+                Loader.yaml_multi_constructors = dict(yaml.CFullLoader.yaml_multi_constructors)
+                Loader.yaml_multi_constructors.update(yaml.FullLoader.yaml_multi_constructors)
+                _loader = Loader
+            else:
+                _loader = yaml.FullLoader
+    return _loader
+
+
+def load_yaml(filename: str):
+    """
+    Return object defined in yaml filename
+    """
+    import yaml
+
+    with open(filename, "r") as f:
+        return yaml.load(f, Loader=yaml_loader())
+
+
+def load_insulators(cad, basedir: str = "", workers: int = 8):
+    """
+    Return the insulators of the helices of cad
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = [os.path.join(basedir, helix + ".yaml") for helix in cad.Helices]
+    if len(files) <= 1:
+        helices = [load_yaml(f) for f in files]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            helices = list(pool.map(load_yaml, files))
+    return [helix.insulators() for helix in helices]
+
+
+def main_characteristics(cad, basedir: str = ""):
+    """
+    Return the main characteristics (gdata tuple) of cad, its parts yaml files being in basedir
+
+    python_magnetgeo reads the parts yaml files (<name>.yaml) relative to the
+    working directory: it is given a copy of cad with absolute part names
+    instead of changing the working directory of the process
+    """
+    from python_magnetgeo import python_magnetgeo
+
+    cad = copy.copy(cad)
+    for parts in ["Helices", "Rings", "CurrentLeads"]:
+        names = getattr(cad, parts, None)
+        if isinstance(names, list):
+            setattr(cad, parts, [os.path.abspath(os.path.join(basedir, name)) if isinstance(name, str) else name
+                                 for name in names])
+    return python_magnetgeo.get_main_characteristics(cad)
+
+
+def file_digest(filename: str):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def default_cache_dir():
+    """
+    returns default location of the geometry cache
+    """
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "magnetsetup", "geometry")
+
+
+class GeometryDiskCache():
+    """
+    On-disk cache of loaded geometries
+
+    cache_dir: cache location (default: see default_cache_dir)
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, debug: bool = False):
+        self.cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.debug = debug
+
+    def _cache_file(self, yamlfile: str, geom: str, basedir: str = ""):
+        key = hashlib.sha256((file_digest(os.path.join(basedir, yamlfile)) + geom).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def get(self, yamlfile: str, geom: str, basedir: str = ""):
+        """
+        returns (cad, gdata, insulators) if cached and unchanged, None otherwise
+        """
+        try:
+            with open(self._cache_file(yamlfile, geom, basedir), "rb") as f:
+                entry = pickle.load(f)
+            for (filename, digest) in entry["files"].items():
+                if file_digest(os.path.join(basedir, filename)) != digest:
+                    if self.debug:
+                        print("geometry cache/%s changed" % filename)
+                    return None
+        except (OSError, EOFError, KeyError, AttributeError, ImportError, pickle.UnpicklingError):
+            return None
+
+        if self.debug:
+            print("geometry cache/restore %s (%s)" % (yamlfile, geom))
+        return entry["data"]
+
+    def put(self, yamlfile: str, geom: str, data: tuple, files: List[str], basedir: str = ""):
+        """
+        store data of yamlfile, files being the yaml files it depends on
+        """
+        entry = {"files": {f: file_digest(os.path.join(basedir, f)) for f in files}, "data": data}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cfile = self._cache_file(yamlfile, geom, basedir)
+        tmp = "%s.%d.%d" % (cfile, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(entry, f)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            if self.debug:
+                print("geometry cache/cannot store %s: %s" % (yamlfile, e))
+            os.unlink(tmp)
+            return
+        os.replace(tmp, cfile)
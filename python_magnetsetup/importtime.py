@@ -0,0 +1,72 @@
+"""
+Check the cold start import time of the setup CLI
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter
+and fails when the cumulative import time of the module is over budget,
+or when a heavy dependency is imported at startup.
+
+ex:
+python -m python_magnetsetup.importtime --budget 0.15
+"""
+
+from typing import List
+
+import os
+import sys
+import subprocess
+
+# dependencies only loaded on the code paths that need them
+heavy_modules = ["yaml", "pint", "numpy", "requests", "python_magnetgeo"]
+
+
+def importtime(module: str = "python_magnetsetup.setup"):
+    """
+    Return the cumulative import times (in s) of module and its dependencies
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+    if proc.returncode:
+        raise RuntimeError("failed to import %s:\n%s" % (module, proc.stderr))
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        (self_us, cumulative, name) = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) * 1.e-6
+    return times
+
+
+def check(module: str = "python_magnetsetup.setup", budget: float = 0.15, forbidden: List[str] = heavy_modules):
+    """
+    Return the list of violations of the import budget
+    """
+    times = importtime(module)
+    errors = []
+    if times[module] > budget:
+        errors.append("import %s took %.3f s (budget %.3f s)" % (module, times[module], budget))
+    for name in forbidden:
+        if name in times:
+            errors.append("import %s loads %s" % (module, name))
+    return (times[module], errors)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check cold start import time of python_magnetsetup")
+    parser.add_argument("--module", help="module to import", type=str, default="python_magnetsetup.setup")
+    parser.add_argument("--budget", help="import time budget in s", type=float, default=0.15)
+    args = parser.parse_args()
+
+    (elapsed, errors) = check(args.module, args.budget)
+    print("import %s: %.3f s (budget %.3f s)" % (args.module, elapsed, args.budget))
+    for error in errors:
+        print("ERROR:", error)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
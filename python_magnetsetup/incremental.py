@@ -0,0 +1,225 @@
+"""
+Incremental regeneration of a setup
+
+Each part of the setup records a digest of what it is rendered from
+(templates contents and input data):
+
+* cfg: the cfg template and its data
+* model: the json model template and its data (Parameters, BoundaryConditions
+  with the cooling template...)
+* Materials: the conductor and insulator templates and the insert materials
+* Flux, Stats_T, Stats_Power: the post-processing templates and their data
+* the material files: their source files
+
+Digests are stored next to the setup in <jsonfile>.deps. On the next run
+only the stale parts are rendered again; the other ones are taken from
+the existing json model, so the result is the same as a full regeneration.
+
+In watch mode, the datafile, the insert yaml files and the template tree
+are polled and the setup is updated on change:
+
+python -m python_magnetsetup.setup --datafile HL-34-data.json --model thelec --watch
+"""
+
+from typing import Callable, Dict, List, Optional
+
+import os
+import json
+import time
+import hashlib
+from collections.abc import Mapping
+from shutil import copyfile
+
+from . import jsonwriter
+from .geometry import file_digest
+from .setup import loadtemplates, setup_inputs, create_materials, render_cfg, material_files, entry
+from .setup import post_sections, render_post, add_materials, add_post
+from .solver import solver_data
+from .profiling import profiled, stage
+
+
+def _default(o):
+    if isinstance(o, Mapping):
+        return dict(o)
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    return repr(o)
+
+
+def digest(*items):
+    """
+    Return the digest of items (template files and json-like data)
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(items, sort_keys=True, default=_default).encode())
+    return sha.hexdigest()
+
+
+def load_state(wd: str, jsonfile: str):
+    """
+    Return the recorded digests of the setup, None if missing
+    """
+    try:
+        with open(os.path.join(wd, jsonfile + ".deps"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(wd: str, jsonfile: str, state: dict):
+    with open(os.path.join(wd, jsonfile + ".deps"), "w") as f:
+        json.dump(state, f, indent=4)
+
+
+@profiled()
+def update_setup(MyEnv, AppCfg: dict, method_data: List[str], nonlinear: bool,
+                 cad, yamlfile: str, gdata: tuple, confdata: dict, h: float, mu0: float,
+                 jsonfile: str, wd: str = "", templates: Optional[dict] = None, compact: bool = False,
+                 shared: bool = False, production: bool = False, np: Optional[int] = None,
+                 init: Optional[Dict[str, str]] = None, dofs: Optional[int] = None, debug: bool = False):
+    """
+    Create or update the setup in wd, rendering only the stale parts
+
+    gdata, confdata, h and mu0 are expected to be already converted
+    (see convert_data)
+
+    returns the list of updated files and the list of stale parts
+    """
+    if templates is None:
+        templates = loadtemplates(MyEnv, AppCfg, method_data, (not nonlinear), debug)
+
+    with stage("digests"):
+        (markers, mdict, mpost) = setup_inputs(cad, gdata, confdata, h, mu0, templates, method_data, debug, init)
+        cfgfile = jsonfile.replace(".json", ".cfg")
+        name = yamlfile.replace(".yaml","")
+        idata = markers["index_Insulators"]
+        [method, time, geom, model, cooling] = method_data
+        solver = solver_data(method_data, nonlinear, gdata, AppCfg[method][time][geom][model].get("solver", {}),
+                             production, dofs, debug)
+        parts = {
+            "cfg": digest(file_digest(templates["cfg"]), name, nonlinear, jsonfile, method_data, solver, np),
+            "model": digest(file_digest(templates["model"]), mdict),
+            "Materials": digest(file_digest(templates["conductor"]), file_digest(templates["insulator"]),
+                                method_data, gdata[0], gdata[1], gdata[3], idata, shared,
+                                [confdata[key] for key in ["Helix", "Ring", "Lead"] if key in confdata]),
+            "json": digest(compact),
+        }
+        posts = post_sections(mpost, templates, method_data)
+        for (pname, section, template, rdata) in posts:
+            parts[pname] = digest(file_digest(template), section, rdata)
+        materials = material_files(MyEnv, AppCfg, method_data, templates, debug)
+        sources = {dst: file_digest(src) for (src, dst) in materials}
+
+    state = load_state(wd, jsonfile)
+    if state is not None and not os.path.isfile(os.path.join(wd, jsonfile)):
+        state = None
+    recorded = state["parts"] if state is not None else {}
+    stale = [part for part in parts if recorded.get(part) != parts[part]]
+    copied = state.get("files", {}) if state is not None else {}
+    if debug:
+        print("incremental/%s stale: %s" % (jsonfile, stale))
+
+    files = []
+    if "cfg" in stale or not os.path.isfile(os.path.join(wd, cfgfile)):
+        print("create_cfg %s from %s" % (cfgfile, templates["cfg"]) )
+        with stage("write_cfg"), open(os.path.join(wd, cfgfile), "w") as out:
+            out.write(render_cfg(name, nonlinear, jsonfile, templates["cfg"], method_data, debug, solver, np))
+        files.append(cfgfile)
+
+    if [part for part in stale if part != "cfg"]:
+        print("update_json =", jsonfile)
+        old = None
+        if state is not None and [part for part in parts if part != "cfg" and not part in stale]:
+            with stage("load_json"), open(os.path.join(wd, jsonfile), "r") as f:
+                old = json.load(f)
+
+        # keep the fresh parts of the existing model
+        if old is None or "Materials" in stale:
+            mmat = create_materials(gdata, idata, confdata, templates, method_data, debug, shared)
+        else:
+            mmat = {key: old["Materials"][key] for key in state["materials"]}
+        stats = {}
+        for (pname, section, template, rdata) in posts:
+            if old is None or pname in stale:
+                stats[pname] = render_post(pname, template, rdata, debug)
+            else:
+                ostats = old["PostProcess"][section]["Measures"]["Statistics"]
+                stats[pname] = {key: ostats[key] for key in state["post"][pname]}
+
+        if old is None or "model" in stale:
+            data = entry(templates["model"], mdict, debug)
+        else:
+            data = old
+            for key in state["materials"]:
+                del data["Materials"][key]
+            for (pname, section, template, rdata) in posts:
+                for key in state["post"][pname]:
+                    del data["PostProcess"][section]["Measures"]["Statistics"][key]
+
+        add_materials(data, mmat)
+        for (pname, section, template, rdata) in posts:
+            add_post(data, section, stats[pname])
+        with stage("write_json"):
+            jsonwriter.write(os.path.join(wd, jsonfile), data, compact, debug)
+        files.append(jsonfile)
+
+        state = {"materials": list(mmat), "post": {pname: list(stats[pname]) for pname in stats}}
+    state["parts"] = parts
+
+    # copy some additional json file
+    with stage("copy_materials"):
+        for (src, dst) in materials:
+            if copied.get(dst) != sources[dst] or not os.path.isfile(os.path.join(wd, dst)):
+                copyfile(src, os.path.join(wd, dst))
+                files.append(dst)
+    state["files"] = sources
+
+    save_state(wd, jsonfile, state)
+    return (files, stale)
+
+
+def snapshot(paths: List[str]):
+    """
+    Return the mtimes of the files in paths (files or directories)
+    """
+    mtimes = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for (root, dirs, filenames) in os.walk(path):
+                for filename in filenames:
+                    filename = os.path.join(root, filename)
+                    try:
+                        mtimes[filename] = os.stat(filename).st_mtime_ns
+                    except OSError:
+                        pass
+        else:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+    return mtimes
+
+
+def watch(paths: Callable[[], List[str]], update: Callable[[], None], interval: float = 1.):
+    """
+    Call update each time a file of paths changes (polled every interval s)
+
+    paths returns the files and directories to watch, evaluated after
+    each update. Errors of update are printed and watching goes on.
+    Stops on KeyboardInterrupt.
+    """
+    previous = snapshot(paths())
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot(paths())
+            if current != previous:
+                changed = sorted(f for f in set(current) | set(previous) if current.get(f) != previous.get(f))
+                print("\n=== changed: %s ===" % ", ".join(changed))
+                try:
+                    update()
+                except (Exception, SystemExit) as e:
+                    print("update failed: %s: %s" % (type(e).__name__, e))
+                previous = current
+    except KeyboardInterrupt:
+        print("watch stopped")
@@ -0,0 +1,346 @@
+"""
+Structured rendering of json mustache templates
+
+A json mustache template (see templates/<method>/<geom>/<model>/*.mustache)
+is parsed once into a tree of nodes. Rendering substitutes the placeholders
+directly into python objects, so that no intermediate text is produced:
+
+* "{{key}}" inside a string is replaced by str(value),
+* {{key}} in place of a json value is replaced by the value itself,
+* {{#key}}...{{/key}} sections expand object members or array items.
+
+As in the json loader used by entry(), trailing commas are tolerated.
+"""
+
+from typing import List
+
+import json
+
+from .cache import template_cache, tokenize
+
+# placeholders are swapped for private use characters while parsing
+_OPEN = "\ue000"
+_CLOSE = "\ue001"
+
+_WHITESPACE = " \t\n\r"
+
+
+class TemplateSyntaxError(Exception):
+    """
+    Raised when a template cannot be parsed as a json tree
+    """
+    pass
+
+
+def _lookup(key: str, scopes: List):
+    """
+    Find key in scopes, following mustache rules
+    """
+    if key == ".":
+        return scopes[0]
+
+    parts = key.split(".")
+    for scope in scopes:
+        if isinstance(scope, dict) and parts[0] in scope:
+            value = scope[parts[0]]
+        elif not isinstance(scope, dict) and hasattr(scope, parts[0]):
+            value = getattr(scope, parts[0])
+        else:
+            continue
+
+        for part in parts[1:]:
+            if isinstance(value, dict):
+                value = value.get(part, "")
+            else:
+                value = getattr(value, part, "")
+        return value
+    return ""
+
+
+def _section_scopes(value, scopes: List, inverted: bool):
+    """
+    Return the list of scopes a section is rendered with
+    """
+    if inverted:
+        return [scopes] if not value or (isinstance(value, list) and not len(value)) else []
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [[item] + scopes for item in value]
+    return [[value] + scopes]
+
+
+class Const():
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+    def render(self, scopes: List):
+        return self.value
+
+
+class Var():
+    """
+    {{key}} used as a json value
+    """
+    __slots__ = ["key"]
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def render(self, scopes: List):
+        return _lookup(self.key, scopes)
+
+
+class Str():
+    """
+    json string holding {{key}} placeholders
+
+    parts is a list of (literal, key) pairs
+    """
+    __slots__ = ["parts"]
+
+    def __init__(self, parts: List):
+        self.parts = parts
+
+    def render(self, scopes: List):
+        out = ""
+        for (literal, key) in self.parts:
+            if key is None:
+                out += literal
+            else:
+                out += str(_lookup(key, scopes))
+        return out
+
+
+class Section():
+    """
+    {{#key}} or {{^key}} block of object members or array items
+    """
+    __slots__ = ["key", "inverted", "items"]
+
+    def __init__(self, key: str, inverted: bool, items: List):
+        self.key = key
+        self.inverted = inverted
+        self.items = items
+
+
+class Obj():
+    __slots__ = ["members"]
+
+    def __init__(self, members: List):
+        self.members = members
+
+    def fill(self, out: dict, members: List, scopes: List):
+        for member in members:
+            if isinstance(member, Section):
+                value = _lookup(member.key, scopes)
+                for sscopes in _section_scopes(value, scopes, member.inverted):
+                    self.fill(out, member.items, sscopes)
+            else:
+                (key, value) = member
+                out[key.render(scopes)] = value.render(scopes)
+
+    def render(self, scopes: List):
+        out = {}
+        self.fill(out, self.members, scopes)
+        return out
+
+
+class Arr():
+    __slots__ = ["items"]
+
+    def __init__(self, items: List):
+        self.items = items
+
+    def fill(self, out: list, items: List, scopes: List):
+        for item in items:
+            if isinstance(item, Section):
+                value = _lookup(item.key, scopes)
+                for sscopes in _section_scopes(value, scopes, item.inverted):
+                    self.fill(out, item.items, sscopes)
+            else:
+                out.append(item.render(scopes))
+
+    def render(self, scopes: List):
+        out = []
+        self.fill(out, self.items, scopes)
+        return out
+
+
+class _Parser():
+    """
+    Recursive descent json parser aware of mustache placeholders
+    """
+
+    def __init__(self, text: str):
+        self.tags = []
+        chunks = []
+        for (tag, key) in tokenize(text):
+            if tag == "literal":
+                chunks.append(key)
+            elif tag in ["variable", "no escape", "section", "inverted section", "end"]:
+                chunks.append("%s%d%s" % (_OPEN, len(self.tags), _CLOSE))
+                self.tags.append((tag, key))
+            elif tag == "comment":
+                continue
+            else:
+                raise TemplateSyntaxError("unsupported mustache tag: %s" % tag)
+        self.src = "".join(chunks)
+        self.pos = 0
+
+    def error(self, msg: str):
+        line = self.src.count("\n", 0, self.pos) + 1
+        return TemplateSyntaxError("%s at line %d" % (msg, line))
+
+    def skip(self, commas: bool = False):
+        seps = _WHITESPACE + "," if commas else _WHITESPACE
+        while self.pos < len(self.src) and self.src[self.pos] in seps:
+            self.pos += 1
+
+    def peek(self):
+        if self.pos >= len(self.src):
+            raise self.error("unexpected end of template")
+        return self.src[self.pos]
+
+    def tag(self):
+        end = self.src.index(_CLOSE, self.pos)
+        tag = self.tags[int(self.src[self.pos+1:end])]
+        self.pos = end + 1
+        return tag
+
+    def parse(self):
+        self.skip()
+        node = self.value()
+        self.skip()
+        if self.pos != len(self.src):
+            raise self.error("trailing data")
+        return node
+
+    def value(self):
+        c = self.peek()
+        if c == "{":
+            self.pos += 1
+            return Obj(self.block("}", self.member))
+        if c == "[":
+            self.pos += 1
+            return Arr(self.block("]", self.value))
+        if c == '"':
+            return self.string()
+        if c == _OPEN:
+            (tag, key) = self.tag()
+            if tag not in ["variable", "no escape"]:
+                raise self.error("unexpected section %s" % key)
+            return Var(key)
+        return self.scalar()
+
+    def block(self, closing: str, item, section: str = None):
+        """
+        Parse items up to closing char (or section end)
+        """
+        items = []
+        while True:
+            self.skip(commas=True)
+            c = self.peek()
+            if section is None and c == closing:
+                self.pos += 1
+                return items
+            if c == _OPEN:
+                start = self.pos
+                (tag, key) = self.tag()
+                if tag in ["section", "inverted section"]:
+                    items.append(Section(key, tag == "inverted section", self.block(closing, item, key)))
+                    continue
+                if tag == "end":
+                    if key != section:
+                        raise self.error("unbalanced section %s" % key)
+                    return items
+                self.pos = start
+            items.append(item())
+
+    def member(self):
+        key = self.string()
+        self.skip()
+        if self.peek() != ":":
+            raise self.error("expected ':'")
+        self.pos += 1
+        self.skip()
+        return (key, self.value())
+
+    def string(self):
+        if self.peek() != '"':
+            raise self.error("expected string")
+        self.pos += 1
+        parts = []
+        start = self.pos
+        while True:
+            c = self.peek()
+            if c == '"' or c == _OPEN:
+                # decode escapes of the literal part with json
+                raw = self.src[start:self.pos]
+                if raw:
+                    try:
+                        parts.append((json.loads('"' + raw + '"'), None))
+                    except json.JSONDecodeError as e:
+                        raise self.error("invalid string (%s)" % e.msg)
+                if c == '"':
+                    self.pos += 1
+                    break
+                (tag, key) = self.tag()
+                if tag not in ["variable", "no escape"]:
+                    raise self.error("unexpected section %s in string" % key)
+                parts.append(("", key))
+                start = self.pos
+            elif c == "\\":
+                self.pos += 2
+            else:
+                self.pos += 1
+
+        if all(key is None for (literal, key) in parts):
+            return Const("".join(literal for (literal, key) in parts))
+        return Str(parts)
+
+    def scalar(self):
+        start = self.pos
+        while self.pos < len(self.src) and self.src[self.pos] not in _WHITESPACE + ",]}" + _OPEN:
+            self.pos += 1
+        raw = self.src[start:self.pos]
+        try:
+            return Const(json.loads(raw))
+        except json.JSONDecodeError:
+            self.pos = start
+            raise self.error("invalid value %r" % raw)
+
+
+
+class JsonTemplate():
+    """
+    Compiled json mustache template
+    """
+
+    def __init__(self, text: str):
+        self.tree = None
+        self.error = None
+        try:
+            self.tree = _Parser(text).parse()
+        except TemplateSyntaxError as e:
+            self.error = e
+
+    def render(self, rdata: dict):
+        """
+        Return python object for rdata
+        """
+        if self.error:
+            raise self.error
+        return self.tree.render([rdata])
+
+
+def render(template: str, rdata: dict, debug: bool = False):
+    """
+    Render a json mustache template file as a python object
+
+    Raise TemplateSyntaxError if template is not a json tree
+    """
+    compiled = template_cache.get(template, JsonTemplate, debug)
+    return compiled.render(rdata)
@@ -0,0 +1,89 @@
+"""
+Streaming writer for json model files
+
+The model is written one top-level section (Parameters, Materials,
+BoundaryConditions, PostProcess...) at a time, each section being
+encoded in chunks straight to the file. The whole document is never
+held as a single string.
+
+Pretty output (indent=4) is identical to json.dumps(data, indent=4).
+Compact output has no indentation nor spaces; when orjson is installed
+it is used to encode the sections.
+"""
+
+from typing import Optional
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dump_section(out, value, indent: Optional[int] = 4, level: int = 1):
+    """
+    Write json encoding of value to out, nested at level
+    """
+    if indent is None:
+        encoder = json.JSONEncoder(separators=(",", ":"))
+        for chunk in encoder.iterencode(value):
+            out.write(chunk)
+        return
+
+    # newlines only appear in separators since strings are escaped
+    prefix = "\n" + " " * (indent * level)
+    encoder = json.JSONEncoder(indent=indent)
+    for chunk in encoder.iterencode(value):
+        out.write(chunk.replace("\n", prefix))
+
+
+def dump(data: dict, out, compact: bool = False):
+    """
+    Write data to out (a text file) one section at a time
+    """
+    indent = None if compact else 4
+    sep = "," if compact else ",\n" + " " * indent
+    key_sep = ":" if compact else ": "
+
+    if not data:
+        out.write("{}")
+        return
+
+    out.write("{" if compact else "{\n" + " " * indent)
+    for (i, (key, value)) in enumerate(data.items()):
+        if i:
+            out.write(sep)
+        out.write(json.dumps(key) + key_sep)
+        dump_section(out, value, indent)
+    out.write("}" if compact else "\n}")
+
+
+def dump_orjson(data: dict, out):
+    """
+    Write data to out (a binary file) in compact form using orjson
+    """
+    out.write(b"{")
+    for (i, (key, value)) in enumerate(data.items()):
+        if i:
+            out.write(b",")
+        out.write(orjson.dumps(key) + b":")
+        out.write(orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY))
+    out.write(b"}")
+
+
+def write(filename: str, data: dict, compact: bool = False, debug: bool = False):
+    """
+    Write data to json filename
+    """
+    if compact and orjson is not None:
+        if debug:
+            print("jsonwriter/write %s (orjson)" % filename)
+        with open(filename, "wb") as out:
+            dump_orjson(data, out)
+        return
+
+    if debug:
+        print("jsonwriter/write %s (%s)" % (filename, "compact" if compact else "pretty"))
+    with open(filename, "w") as out:
+        dump(data, out, compact)
@@ -0,0 +1,191 @@
+"""
+Client for magnetdb API
+
+Requests go through a pooled requests.Session (keep-alive) with
+timeouts and retries with backoff.
+
+Responses are stored in an on-disk cache. Within ttl seconds a cached
+response is returned without any request; afterwards it is revalidated
+with a conditional request (ETag/If-Modified-Since).
+"""
+
+from typing import Optional
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class MagnetDBError(Exception):
+    """
+    Raised when magnetdb does not return the requested object
+
+    status: http status, None when no response was received (see reason)
+    """
+
+    def __init__(self, url: str, status: Optional[int], reason: str = ""):
+        super().__init__("magnetdb request %s failed (%s)" % (url, "status %d" % status if status is not None else reason))
+        self.url = url
+        self.status = status
+
+
+def default_cache_dir():
+    """
+    returns default location of the magnetdb cache
+    """
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "magnetsetup", "magnetdb")
+
+
+class MagnetDBClient():
+    """
+    Pooled and cached magnetdb client
+
+    url_api: magnetdb api url (ex. http://localhost:8000/api)
+    timeout: (connect, read) timeouts in s
+    retries: number of retries on connection errors and 5xx status
+    backoff: backoff factor between retries
+    cache: use the on-disk cache
+    cache_dir: on-disk cache location (default: see default_cache_dir)
+    ttl: time in s during which a cached response is used without revalidation
+    """
+
+    def __init__(self, url_api: str, timeout: tuple = (3.05, 30), retries: int = 3, backoff: float = 0.5,
+                 cache: bool = True, cache_dir: Optional[str] = None, ttl: float = 3600, pool: int = 10,
+                 debug: bool = False):
+        self.url_api = url_api.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache_dir = None
+        if cache:
+            self.cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.ttl = ttl
+        self.pool = pool
+        self.debug = debug
+        self.requests: int = 0
+        self.hits: int = 0
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        """
+        returns the requests session, created on first call
+        """
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                              status_forcelist=[500, 502, 503, 504], allowed_methods=["GET"])
+                adapter = HTTPAdapter(pool_connections=self.pool, pool_maxsize=self.pool, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+        return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _cache_file(self, url: str):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def _load(self, url: str):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_file(url), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def _store(self, url: str, entry: dict):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cfile = self._cache_file(url)
+        tmp = "%s.%d.%d" % (cfile, os.getpid(), threading.get_ident())
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, cfile)
+
+    def get(self, path: str):
+        """
+        returns json data from url_api/path
+        """
+        url = self.url_api + "/" + path.lstrip("/")
+        entry = self._load(url)
+        if entry and time.time() - entry["time"] < self.ttl:
+            self.hits += 1
+            if self.debug:
+                print("magnetdb/cached:", url)
+            return entry["data"]
+
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        import requests
+
+        try:
+            r = self.session().get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            # connection errors, timeouts, 5xx status after retries
+            raise MagnetDBError(url, None, "%s: %s" % (type(e).__name__, e)) from e
+        self.requests += 1
+        if self.debug:
+            print("magnetdb/request:", url, r.status_code)
+
+        if r.status_code == 304 and entry:
+            entry["time"] = time.time()
+            self._store(url, entry)
+            return entry["data"]
+
+        if r.status_code != 200:
+            raise MagnetDBError(url, r.status_code)
+
+        data = r.json()
+        self._store(url, {"url": url, "time": time.time(), "etag": r.headers.get("ETag"),
+                          "last_modified": r.headers.get("Last-Modified"), "data": data})
+        return data
+
+    def mdata(self, mtype: str, name: str):
+        """
+        returns object name of mtype
+        """
+        return self.get(mtype + "/mdata/" + name)
+
+    def names(self, mtype: str):
+        """
+        returns names of objects of mtype
+        """
+        if mtype in ["Helix", "Bitter", "Supra"]:
+            mtype = "mpart"
+        return [ d["name"] for d in self.get(mtype + "s/") ]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url_api: str, **kwargs):
+    """
+    returns a shared client for url_api and the options kwargs (see MagnetDBClient)
+    """
+    key = (url_api, tuple(sorted(kwargs.items())))
+    with _clients_lock:
+        if not key in _clients:
+            _clients[key] = MagnetDBClient(url_api, **kwargs)
+        return _clients[key]
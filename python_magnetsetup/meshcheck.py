@@ -0,0 +1,289 @@
+"""
+Pre-flight check of the markers of a setup against its mesh
+
+Only the tables of physical names are read from the mesh:
+
+* gmsh .msh: the $PhysicalNames section, the file being read forward
+  up to the first mesh data section ($Entities, $Nodes...)
+* med: the group names (FAS/.../GRO/NOM datasets, requires h5py)
+* Feel++ partitioned meshes (_p.json): the markers of the json file,
+  or the markers group of the .h5 file (requires h5py)
+
+The markers of the Materials, BoundaryConditions and PostProcess sections
+of the json model (with %1%, %1_2%... expanded over index1 and index2)
+are then checked against these names:
+
+python -m python_magnetsetup.meshcheck HL-34-cfpdes-thmagel-Axi-sim.json HL-34-Axi_withAir.msh
+"""
+
+from typing import Dict, Optional
+
+import re
+import os
+import sys
+import json
+import shlex
+import itertools
+
+from .profiling import profiled
+
+
+# sections following $PhysicalNames, they hold the (large) mesh data
+_msh_data = [b"$Entities", b"$PartitionedEntities", b"$Nodes", b"$Elements"]
+
+
+def msh_names(meshfile: str):
+    """
+    Return the physical names of the gmsh meshfile (name: (dim, tag))
+
+    the file is read forward up to the first mesh data section
+    """
+    names = {}
+    with open(meshfile, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line in _msh_data:
+                break
+            if line != b"$PhysicalNames":
+                continue
+            count = int(f.readline())
+            for i in range(count):
+                items = shlex.split(f.readline().decode())
+                if len(items) == 3:
+                    names[items[2]] = (int(items[0]), int(items[1]))
+            if f.readline().strip() != b"$EndPhysicalNames":
+                raise ValueError("%s: unterminated $PhysicalNames section" % meshfile)
+            break
+    return names
+
+
+def _h5py(meshfile: str):
+    try:
+        import h5py
+    except ImportError:
+        raise RuntimeError("%s: reading the markers requires h5py" % meshfile)
+    return h5py
+
+
+def med_names(meshfile: str):
+    """
+    Return the group names of the med meshfile
+    """
+    h5py = _h5py(meshfile)
+    names = {}
+    with h5py.File(meshfile, "r") as f:
+        if not "FAS" in f:
+            return names
+
+        def visit(path, obj):
+            if path.endswith("GRO/NOM") and isinstance(obj, h5py.Dataset):
+                data = obj[()].tobytes()
+                for i in range(0, len(data), 80):
+                    name = data[i:i+80].split(b"\0")[0].decode().strip()
+                    if name:
+                        names[name] = None
+        f["FAS"].visititems(visit)
+    return names
+
+
+def _json_markers(data):
+    if isinstance(data, dict):
+        for (key, value) in data.items():
+            if key == "markers":
+                return list(value) if isinstance(value, (dict, list)) else [value]
+            res = _json_markers(value)
+            if res is not None:
+                return res
+    return None
+
+
+def feelpp_names(meshfile: str):
+    """
+    Return the markers of a Feel++ partitioned mesh (_p.json or .h5)
+    """
+    if meshfile.endswith(".json"):
+        with open(meshfile, "r") as f:
+            markers = _json_markers(json.load(f))
+        if markers is not None:
+            return {name: None for name in markers}
+        meshfile = meshfile.replace(".json", ".h5")
+
+    h5py = _h5py(meshfile)
+    names = {}
+    with h5py.File(meshfile, "r") as f:
+        def visit(path, obj):
+            if path.split("/")[-1] == "markers" and isinstance(obj, h5py.Group):
+                for name in obj:
+                    names[name] = None
+                return True
+        f.visititems(visit)
+    return names
+
+
+def mesh_names(meshfile: str):
+    """
+    Return the markers defined in meshfile
+    """
+    if meshfile.endswith(".msh"):
+        return msh_names(meshfile)
+    if meshfile.endswith(".med"):
+        return med_names(meshfile)
+    if meshfile.endswith(".json") or meshfile.endswith(".h5"):
+        return feelpp_names(meshfile)
+    raise ValueError("%s: unsupported mesh format" % meshfile)
+
+
+def _index(values):
+    """
+    Return the values of an index (eg. "0:6", ["1", "2"], [["1", "1"], ["1", "2"]])
+    """
+    if not isinstance(values, list):
+        values = [values]
+    res = []
+    for value in values:
+        if isinstance(value, str) and re.match(r"^-?\d+:-?\d+$", value):
+            (start, stop) = value.split(":")
+            res += [str(i) for i in range(int(start), int(stop))]
+        elif isinstance(value, list):
+            res.append([str(v) for v in value])
+        else:
+            res.append(str(value))
+    return res
+
+
+def _substitute(name: str, n: int, value):
+    if isinstance(value, list):
+        for (k, v) in enumerate(value):
+            name = name.replace("%%%d_%d%%" % (n, k+1), v)
+        return name
+    return name.replace("%%%d%%" % n, value)
+
+
+def expand(spec, index: Optional[dict] = None):
+    """
+    Return the markers of spec (a name, a list of names or a dict with name, index1, index2)
+
+    index: index1, index2 of the section defining spec
+    """
+    if index is None:
+        index = {}
+    if isinstance(spec, dict):
+        index = {key: spec[key] for key in ["index1", "index2"] if key in spec}
+        spec = spec.get("name", [])
+    names = spec if isinstance(spec, list) else [spec]
+    index1 = _index(index["index1"]) if "index1" in index else [None]
+    index2 = _index(index["index2"]) if "index2" in index else [None]
+
+    res = []
+    for name in names:
+        if not isinstance(name, str):
+            continue
+        for (i1, i2) in itertools.product(index1, index2):
+            marker = name
+            if i1 is not None:
+                marker = _substitute(marker, 1, i1)
+            if i2 is not None:
+                marker = _substitute(marker, 2, i2)
+            res.append(marker)
+    return res
+
+
+def model_markers(model: dict):
+    """
+    Return the markers used by the json model (marker: list of sections using it)
+    """
+    markers = {}
+
+    def add(names, where):
+        for name in names:
+            markers.setdefault(name, [])
+            if not where in markers[name]:
+                markers[name].append(where)
+
+    def entry(name, data, where):
+        # without markers, the name of the entry is the marker
+        if isinstance(data, dict) and "markers" in data:
+            add(expand(data["markers"], data), where)
+        else:
+            add(expand(name, data if isinstance(data, dict) else {}), where)
+
+    for (name, data) in model.get("Materials", {}).items():
+        entry(name, data, "Materials/%s" % name)
+
+    for (field, bctypes) in model.get("BoundaryConditions", {}).items():
+        for (bctype, bcs) in bctypes.items():
+            if isinstance(bcs, dict):
+                for (name, data) in bcs.items():
+                    entry(name, data, "BoundaryConditions/%s/%s/%s" % (field, bctype, name))
+
+    def walk(data, path):
+        if isinstance(data, dict):
+            if "markers" in data:
+                add(expand(data["markers"], data), path)
+            for (key, value) in data.items():
+                walk(value, path + "/" + key)
+        elif isinstance(data, list):
+            for value in data:
+                walk(value, path)
+    walk(model.get("PostProcess", {}), "PostProcess")
+    return markers
+
+
+@profiled()
+def check_markers(model: dict, names: Dict, debug: bool = False):
+    """
+    Check the markers of model against the markers names of the mesh
+
+    returns a dict with:
+    missing: markers used by the model and not defined in the mesh (marker: sections)
+    unused: markers of the mesh not used by the model
+    """
+    markers = model_markers(model)
+    if debug:
+        print("check_markers: %d markers in model, %d in mesh" % (len(markers), len(names)))
+    missing = {name: markers[name] for name in sorted(markers) if not name in names and not "%" in name}
+    unused = sorted(name for name in names if not name in markers)
+    return {"missing": missing, "unused": unused}
+
+
+def check_setup(jsonfile: str, meshfile: str, debug: bool = False):
+    """
+    Check the markers of the json model file against meshfile (see check_markers)
+    """
+    with open(jsonfile, "r") as f:
+        model = json.load(f)
+    return check_markers(model, mesh_names(meshfile), debug)
+
+
+def report(res: dict, meshfile: str):
+    """
+    Return the report of check_markers
+    """
+    lines = []
+    for (name, where) in res["missing"].items():
+        used = ", ".join(where[:3]) + (" and %d more" % (len(where) - 3) if len(where) > 3 else "")
+        lines.append("missing marker %s in %s (used in %s)" % (name, meshfile, used))
+    if res["unused"]:
+        lines.append("unused markers of %s: %s" % (meshfile, ", ".join(res["unused"])))
+    lines.append("markers check: %d missing, %d unused" % (len(res["missing"]), len(res["unused"])))
+    return "\n".join(lines)
+
+
+def main():
+    """
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check the markers of a json model against a mesh")
+    parser.add_argument("jsonfile", help="json model file", type=str)
+    parser.add_argument("meshfile", help="mesh file (.msh, .med, _p.json or .h5)", type=str)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    res = check_setup(args.jsonfile, args.meshfile, args.debug)
+    print(report(res, args.meshfile))
+    return 1 if res["missing"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
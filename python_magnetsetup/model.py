@@ -0,0 +1,211 @@
+"""
+Compact immutable models for insert geometry and data
+
+Geometry replaces the gdata tuple
+(NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh):
+per helix and per channel values are stored as read-only numpy arrays,
+and it still unpacks as the tuple so that every create_* accepts it.
+
+Record is a read-only mapping with attribute access, used for the
+insert data (aka confdata) and its parts. Material records are shared
+between parts having the same properties. Variants are derived without
+copying the unchanged values, and records hash cheaply for cache keys.
+
+ex:
+gdata = Geometry.from_tuple(gdata)
+confdata = magnet_data(confdata)
+confdata.Helix[0].material.ThermalConductivity
+copper = confdata.Helix[0].material.derive(ThermalConductivity=360.)
+"""
+
+from typing import Dict
+
+import json
+import hashlib
+from collections.abc import Mapping
+
+
+class Geometry():
+    """
+    Main characteristics of an insert (lengths in mm)
+    """
+
+    fields = ("NHelices", "NRings", "NChannels", "Nsections", "R1", "R2", "Z1", "Z2", "Zmin", "Zmax", "Dh", "Sh")
+    arrays = ("R1", "R2", "Z1", "Z2", "Zmin", "Zmax", "Dh", "Sh")
+
+    __slots__ = fields + ("_digest",)
+
+    def __init__(self, NHelices: int, NRings: int, NChannels: int, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh):
+        import numpy as np
+
+        object.__setattr__(self, "NHelices", int(NHelices))
+        object.__setattr__(self, "NRings", int(NRings))
+        object.__setattr__(self, "NChannels", int(NChannels))
+        object.__setattr__(self, "Nsections", tuple(int(n) for n in Nsections))
+        for (name, values) in zip(self.arrays, [R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh]):
+            array = np.array(values, dtype=float)
+            array.setflags(write=False)
+            object.__setattr__(self, name, array)
+        object.__setattr__(self, "_digest", None)
+
+    @classmethod
+    def from_tuple(cls, gdata):
+        """
+        returns gdata as a Geometry
+        """
+        if isinstance(gdata, cls):
+            return gdata
+        return cls(*gdata)
+
+    def scaled(self, length: float, surface: float):
+        """
+        returns the geometry with lengths scaled by length and surfaces by surface
+        """
+        if length == 1. and surface == 1.:
+            return self
+        return Geometry(self.NHelices, self.NRings, self.NChannels, self.Nsections,
+                        self.R1 * length, self.R2 * length, self.Z1 * length, self.Z2 * length,
+                        self.Zmin * length, self.Zmax * length, self.Dh * surface, self.Sh * surface)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Geometry is immutable")
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, i):
+        return tuple(self)[i]
+
+    def __reduce__(self):
+        return (Geometry, tuple(self))
+
+    def digest(self):
+        """
+        returns a digest of the geometry
+        """
+        if self._digest is None:
+            sha = hashlib.sha1(repr((self.NHelices, self.NRings, self.NChannels, self.Nsections)).encode())
+            for name in self.arrays:
+                sha.update(getattr(self, name).tobytes())
+            object.__setattr__(self, "_digest", sha.hexdigest())
+        return self._digest
+
+    def __hash__(self):
+        return hash(self.digest())
+
+    def __eq__(self, other):
+        if not isinstance(other, Geometry):
+            return NotImplemented
+        return self.digest() == other.digest()
+
+    def __repr__(self):
+        return "Geometry(%s)" % ", ".join("%s=%s" % (name, getattr(self, name).tolist() if name in self.arrays
+                                                       else getattr(self, name)) for name in self.fields)
+
+
+class Record(Mapping):
+    """
+    Read-only mapping with attribute access
+    """
+
+    __slots__ = ("_data", "_hash")
+
+    def __init__(self, data=(), **kwargs):
+        object.__setattr__(self, "_data", dict(data, **kwargs))
+        object.__setattr__(self, "_hash", None)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def derive(self, **changes):
+        """
+        returns a copy with changes, unchanged values are shared
+        """
+        return type(self)(self._data, **changes)
+
+    def __reduce__(self):
+        return (type(self), (self._data,))
+
+    def __hash__(self):
+        if self._hash is None:
+            try:
+                value = hash(tuple(sorted(self._data.items())))
+            except TypeError:
+                value = hash(json.dumps(self._data, sort_keys=True, default=repr))
+            object.__setattr__(self, "_hash", value)
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._data == other._data
+        if isinstance(other, Mapping):
+            return self._data == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self._data)
+
+
+class Material(Record):
+    """
+    Material properties
+    """
+
+    __slots__ = ()
+
+
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return Record({k: _freeze(v) for (k, v) in value.items()})
+    return value
+
+
+def magnet_data(confdata, materials: Dict = None):
+    """
+    returns confdata (see load_object) as a Record
+
+    parts are Records and materials are Materials, identical materials
+    being shared (through the materials dict when given)
+    """
+    if isinstance(confdata, Record):
+        return confdata
+    if materials is None:
+        materials = {}
+
+    def material(data):
+        m = data if isinstance(data, Material) else Material({k: _freeze(v) for (k, v) in data.items()})
+        return materials.setdefault(m, m)
+
+    data = {}
+    for (key, value) in confdata.items():
+        if key in ["Helix", "Ring", "Lead"]:
+            parts = []
+            for part in value:
+                parts.append(Record({k: material(v) if k in ["material", "insulator"] else _freeze(v)
+                                     for (k, v) in part.items()}))
+            data[key] = tuple(parts)
+        else:
+            data[key] = _freeze(value)
+    return Record(data)
@@ -0,0 +1,163 @@
+"""
+Content-addressed cache of generated setups
+
+The key of a setup is a digest of everything that determines its
+outputs: the input files (insert and helices yaml), the template files,
+the magnetsetup.json entry, the (converted) input data and options, and
+the sources of python_magnetsetup itself.
+
+Each entry is stored as a directory named after the key, holding the
+generated files and a manifest. When the key matches, the files are
+copied back to the working directory instead of being rendered again.
+
+The cache size is bounded: least recently used entries are evicted
+once the total size is over maxsize.
+"""
+
+from typing import List, Optional
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import functools
+
+
+def default_cache_dir():
+    """
+    returns default location of the setup cache
+    """
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "magnetsetup", "setups")
+
+
+@functools.lru_cache(maxsize=None)
+def code_digest():
+    """
+    returns digest of the python_magnetsetup sources
+    """
+    sha = hashlib.sha256()
+    default_path = os.path.dirname(os.path.abspath(__file__))
+    for filename in sorted(os.listdir(default_path)):
+        if filename.endswith(".py") or filename == "magnetsetup.json":
+            sha.update(filename.encode())
+            with open(os.path.join(default_path, filename), "rb") as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+def digest(files: List[str], data) -> str:
+    """
+    returns digest of files content and data (json serializable)
+    """
+    sha = hashlib.sha256(code_digest().encode())
+    for filename in files:
+        sha.update(b"\0" + filename.encode() + b"\0")
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                sha.update(chunk)
+    sha.update(json.dumps(data, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+class OutputCache():
+    """
+    On-disk cache of generated setups
+
+    cache_dir: cache location (default: see default_cache_dir)
+    maxsize: maximum size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, maxsize: int = 256 * 1024 * 1024, debug: bool = False):
+        self.cache_dir = cache_dir if cache_dir else default_cache_dir()
+        self.maxsize = maxsize
+        self.debug = debug
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def key(self, files: List[str], data) -> str:
+        return digest(files, data)
+
+    def restore(self, key: str, wd: str = ""):
+        """
+        copy files of entry key into wd
+
+        returns the list of restored files, None if key is not cached
+        """
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, "manifest.json"), "r") as f:
+                manifest = json.load(f)
+            for filename in manifest["files"]:
+                shutil.copyfile(os.path.join(entry, filename), os.path.join(wd, filename))
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        # mark entry as recently used
+        os.utime(entry)
+        self.hits += 1
+        if self.debug:
+            print("outputcache/restore %s: %s" % (key, manifest["files"]))
+        return manifest["files"]
+
+    def store(self, key: str, files: List[str], wd: str = ""):
+        """
+        store files of wd as entry key
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = os.path.join(self.cache_dir, key)
+        tmp = "%s.%d.tmp" % (entry, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for filename in files:
+            shutil.copyfile(os.path.join(wd, filename), os.path.join(tmp, filename))
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"files": files, "time": time.time()}, f)
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # already stored by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        if self.debug:
+            print("outputcache/store %s: %s" % (key, files))
+        self.evict()
+
+    def entries(self):
+        """
+        returns list of (last use, size, path) of cache entries
+        """
+        res = []
+        if not os.path.isdir(self.cache_dir):
+            return res
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp") or not os.path.isdir(entry):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+            res.append((os.stat(entry).st_mtime, size, entry))
+        return res
+
+    def evict(self):
+        """
+        remove least recently used entries until size is under maxsize
+        """
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        for (mtime, esize, entry) in entries:
+            if size <= self.maxsize:
+                break
+            if self.debug:
+                print("outputcache/evict %s" % entry)
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= esize
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def stats(self):
+        entries = self.entries()
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries),
+                "size": sum(entry[1] for entry in entries), "maxsize": self.maxsize}
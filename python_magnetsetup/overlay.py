@@ -0,0 +1,189 @@
+"""
+Base plus overlay output for families of setups
+
+Setups differing only by a few values (eg. the members of a sweep) are
+written as a shared base (cfg, json model and material files, written
+once) and, per variant, a small directory with:
+
+* <jsonfile>.patch: the RFC 6902 JSON Patch turning the base model into
+  the variant model
+* the variant cfg, pointing at the base model and applying the patch
+  (json.patch options of Feel++ toolboxes)
+* hardlinks (or symlinks when hardlinks are not supported) to the base
+  material files
+
+To get the full model of a variant (eg. for tools not supporting patches):
+
+python -m python_magnetsetup.overlay sweep/base/HL-34-cfpdes-thelec-Axi-sim.json \\
+    sweep/0003/HL-34-cfpdes-thelec-Axi-sim.json.patch --output HL-34-0003.json
+"""
+
+from typing import List
+
+import os
+import re
+import sys
+import json
+import shutil
+
+from . import jsonwriter
+
+
+def pointer(path: List[str]):
+    """
+    Return the JSON pointer of path
+    """
+    return "".join("/" + str(key).replace("~", "~0").replace("/", "~1") for key in path)
+
+
+def diff(base, data, path: List[str] = []):
+    """
+    Return the JSON Patch (list of operations) turning base into data
+
+    dicts are compared key by key, other values are replaced as a whole
+    """
+    if isinstance(base, dict) and isinstance(data, dict):
+        ops = []
+        for key in base:
+            if not key in data:
+                ops.append({"op": "remove", "path": pointer(path + [key])})
+            elif base[key] != data[key]:
+                ops += diff(base[key], data[key], path + [key])
+        for key in data:
+            if not key in base:
+                ops.append({"op": "add", "path": pointer(path + [key]), "value": data[key]})
+        return ops
+
+    if base == data and type(base) == type(data):
+        return []
+    return [{"op": "replace", "path": pointer(path), "value": data}]
+
+
+def _parse_pointer(path: str):
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise ValueError("invalid JSON pointer %s" % path)
+    return [key.replace("~1", "/").replace("~0", "~") for key in path[1:].split("/")]
+
+
+def apply(data, ops: List[dict]):
+    """
+    Return data with the JSON Patch ops applied (data is not modified)
+
+    supports add, remove and replace operations
+    """
+    import copy
+
+    data = copy.deepcopy(data)
+    for op in ops:
+        keys = _parse_pointer(op["path"])
+        if not keys:
+            if op["op"] == "remove":
+                raise ValueError("cannot remove the document")
+            data = copy.deepcopy(op["value"])
+            continue
+
+        parent = data
+        for key in keys[:-1]:
+            parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+        key = keys[-1]
+        if isinstance(parent, list):
+            key = len(parent) if key == "-" else int(key)
+
+        if op["op"] == "add":
+            if isinstance(parent, list):
+                parent.insert(key, copy.deepcopy(op["value"]))
+            else:
+                parent[key] = copy.deepcopy(op["value"])
+        elif op["op"] == "replace":
+            if not isinstance(parent, list) and not key in parent:
+                raise ValueError("%s: no such member" % op["path"])
+            parent[key] = copy.deepcopy(op["value"])
+        elif op["op"] == "remove":
+            del parent[key]
+        else:
+            raise ValueError("unsupported operation %s" % op["op"])
+    return data
+
+
+def link(src: str, dst: str, debug: bool = False):
+    """
+    Link dst to src: hardlink, symlink if not supported, copy otherwise
+
+    returns the kind of link created
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        kind = "hardlink"
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(src, os.path.dirname(os.path.abspath(dst))), dst)
+            kind = "symlink"
+        except OSError:
+            shutil.copyfile(src, dst)
+            kind = "copy"
+    if debug:
+        print("overlay/%s %s -> %s" % (kind, dst, src))
+    return kind
+
+
+def overlay_cfg(cfg: str, jsonfile: str, basejson: str, ops: List[dict]):
+    """
+    Return cfg with the json model replaced by basejson patched by ops
+    """
+    line = "filename=$cfgdir/%s" % jsonfile
+    patches = "".join("\njson.patch=%s" % json.dumps(op, separators=(",", ":")) for op in ops)
+    (res, count) = re.subn(r"^%s$" % re.escape(line),
+                           lambda m: "filename=$cfgdir/%s%s" % (basejson, patches), cfg, flags=re.M)
+    if count != 1:
+        raise ValueError("no %s in cfg" % line)
+    return res
+
+
+def write_variant(setup: dict, base: dict, basedir: str, wd: str, debug: bool = False):
+    """
+    Write setup (see setup_data) in wd as an overlay of base, written in basedir
+
+    returns the list of created files
+    """
+    ops = diff(base["model"], setup["model"])
+    patchfile = setup["jsonfile"] + ".patch"
+    with open(os.path.join(wd, patchfile), "w") as out:
+        json.dump(ops, out, indent=4)
+
+    basejson = os.path.join(os.path.relpath(basedir, wd), base["jsonfile"])
+    with open(os.path.join(wd, setup["cfgfile"]), "w") as out:
+        out.write(overlay_cfg(setup["cfg"], setup["jsonfile"], basejson, ops))
+    files = [setup["cfgfile"], patchfile]
+
+    for (src, dst) in setup["materials"]:
+        link(os.path.join(basedir, dst), os.path.join(wd, dst), debug)
+        files.append(dst)
+    return files
+
+
+def main():
+    """
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply a JSON Patch to a base json model")
+    parser.add_argument("base", help="base json model", type=str)
+    parser.add_argument("patch", help="JSON Patch file", type=str)
+    parser.add_argument("--output", help="output json model", type=str, required=True)
+    parser.add_argument("--compact", help="write json model without indentation", action='store_true')
+    args = parser.parse_args()
+
+    with open(args.base, "r") as f:
+        base = json.load(f)
+    with open(args.patch, "r") as f:
+        ops = json.load(f)
+    jsonwriter.write(args.output, apply(base, ops), args.compact)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
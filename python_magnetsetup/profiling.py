@@ -0,0 +1,228 @@
+"""
+Per stage profiling of setup generation
+
+Stages of the setup are decorated with profiled (or wrapped in
+stage blocks). They cost nothing unless a Profiler is active:
+
+with profiling(Profiler()) as profiler:
+    create_setup(...)
+profiler.summary()
+profiler.save_trace("trace.json")
+
+For each stage the profiler records the wall time and number of calls,
+the peak of traced memory (tracemalloc) and optionally a cProfile of the
+stage. Timings are exported as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev).
+"""
+
+from typing import List, Optional
+
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+
+_profiler = None
+
+
+class Profiler():
+    """
+    Record timings of stages
+
+    memory: track peak memory of stages (slows down the run),
+    requires tracemalloc.reset_peak (python >= 3.9)
+    cprofile: names of stages to profile with cProfile, only one profile
+    is enabled at a time: a stage running inside a profiled stage (or in
+    another thread meanwhile) is not profiled on its own
+    """
+
+    def __init__(self, memory: bool = True, cprofile: Optional[List[str]] = None, debug: bool = False):
+        import tracemalloc
+        self.memory = memory and hasattr(tracemalloc, "reset_peak")
+        self.debug = debug
+        self.events = []
+        self.stats = {}
+        self.profiles = {}
+        self._start = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiling = False
+
+        for name in (cprofile or []):
+            import cProfile
+            self.profiles[name] = cProfile.Profile()
+
+    def start(self):
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def stop(self):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def _peak(self):
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[1]
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        record the block as stage name
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        tracing = self.memory and self._tracing()
+        if tracing:
+            import tracemalloc
+            if stack:
+                stack[-1][1] = max(stack[-1][1], self._peak())
+            tracemalloc.reset_peak()
+        entry = [name, 0]
+        stack.append(entry)
+
+        profile = self.profiles.get(name)
+        if profile is not None:
+            with self._lock:
+                if self._profiling:
+                    profile = None
+                else:
+                    self._profiling = True
+            if profile is not None:
+                profile.enable()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if profile is not None:
+                profile.disable()
+                with self._lock:
+                    self._profiling = False
+            peak = max(entry[1], self._peak()) if tracing else None
+            stack.pop()
+            if tracing and stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            self.record(name, start, end, peak)
+
+    def _tracing(self):
+        import tracemalloc
+        return tracemalloc.is_tracing()
+
+    def record(self, name: str, start: float, end: float, peak: Optional[int] = None):
+        event = {"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                 "ts": (start - self._start) * 1.e+6, "dur": (end - start) * 1.e+6}
+        if peak is not None:
+            event["args"] = {"peak_memory": peak}
+
+        with self._lock:
+            self.events.append(event)
+            if not name in self.stats:
+                self.stats[name] = {"calls": 0, "time": 0., "peak_memory": None}
+            stats = self.stats[name]
+            stats["calls"] += 1
+            stats["time"] += end - start
+            if peak is not None:
+                stats["peak_memory"] = max(stats["peak_memory"] or 0, peak)
+        if self.debug:
+            print("profile/%s: %.6f s" % (name, end - start))
+
+    def summary(self, out=None):
+        """
+        print table of stages: calls, total and mean time, peak memory
+        """
+        print("\n=== Profile ===", file=out)
+        print("%-24s %8s %12s %12s %12s" % ("stage", "calls", "total [s]", "mean [ms]", "peak [MB]"), file=out)
+        for (name, stats) in self.stats.items():
+            peak = "%12.2f" % (stats["peak_memory"] / 1024. / 1024.) if stats["peak_memory"] is not None else "%12s" % "-"
+            print("%-24s %8d %12.6f %12.3f %s" % (name, stats["calls"], stats["time"],
+                                                 stats["time"] / stats["calls"] * 1.e+3, peak), file=out)
+        print("===============\n", file=out)
+
+    def save_trace(self, filename: str):
+        """
+        save events as a Chrome trace
+        """
+        with self._lock:
+            data = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(filename, "w") as f:
+            json.dump(data, f)
+
+    def save_profiles(self, prefix: str = ""):
+        """
+        save cProfile stats as prefix<stage>.prof
+
+        returns the list of saved files
+        """
+        files = []
+        for (name, profile) in self.profiles.items():
+            filename = "%s%s.prof" % (prefix, name)
+            profile.dump_stats(filename)
+            files.append(filename)
+        return files
+
+
+def enable(profiler: Profiler):
+    """
+    activate profiler, returns the previously active profiler
+    """
+    global _profiler
+    previous = _profiler
+    _profiler = profiler
+    profiler.start()
+    return previous
+
+
+def disable(previous: Optional[Profiler] = None):
+    """
+    deactivate the active profiler (and restore previous)
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = previous
+
+
+@contextlib.contextmanager
+def profiling(profiler: Profiler):
+    """
+    activate profiler for the block
+    """
+    previous = enable(profiler)
+    try:
+        yield profiler
+    finally:
+        disable(previous)
+
+
+def stage(name: str):
+    """
+    returns a block recorded as stage name by the active profiler
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+
+def profiled(name: Optional[str] = None):
+    """
+    decorator recording calls of a function as stage name (default: function name)
+    """
+    def decorator(func):
+        stage_name = name if name else func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,122 @@
+"""
+Concurrent resolution of magnet records from magnetdb
+
+A magnet record lists its parts (Helix, Ring, Lead) and each part
+refers to a material (and possibly an insulator). Parts and materials
+given by name are fetched concurrently, with a bounded number of
+requests in flight. Objects shared between parts (typically materials)
+are only requested once.
+
+The result has the same layout as a *-data.json file:
+{
+    "geom": "HL-34.yaml",
+    "Helix": [ {"material": {...}, "insulator": {...}}, ... ],
+    "Ring": [ {"material": {...}}, ... ],
+    "Lead": [ {"material": {...}}, ... ]
+}
+"""
+
+from typing import Dict
+
+import asyncio
+
+from .magnetdb import MagnetDBClient
+
+part_types = ["Helix", "Ring", "Lead"]
+material_types = ["material", "insulator"]
+
+
+class Resolver():
+    """
+    Resolve magnet -> parts -> materials from magnetdb
+
+    client: MagnetDBClient used for the requests
+    concurrency: maximum number of requests in flight
+    part_mtype: mtype used to fetch parts given by name
+    """
+
+    part_mtype = "mpart"
+
+    def __init__(self, client: MagnetDBClient, concurrency: int = 8, debug: bool = False):
+        self.client = client
+        self.concurrency = concurrency
+        self.debug = debug
+        self.requests: int = 0
+        self._semaphore = None
+        self._tasks: Dict[tuple, asyncio.Future] = {}
+
+    async def fetch(self, mtype: str, name: str):
+        """
+        returns mdata of object, requesting it only once
+        """
+        key = (mtype, name)
+        if not key in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(self._fetch(mtype, name))
+        return await self._tasks[key]
+
+    async def _fetch(self, mtype: str, name: str):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            if self.debug:
+                print("resolver/fetch %s %s" % (mtype, name))
+            self.requests += 1
+            return await asyncio.get_running_loop().run_in_executor(None, self.client.mdata, mtype, name)
+
+    async def material(self, material):
+        if isinstance(material, str):
+            return dict(await self.fetch("material", material))
+        return material
+
+    async def part(self, part):
+        """
+        returns part with its materials
+        """
+        if isinstance(part, str):
+            part = await self.fetch(self.part_mtype, part)
+        part = dict(part)
+
+        keys = [key for key in material_types if key in part]
+        materials = await asyncio.gather(*[self.material(part[key]) for key in keys])
+        for (key, material) in zip(keys, materials):
+            part[key] = material
+        return part
+
+    async def magnet(self, name: str):
+        """
+        returns confdata of magnet name
+        """
+        confdata = dict(await self.fetch("magnet", name))
+
+        mtypes = [mtype for mtype in part_types if mtype in confdata]
+        parts = await asyncio.gather(*[asyncio.gather(*[self.part(p) for p in confdata[mtype]]) for mtype in mtypes])
+        for (mtype, mparts) in zip(mtypes, parts):
+            confdata[mtype] = list(mparts)
+        return confdata
+
+    async def msite(self, name: str):
+        """
+        returns msite name with confdata of its magnets
+        """
+        site = dict(await self.fetch("msite", name))
+        magnets = site.get("magnets", [])
+        names = [m if isinstance(m, str) else m["name"] for m in magnets]
+        site["magnets"] = dict(zip(names, await asyncio.gather(*[self.magnet(m) for m in names])))
+        return site
+
+
+def resolve(client: MagnetDBClient, mtype: str, name: str, concurrency: int = 8, debug: bool = False):
+    """
+    returns fully populated mtype ("magnet" or "msite") object name
+    """
+    resolver = Resolver(client, concurrency, debug)
+    if mtype == "magnet":
+        data = asyncio.run(resolver.magnet(name))
+    elif mtype == "msite":
+        data = asyncio.run(resolver.msite(name))
+    else:
+        raise Exception("resolve: %s not supported" % mtype)
+
+    if debug:
+        print("resolve %s %s: %d requests" % (mtype, name, resolver.requests))
+    return data
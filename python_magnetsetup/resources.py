@@ -0,0 +1,239 @@
+"""
+Resources estimate of a setup
+
+The number of mesh vertices is read from the mesh file when available
+(gmsh .msh, or .med with h5py), otherwise estimated from gdata (number
+of conductor regions). The number of dofs follows from the unknowns of
+the json model template (Pch1, Pch2, Pchv1...), the memory and the
+recommended number of MPI processes from the dofs:
+
+python -m python_magnetsetup.resources --datafile HL-34-data.json --model thmagel --cores 32
+"""
+
+from typing import List, Optional
+
+import os
+import re
+import sys
+import math
+import struct
+
+# equations of the json models, in order
+equations = {
+    ("Axi", "thelec"): ["heat"],
+    ("Axi", "mag"): ["magnetic"],
+    ("Axi", "thmag"): ["heat", "magnetic"],
+    ("Axi", "thmagel"): ["heat", "magnetic", "elastic"],
+    ("3D", "thelec"): ["electric", "heat"],
+    ("3D", "thmag"): ["electric", "heat", "magnetic"],
+    ("3D", "thmagel"): ["electric", "heat", "magnetic", "elastic"],
+}
+
+# basis of the unknowns when the model template is not given
+bases = {"heat": "Pch1", "electric": "Pch1", "magnetic": "Pch2", "elastic": "Pchv1"}
+
+# estimated number of mesh vertices per conductor region
+region_vertices = {"Axi": 2000, "3D": 50000}
+
+# memory per dof (matrix, preconditioner, vectors) and per process (runtime, mesh halo)
+dof_memory = {"Axi": 1.5e+3, "3D": 4.e+3}
+process_memory = 250.e+6
+
+# target number of dofs per process
+process_dofs = {"Axi": 20000, "3D": 50000}
+
+
+def fields(method_data: List[str]):
+    """
+    Return the equations solved for method_data
+    """
+    [method, time, geom, model, cooling] = method_data
+    return equations.get((geom, model), [model])
+
+
+def model_bases(template: str):
+    """
+    Return the basis of the unknowns of the json model template
+    """
+    with open(template, "r") as f:
+        text = f.read()
+    i = text.find('"Models"')
+    if i < 0:
+        return []
+    return re.findall(r'"basis"\s*:\s*"(\w+)"', text[i:])
+
+
+def basis_factor(basis: str, dim: int):
+    """
+    Return the number of dofs per mesh vertex of basis (eg. Pch2, Pchv1)
+    """
+    m = re.match(r"P\w*?(v|m)?(\d+)$", basis)
+    if m is None:
+        return 1
+    order = int(m.group(2))
+    factor = max(order, 1) ** dim
+    if m.group(1) == "v":
+        factor *= dim
+    elif m.group(1) == "m":
+        factor *= dim * dim
+    return factor
+
+
+def mesh_vertices(meshfile: str):
+    """
+    Return the number of vertices of meshfile, None if unknown
+
+    supports gmsh .msh (ascii or binary, v2 and v4) and .med (requires h5py)
+    """
+    if meshfile.endswith(".msh"):
+        version = 2.
+        binary = False
+        size = 8
+        with open(meshfile, "rb") as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    return None
+                line = line.strip()
+                if line == b"$MeshFormat":
+                    fmt = f.readline().split()
+                    (version, binary, size) = (float(fmt[0]), fmt[1] == b"1", int(fmt[2]))
+                elif line == b"$Nodes":
+                    if version >= 4 and binary:
+                        (blocks, nodes, tmin, tmax) = struct.unpack("<4%s" % ("Q" if size == 8 else "I"), f.read(4 * size))
+                        return nodes
+                    header = f.readline().split()
+                    return int(header[1]) if version >= 4 else int(header[0])
+
+    if meshfile.endswith(".med"):
+        try:
+            import h5py
+        except ImportError:
+            return None
+        with h5py.File(meshfile, "r") as f:
+            if not "ENS_MAA" in f:
+                return None
+            for mesh in f["ENS_MAA"].values():
+                for step in mesh.values():
+                    if "NOE" in step and "COO" in step["NOE"]:
+                        return int(step["NOE"]["COO"].attrs["NBR"])
+    return None
+
+
+def estimate_vertices(method_data: List[str], gdata: tuple):
+    """
+    Return an estimate of the number of mesh vertices from gdata
+    """
+    (NHelices, NRings, NChannels, Nsections) = tuple(gdata)[:4]
+    regions = sum(n + 2 for n in Nsections) + NRings
+    geom = method_data[2]
+    return regions * region_vertices.get(geom, region_vertices["3D"])
+
+
+def available_cores():
+    """
+    Return the number of cores usable by this process
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def estimate(method_data: List[str], gdata: tuple, template: Optional[str] = None, meshfile: Optional[str] = None,
+             cores: Optional[int] = None, debug: bool = False):
+    """
+    Return the resources estimate of the setup
+
+    template: json model template (for the basis of the unknowns)
+    meshfile: mesh file, used when it exists
+    cores: number of cores available (default: cores of this machine)
+
+    returns a dict with:
+    vertices, source: number of mesh vertices and where it comes from (mesh or gdata)
+    dofs, memory (bytes), np: recommended number of processes
+    """
+    geom = method_data[2]
+    dim = 3 if geom == "3D" else 2
+
+    unknowns = model_bases(template) if template is not None else []
+    if not unknowns:
+        unknowns = [bases.get(field, "Pch1") for field in fields(method_data)]
+
+    vertices = None
+    source = "gdata"
+    if meshfile is not None and os.path.isfile(meshfile):
+        vertices = mesh_vertices(meshfile)
+        source = meshfile
+    if vertices is None:
+        vertices = estimate_vertices(method_data, gdata)
+        source = "gdata"
+
+    dofs = vertices * sum(basis_factor(basis, dim) for basis in unknowns)
+    if cores is None:
+        cores = available_cores()
+    np = min(max(1, math.ceil(dofs / process_dofs.get(geom, process_dofs["3D"]))), max(1, cores))
+    memory = dofs * dof_memory.get(geom, dof_memory["3D"]) + np * process_memory
+
+    res = {"vertices": vertices, "source": source, "unknowns": unknowns, "dofs": dofs, "memory": memory,
+           "np": np, "cores": cores}
+    if debug:
+        print("resources/estimate:", res)
+    return res
+
+
+def summary(res: dict):
+    """
+    Return a one line summary of estimate res
+    """
+    return "%d vertices (%s), %d dofs (%s), memory ~%.1f GB, NP=%d (%d cores)" % (
+        res["vertices"], res["source"], res["dofs"], ",".join(res["unknowns"]), res["memory"] / 1.e+9,
+        res["np"], res["cores"])
+
+
+def main():
+    """
+    """
+    import argparse
+    from .setup import appenv, loadconfig, load_object, load_object_from_db, load_geometry
+
+    parser = argparse.ArgumentParser(description="Estimate the resources of a setup")
+    parser.add_argument("--datafile", help="input data file (ex. HL-34-data.json)", default=None)
+    parser.add_argument("--wd", help="set a working directory", type=str, default="")
+    parser.add_argument("--magnet", help="Magnet name from magnetdb (ex. HL-34)", default=None)
+    parser.add_argument("--method", help="choose method (default is cfpdes", type=str,
+                    choices=['cfpdes', 'CG', 'HDG', 'CRB'], default='cfpdes')
+    parser.add_argument("--time", help="choose time type", type=str,
+                    choices=['static', 'transient'], default='static')
+    parser.add_argument("--geom", help="choose geom type", type=str,
+                    choices=['Axi', '3D'], default='Axi')
+    parser.add_argument("--model", help="choose model type", type=str,
+                    choices=['thelec', 'mag', 'thmag', 'thmagel'], default='thmagel')
+    parser.add_argument("--mesh", help="mesh file (ex. HL-34-Axi_withAir.msh)", type=str, default=None)
+    parser.add_argument("--cores", help="number of cores available (default: cores of this machine)", type=int, default=None)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    MyEnv = appenv()
+    AppCfg = loadconfig()
+    if not "model" in AppCfg[args.method][args.time].get(args.geom, {}).get(args.model, {}):
+        parser.error("%s %s %s %s is not supported" % (args.method, args.time, args.geom, args.model))
+    if args.datafile != None:
+        confdata = load_object(MyEnv, os.path.join(args.wd, args.datafile), args.debug)
+    elif args.magnet != None:
+        confdata = load_object_from_db(MyEnv, "magnet", args.magnet, args.debug)
+    else:
+        parser.error("--datafile or --magnet is required")
+
+    (cad, gdata, insulators) = load_geometry(confdata["geom"], args.geom, basedir=args.wd, debug=args.debug)
+    method_data = [args.method, args.time, args.geom, args.model, "mean"]
+    template = os.path.join(MyEnv.template_path(), args.method, args.geom, args.model,
+                            AppCfg[args.method][args.time][args.geom][args.model]["model"])
+    meshfile = os.path.join(args.wd, args.mesh) if args.mesh is not None else None
+    res = estimate(method_data, gdata, template, meshfile, args.cores, args.debug)
+    print("%s: %s" % (cad.name, summary(res)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
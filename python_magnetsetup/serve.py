@@ -0,0 +1,287 @@
+"""
+Setup daemon
+
+Keeps the app config, the compiled templates, the unit factors and the
+insert geometries in memory and generates setups on request, over
+localhost HTTP or a unix domain socket. Requests are handled by a
+bounded pool of workers.
+
+ex:
+python -m python_magnetsetup.serve --socket /tmp/magnetsetup.sock -j 4
+curl --unix-socket /tmp/magnetsetup.sock -d @request.json http://localhost/setup
+
+POST /setup
+{
+    "method": "cfpdes", "time": "static", "geom": "Axi", "model": "thelec", "cooling": "mean",
+    "nonlinear": false, "distance_unit": "meter", "shared": false,
+    "wd": "data",                    # directory of the inputs
+    "datafile": "HL-34-data.json",   # or "magnet": "HL-34", or "confdata": {...}
+    "output": "setups/HL-34",        # optional: write the files there
+    "compact": false
+}
+returns {"cfgfile", "cfg", "jsonfile", "model", "materials", "files", "time"}
+
+GET /metrics
+returns requests count, latency percentiles and cache statistics
+"""
+
+from typing import Optional
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from .cache import template_cache
+from .setup import load_object, load_object_from_db, load_geometry
+from .generator import SetupGenerator
+
+
+class GeometryCache():
+    """
+    Loaded insert geometries, keyed by yaml file and modification time
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, yamlfile: str, geom: str, basedir: str = "", debug: bool = False):
+        """
+        returns (cad, gdata, insulators) of yamlfile
+        """
+        filename = os.path.abspath(os.path.join(basedir, yamlfile))
+        key = (filename, os.stat(filename).st_mtime_ns, geom)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        data = load_geometry(yamlfile, geom, basedir=basedir, debug=debug)
+        with self._lock:
+            self._entries[key] = data
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+class Metrics():
+    """
+    Request counters and latencies (of the last window requests)
+    """
+
+    def __init__(self, window: int = 1000):
+        self.requests: int = 0
+        self.errors: int = 0
+        self.latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self.latencies.append(latency)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            res = {"requests": self.requests, "errors": self.errors}
+        for p in [50, 90, 99]:
+            res["p%d" % p] = latencies[min(len(latencies) - 1, len(latencies) * p // 100)] if latencies else None
+        return res
+
+
+class SetupService():
+    """
+    Generate setups from requests (see module doc)
+    """
+
+    def __init__(self, generator: Optional[SetupGenerator] = None, debug: bool = False):
+        self.generator = generator if generator is not None else SetupGenerator(debug=debug)
+        self.geometries = GeometryCache()
+        self.metrics = Metrics()
+        self.debug = debug
+
+    def confdata(self, request: dict):
+        if "confdata" in request:
+            return (request["confdata"], request.get("name"))
+        if "datafile" in request:
+            datafile = request["datafile"]
+            confdata = load_object(self.generator.env, os.path.join(request.get("wd", ""), datafile), self.debug)
+            return (confdata, os.path.basename(datafile).replace("-data.json", ""))
+        if "magnet" in request:
+            return (load_object_from_db(self.generator.env, "magnet", request["magnet"], self.debug), request["magnet"])
+        raise ValueError("expected confdata, datafile or magnet")
+
+    def setup(self, request: dict):
+        """
+        returns the setup for request
+        """
+        method_data = [request.get("method", "cfpdes"), request.get("time", "static"), request.get("geom", "Axi"),
+                       request.get("model", "thmagel"), request.get("cooling", "mean")]
+        nonlinear = request.get("nonlinear", False)
+        wd = request.get("wd", "")
+
+        (confdata, basename) = self.confdata(request)
+        yamlfile = confdata["geom"]
+        (cad, gdata, insulators) = self.geometries.get(yamlfile, method_data[2], wd, self.debug)
+
+        setup = self.generator.generate(method_data, nonlinear, confdata, cad, yamlfile=yamlfile,
+                                        basename=basename, gdata=gdata,
+                                        distance_unit=request.get("distance_unit", "meter"),
+                                        shared=request.get("shared", False))
+        files = None
+        if request.get("output"):
+            os.makedirs(request["output"], exist_ok=True)
+            files = self.generator.write(setup, request["output"], request.get("compact", False))
+        return dict(setup, materials=[dst for (src, dst) in setup["materials"]], files=files)
+
+    def stats(self):
+        return {"requests": self.metrics.stats(), "templates": template_cache.stats(),
+                "geometries": self.geometries.stats()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # client_address is empty for unix sockets
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.service.debug:
+            super().log_message(format, *args)
+
+    def reply(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.reply(200, self.server.service.stats())
+        elif self.path == "/health":
+            self.reply(200, {"status": "ok"})
+        else:
+            self.reply(404, {"error": "unknown path %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/setup":
+            self.reply(404, {"error": "unknown path %s" % self.path})
+            return
+
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            setup = service.setup(request)
+        except (Exception, SystemExit) as e:
+            service.metrics.add(time.perf_counter() - start, error=True)
+            self.reply(400, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+
+        setup["time"] = time.perf_counter() - start
+        service.metrics.add(setup["time"])
+        self.reply(200, setup)
+
+
+class PoolMixIn():
+    """
+    Handle requests in a bounded pool of threads
+    """
+
+    workers = 4
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class PoolHTTPServer(PoolMixIn, HTTPServer):
+    pass
+
+
+class PoolUnixHTTPServer(PoolMixIn, HTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(service: SetupService, host: str = "127.0.0.1", port: int = 8765, unix_socket: Optional[str] = None,
+                workers: int = 4):
+    """
+    returns the server for service, on unix_socket if given or on host:port
+    """
+    if unix_socket:
+        server = PoolUnixHTTPServer(unix_socket, Handler)
+    else:
+        server = PoolHTTPServer((host, port), Handler)
+    server.service = service
+    server.pool = ThreadPoolExecutor(max_workers=workers)
+    return server
+
+
+def main():
+    """
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve setup generation requests for Feelpp/HiFiMagnet simu")
+    parser.add_argument("--socket", help="unix socket path", type=str, default=None)
+    parser.add_argument("--host", help="host (default is localhost)", type=str, default="127.0.0.1")
+    parser.add_argument("--port", help="port", type=int, default=8765)
+    parser.add_argument("-j", "--jobs", help="number of workers", type=int, default=4)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    service = SetupService(debug=args.debug)
+    server = make_server(service, args.host, args.port, args.socket, args.jobs)
+    print("magnetsetup serve on %s" % (args.socket if args.socket else "http://%s:%d" % (args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,44 +24,91 @@ mustache templates
 # TODO check for unit consistency
 # depending on Length base unit
 
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import sys
 import os
+import re
 import json
-import yaml
-import math
 
-from python_magnetgeo import Helix
-from python_magnetgeo import Ring
-from python_magnetgeo import InnerCurrentLead
-from python_magnetgeo import OuterCurrentLead
-from python_magnetgeo import Insert
-from python_magnetgeo import python_magnetgeo
+from .cache import template_cache, render
+from . import jsontemplate
+from . import jsonwriter
+from .units import convert_data
+from . import units
+from .model import magnet_data
+from .solver import solver_data
+from .profiling import profiled, stage
 
 class appenv():
+    """
+    App settings, loaded from settings.env on first use
+    """
     
-    def __init__(self, debug: bool = False):
-        self.url_api: str = None
+    def __init__(self, debug: bool = False, envfile: str = "settings.env"):
+        self.envfile: str = envfile
+        self.debug: bool = debug
         self.yaml_repo: Optional[str] = None
         self.mesh_repo: Optional[str] = None
-        self.template_repo: Optional[str] = None
+        self._settings: Optional[dict] = None
 
-        from decouple import Config, RepositoryEnv
-        envdata = RepositoryEnv("settings.env")
-        data = Config(envdata)
-        if debug:
-            print("appenv:", RepositoryEnv("settings.env").data)
+    def settings(self):
+        """
+        returns settings, parsing envfile on first call
+        """
+        if self._settings is None:
+            self._settings = {'URL_API': None, 'TEMPLATE_REPO': None, 'MAGNETDB_CACHE': None, 'MAGNETDB_TTL': None,
+                              'SETUP_CACHE': None, 'SETUP_CACHE_SIZE': None}
+            if os.path.isfile(self.envfile):
+                from decouple import Config, RepositoryEnv
+                envdata = RepositoryEnv(self.envfile)
+                data = Config(envdata)
+                if self.debug:
+                    print("appenv:", envdata.data)
+
+                self._settings['URL_API'] = data.get('URL_API')
+                for key in ['TEMPLATE_REPO', 'MAGNETDB_CACHE', 'MAGNETDB_TTL', 'SETUP_CACHE', 'SETUP_CACHE_SIZE']:
+                    if key in envdata:
+                        self._settings[key] = data.get(key)
+        return self._settings
+
+    @property
+    def url_api(self):
+        return self.settings()['URL_API']
+
+    @property
+    def template_repo(self):
+        return self.settings()['TEMPLATE_REPO']
+
+    def magnetdb(self, debug: bool = False):
+        """
+        returns the magnetdb client for url_api
+        """
+        from .magnetdb import get_client
 
-        self.url_api = data.get('URL_API')
-        if 'TEMPLATE_REPO' in envdata:
-            self.template_repo = data.get('TEMPLATE_REPO')
+        if not self.url_api:
+            raise Exception("URL_API is not defined (see %s)" % self.envfile)
+        ttl = self.settings()['MAGNETDB_TTL']
+        return get_client(self.url_api, cache_dir=self.settings()['MAGNETDB_CACHE'],
+                          ttl=float(ttl) if ttl else 3600, debug=debug)
+
+    def output_cache(self, debug: bool = False):
+        """
+        returns the cache of generated setups
+        """
+        from .outputcache import OutputCache
+
+        size = self.settings()['SETUP_CACHE_SIZE']
+        if size:
+            return OutputCache(self.settings()['SETUP_CACHE'], int(size) * 1024 * 1024, debug=debug)
+        return OutputCache(self.settings()['SETUP_CACHE'], debug=debug)
 
     def template_path(self, debug: bool = False):
         """
         returns template_repo
         """
-        if not self.template_repo:
+        template_repo = self.template_repo
+        if not template_repo:
             default_path = os.path.dirname(os.path.abspath(__file__))
             template_repo = os.path.join(default_path, "templates")
 
@@ -79,6 +126,7 @@ def loadconfig():
         magnetsetup = json.load(appcfg)
     return magnetsetup
 
+@profiled()
 def loadtemplates(appenv: appenv, appcfg: dict , method_data: List[str], linear: bool=True, debug: bool=False):
     """
     Load templates into a dict
@@ -139,26 +187,35 @@ def loadtemplates(appenv: appenv, appcfg: dict , method_data: List[str], linear:
     if model != 'mag':
         dict = Merge(dict, {"cooling": fcooling, "flux": fflux, "stats": [fstats_T, fstats_Power] })
 
-    if check_templates(dict):
+    if check_templates(dict, debug):
         pass
 
     return dict    
 
-def check_templates(templates: dict):
+def check_templates(templates: dict, debug: bool = False):
     """
     check if template file exist
+
+    templates are compiled into the template cache on the way
     """
-    print("\n\n=== Checking Templates ===")
+    if debug:
+        print("\n\n=== Checking Templates ===")
     for key in templates:
+        if key == "material_def":
+            continue
+
         if isinstance(templates[key], str):
-            print(key, templates[key])
-            with open(templates[key], "r") as f: pass
+            if debug:
+                print(key, templates[key])
+            template_cache.get(templates[key])
 
-        elif isinstance(templates[key], str):
+        elif isinstance(templates[key], list):
             for s in templates[key]:
-                print(key, s)
-                with open(s, "r") as f: pass
-    print("==========================\n\n")
+                if debug:
+                    print(key, s)
+                template_cache.get(s)
+    if debug:
+        print("==========================\n\n")
     
     return True
 
@@ -167,48 +224,36 @@ def query_db(appenv: appenv, mtype: str, name: str, debug: bool = False):
     Get object from magnetdb
     """
 
-    import requests
-    import requests.exceptions
-    # import ast
+    from .magnetdb import MagnetDBError
 
-    r = requests.get(url= appenv.url_api + '/' + mtype + '/mdata/' + name )
-    if debug: print("request:", r)
-    if (r.status_code == requests.codes.ok):
-        if debug: print("request:", r.text)
-        mdata = json.loads(r.text)
-        if debug:
-            print("query_db/mdata:", mdata)
-        # confdata = ast.literal_eval(r.text)
-        return mdata
-    else:
+    try:
+        mdata = appenv.magnetdb(debug).mdata(mtype, name)
+    except MagnetDBError as e:
+        if debug: print("query_db:", e)
         print("failed to retreive %s from db" % name)
-        list_mtype_db(appenv, mtype)
         print("available requested mtype in db are: ", list_mtype_db(appenv, mtype))
         sys.exit(1)
 
+    if debug:
+        print("query_db/mdata:", mdata)
+    return mdata
+
 def list_mtype_db(appenv: appenv, mtype: str, debug: bool = False):
     """
     List object of mtype stored in magnetdb
     """
 
-    import requests
-    import requests.exceptions
-    # import ast
+    from .magnetdb import MagnetDBError
+
+    try:
+        names = appenv.magnetdb(debug).names(mtype)
+    except MagnetDBError as e:
+        if debug: print("list_mtype_db:", e)
+        return None
 
-    names = []
-    if mtype in ["Helix", "Bitter", "Supra"]:
-        mtype = "mpart"
-    r = requests.get(url= appenv.url_api + '/' + mtype + 's/' )
     if debug:
-        print("url=%s", appenv.url_api)
-        print("request(url=%s):" % (appenv.url_api + '/' + mtype + 's/'), r)
-    if (r.status_code == requests.codes.ok):
-        data = json.loads(r.text)
-        # data = ast.literal_eval(r.text)
-        if debug:
-            print("list_mtype_db:", data)
-        return [ d["name"] for d in data ]
-    pass
+        print("list_mtype_db:", names)
+    return names
 
 def Merge(dict1, dict2):
     """
@@ -218,6 +263,7 @@ def Merge(dict1, dict2):
     res = {**dict1, **dict2}
     return res    
 
+@profiled()
 def load_object(appenv: appenv, datafile: str, debug: bool = False):
     """
     Load object props
@@ -231,78 +277,29 @@ def load_object(appenv: appenv, datafile: str, debug: bool = False):
             confdata = json.load(cfgdata)
     return confdata
 
+@profiled()
 def load_object_from_db(appenv: appenv, mtype: str, name: str, debug: bool = False):
     """
     Load object props from db
-    """
 
-    if not mtype in ["msite", "magnet", "Helix", "Bitter", "Supra", "material"]:
-        raise("query_bd: %s not supported" % mtype)
-    
-    return query_db(appenv, mtype, name, debug)
-
-def convert_data(distance_unit, confdata, gdata, h, mu0):
-    """
-    Convert the input in distance_unit ('meter' or millimeter).
+    magnet and msite are returned with their parts and materials resolved
     """
-    
-    import warnings
-    from pint import UnitRegistry, Unit, Quantity
 
-    # Ignore warning for pint
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        Quantity([])
-
-    # Pint configuration
-    ureg = UnitRegistry()
-    ureg.default_system = 'SI'
-    ureg.autoconvert_offset_to_baseunit = True
-
-    (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
-
-    confdata_convert = confdata.copy()
-
-    for mtype in ["Helix", "Ring", "Lead"]:
-        for i in range(len(confdata_convert[mtype])):
-            
-            # ThermalConductivity : W/m/K --> W/distance_unit/K
-            confdata_convert[mtype][i]["material"]["ThermalConductivity"] = Quantity( confdata_convert[mtype][i]["material"]["ThermalConductivity"], ureg.watt / ureg.meter / ureg.kelvin ).to( ureg.watt / ureg.Unit(distance_unit) / ureg.kelvin ).magnitude
-            
-            # Young : kg/m/s --> kg/distance_unit/s
-            confdata_convert[mtype][i]["material"]["Young"] = Quantity( confdata_convert[mtype][i]["material"]["Young"], ureg.kilogram / ureg.meter / ureg.second ).to( ureg.kilogram / ureg.Unit(distance_unit) / ureg.second ).magnitude
-            
-            # VolumicMass : kg/m3 --> kg/distance_unit**3
-            confdata_convert[mtype][i]["material"]["VolumicMass"] = Quantity( confdata_convert[mtype][i]["material"]["VolumicMass"], ureg.kilogram / ureg.meter**3 ).to( ureg.kilogram / ureg.Unit(distance_unit)**3 ).magnitude
-            
-            # ElectricalConductivity : S/m --> S/distance_unit
-            confdata_convert[mtype][i]["material"]["ElectricalConductivity"] = Quantity( confdata_convert[mtype][i]["material"]["ElectricalConductivity"], ureg.siemens / ureg.meter ).to( ureg.siemens / ureg.Unit(distance_unit) ).magnitude
-
-            # Rpe : kg/m/s --> kg/distance_unit/s
-            confdata_convert[mtype][i]["material"]["Rpe"] = Quantity( confdata_convert[mtype][i]["material"]["Rpe"], ureg.kilogram / ureg.meter / ureg.second ).to( ureg.kilogram / ureg.Unit(distance_unit) / ureg.second ).magnitude
-
-    # Distances : mm -> distance_unit
-    R1_convert   = Quantity( R1, ureg.millimeter ).to( ureg.Unit(distance_unit) ).magnitude.tolist()
-    R2_convert   = Quantity( R2, ureg.millimeter ).to( ureg.Unit(distance_unit) ).magnitude.tolist()
-    Z1_convert   = Quantity( Z1, ureg.millimeter ).to( ureg.Unit(distance_unit) ).magnitude.tolist()
-    Z2_convert   = Quantity( Z2, ureg.millimeter ).to( ureg.Unit(distance_unit) ).magnitude.tolist()
-    Zmin_convert = Quantity( Zmin, ureg.millimeter ).to( ureg.Unit(distance_unit) ).magnitude.tolist()
-    Zmax_convert = Quantity( Zmax, ureg.millimeter ).to( ureg.Unit(distance_unit) ).magnitude.tolist()
-
-    # Surfaces : mm2 -> distance_unit2
-    Dh_convert   = Quantity( Dh, ureg.millimeter**2 ).to( ureg.Unit(distance_unit)**2 ).magnitude.tolist()
-    Sh_convert   = Quantity( Sh, ureg.millimeter**2 ).to( ureg.Unit(distance_unit)**2 ).magnitude.tolist()
-
-    gdata_convert = (NHelices, NRings, NChannels, Nsections, R1_convert, R2_convert,
-                    Z1_convert, Z2_convert, Zmin_convert, Zmax_convert, Dh_convert, Sh_convert)
+    if not mtype in ["msite", "magnet", "Helix", "Bitter", "Supra", "material"]:
+        raise Exception("query_bd: %s not supported" % mtype)
 
-    # MagnetPermeability of vacuum : H/m --> H/distance_unit
-    mu0_convert = Quantity( mu0, ureg.henry / ureg.meter ).to( ureg.henry / ureg.Unit(distance_unit) ).magnitude
+    if mtype in ["msite", "magnet"]:
+        from .magnetdb import MagnetDBError
+        from .resolver import resolve
 
-    # Convection coefficients : W/m2/K --> W/distance_unit**2/K
-    h_convert = Quantity( h, ureg.watt / ureg.meter**2 / ureg.kelvin ).to( ureg.watt / ureg.Unit(distance_unit)**2 / ureg.kelvin ).magnitude
+        try:
+            return resolve(appenv.magnetdb(debug), mtype, name, debug=debug)
+        except MagnetDBError as e:
+            print("failed to retreive %s from db (%s)" % (name, e))
+            print("available requested mtype in db are: ", list_mtype_db(appenv, mtype))
+            sys.exit(1)
 
-    return confdata_convert, gdata_convert, h_convert, mu0_convert
+    return query_db(appenv, mtype, name, debug)
 
 def create_cfg(cfgfile:str, name: str, nonlinear: bool, jsonfile: str, template: str, method_data: List[str], debug: bool=False):
     """
@@ -310,6 +307,22 @@ def create_cfg(cfgfile:str, name: str, nonlinear: bool, jsonfile: str, template:
     """
     print("create_cfg %s from %s" % (cfgfile, template) )
 
+    mdata = render_cfg(name, nonlinear, jsonfile, template, method_data, debug)
+    with open(cfgfile, "w") as out:
+        out.write(mdata)
+    
+    pass
+
+@profiled()
+def render_cfg(name: str, nonlinear: bool, jsonfile: str, template: str, method_data: List[str], debug: bool=False,
+               solver: Optional[dict] = None, np: Optional[int] = None):
+    """
+    Return the cfg file content
+
+    solver: solver options (see solver_data), presets without size estimate if None
+    np: number of MPI processes (the mesh is partitioned if np > 1)
+    """
+
     dim = 2
     if method_data[2] == "3D":
         dim = 3
@@ -331,18 +344,16 @@ def create_cfg(cfgfile:str, name: str, nonlinear: bool, jsonfile: str, template:
         "jsonfile": jsonfile,
         "mesh": mesh,
         "scale": 0.001,
-        "partition": 0
+        "partition": 1 if (np is not None and np > 1) else 0,
+        "solver": solver if solver is not None else solver_data(method_data, nonlinear, debug=debug)
     }
     
     mdata = entry_cfg(template, data, debug)
     if debug:
         print("create_cfg/mdata=", mdata)
+    return mdata
 
-    with open(cfgfile, "x") as out:
-        out.write(mdata)
-    
-    pass
-
+@profiled()
 def create_params(gdata: tuple, h: float, mu0: float, method_data: List[str], debug: bool=False):             # TODO : better manage of h
     """
     Return params_dict, the dictionnary of section \"Parameters\" for JSON file.
@@ -397,7 +408,43 @@ def create_params(gdata: tuple, h: float, mu0: float, method_data: List[str], de
 
     return params_data
 
-def create_materials(gdata: tuple, idata: Optional[List], confdata: dict, templates: dict, method_data: List[str], debug: bool = False):
+# name used to render a material once for all the parts sharing it
+material_placeholder = "__MAGNETSETUP_NAME__"
+
+def rename(data, name: str, placeholder: str = material_placeholder):
+    """
+    Return a copy of data with placeholder replaced by name in keys and strings
+    """
+    if isinstance(data, str):
+        return data.replace(placeholder, name)
+    if isinstance(data, dict):
+        return { rename(key, name, placeholder): rename(value, name, placeholder) for (key, value) in data.items() }
+    if isinstance(data, list):
+        return [ rename(value, name, placeholder) for value in data ]
+    return data
+
+def material_key(material):
+    """
+    Return a hashable key for material
+    """
+    try:
+        hash(material)
+        return material
+    except TypeError:
+        return json.dumps(material, sort_keys=True, default=repr)
+
+@profiled()
+def create_materials(gdata: tuple, idata: Optional[List], confdata: dict, templates: dict, method_data: List[str],
+                     debug: bool = False, shared: bool = False):
+    """
+    Return materials_dict, the dictionnary of section \"Materials\" for JSON file.
+
+    Each distinct (template, material) is rendered once.
+
+    shared (Axi only): define one conductor material per helix for all its
+    sections ("H%d_Cu%1%" with index1) and one insulator material for its
+    end sections (with a markers list)
+    """
     # TODO loop for Plateau (Axi specific)
     materials_dict = {}
 
@@ -406,6 +453,13 @@ def create_materials(gdata: tuple, idata: Optional[List], confdata: dict, templa
 
     (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
 
+    rendered = {}
+    def material_entry(template: str, name: str, material):
+        key = (template, material_key(material))
+        if not key in rendered:
+            rendered[key] = entry(template, Merge({'name': material_placeholder}, material), debug)[material_placeholder]
+        return rename(rendered[key], name)
+
     # Loop for Helix
     for i in range(NHelices):
         if method_data[2] == "3D":
@@ -423,47 +477,54 @@ def create_materials(gdata: tuple, idata: Optional[List], confdata: dict, templa
                         kapton_dict = { "name": "[\"Kapton%1%\"]", "index1": "0:%d" % item(1)}
                         mdata = entry(finsulator, Merge({'name': name, 'marker': kapton_dict}, confdata["Helix"][i]["insulator"]), debug)
                     materials_dict[name] = mdata[name]
+        elif shared:
+            # sections j==0 and j==Nsections+1: treated as insulator in Axi
+            name = "H%d_Isolant" % (i+1)
+            materials_dict[name] = material_entry(finsulator, name, confdata["Helix"][i]["material"])
+            materials_dict[name]["markers"] = ["H%d_Cu%d" % (i+1, 0), "H%d_Cu%d" % (i+1, Nsections[i]+1)]
+
+            name = "H%d_Cu%%1%%" % (i+1)
+            materials_dict[name] = material_entry(fconductor, name, confdata["Helix"][i]["material"])
+            materials_dict[name]["index1"] = "1:%d" % (Nsections[i]+1)
         else:
             # section j==0:  treated as insulator in Axi
-            mdata = entry(finsulator, Merge({'name': "H%d_Cu%d" % (i+1, 0)}, confdata["Helix"][i]["material"]), debug)
-            materials_dict["H%d_Cu%d" % (i+1, 0)] = mdata["H%d_Cu%d" % (i+1, 0)]
+            name = "H%d_Cu%d" % (i+1, 0)
+            materials_dict[name] = material_entry(finsulator, name, confdata["Helix"][i]["material"])
         
             # load conductor template
             for j in range(1,Nsections[i]+1):
-                mdata = entry(fconductor, Merge({'name': "H%d_Cu%d" % (i+1, j)}, confdata["Helix"][i]["material"]), debug)
-                materials_dict["H%d_Cu%d" % (i+1, j)] = mdata["H%d_Cu%d" % (i+1, j)]
+                name = "H%d_Cu%d" % (i+1, j)
+                materials_dict[name] = material_entry(fconductor, name, confdata["Helix"][i]["material"])
 
             # section j==Nsections+1:  treated as insulator in Axi
-            mdata = entry(finsulator, Merge({'name': "H%d_Cu%d" % (i+1, Nsections[i]+1)}, confdata["Helix"][i]["material"]), debug)
-            materials_dict["H%d_Cu%d" % (i+1, Nsections[i]+1)] = mdata["H%d_Cu%d" % (i+1, Nsections[i]+1)]
+            name = "H%d_Cu%d" % (i+1, Nsections[i]+1)
+            materials_dict[name] = material_entry(finsulator, name, confdata["Helix"][i]["material"])
 
     # loop for Rings
     for i in range(NRings):
+        name = "R%d" % (i+1)
         if method_data[2] == "3D":
-            mdata = entry(fconductor, Merge({'name': "R%d" % (i+1)}, confdata["Ring"][i]["material"]), debug)
+            materials_dict[name] = material_entry(fconductor, name, confdata["Ring"][i]["material"])
         else:
-            mdata = entry(finsulator, Merge({'name': "R%d" % (i+1)}, confdata["Ring"][i]["material"]), debug)
-        materials_dict["R%d" % (i+1)] = mdata["R%d" % (i+1)]
+            materials_dict[name] = material_entry(finsulator, name, confdata["Ring"][i]["material"])
         
     # Leads: 
     if method_data[2] == "3D" and confdata["Lead"]:
-        mdata = entry(fconductor, Merge({'name': "iL1"}, confdata["Lead"][0]["material"]), debug)
-        materials_dict["iL1"] = mdata["iL1"]
-
-        mdata = entry(fconductor, Merge({'name': "oL2"}, confdata["Lead"][1]["material"]), debug)
-        materials_dict["oL2"] = mdata["oL2"]
+        materials_dict["iL1"] = material_entry(fconductor, "iL1", confdata["Lead"][0]["material"])
+        materials_dict["oL2"] = material_entry(fconductor, "oL2", confdata["Lead"][1]["material"])
 
     return materials_dict
 
-def create_bcs(args,
-               boundary_meca: List, 
+@profiled()
+def create_bcs(boundary_meca: List, 
                boundary_maxwell: List,
                boundary_electric: List,
                boundary_Therm_Neu: List,
                boundary_Electric_Neu: List,
                gdata: tuple, confdata: dict, templates: dict, method_data: List[str], debug: bool = False):
 
-    print("create_bcs from templates")
+    if debug:
+        print("create_bcs from templates")
     electric_bcs_dir = { 'boundary_Electric_Dir': []} # name, value, vol
     electric_bcs_neu = { 'boundary_Electric_Neu': []} # name, value
     thermic_bcs_rob = { 'boundary_Therm_Robin': []} # name, expr1, expr2
@@ -473,7 +534,7 @@ def create_bcs(args,
     
     (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
     
-    if args.model != 'mag':
+    if method_data[3] != 'mag':
         fcooling = templates["cooling"]
     
         for i in range(NChannels):
@@ -525,84 +586,115 @@ def create_bcs(args,
             
     pass
 
-def create_json(jsonfile: str, mdict: dict, mmat: dict, mpost: dict, templates: dict, method_data: List[str], debug: bool = False):
+def create_json(jsonfile: str, mdict: dict, mmat: dict, mpost: dict, templates: dict, method_data: List[str],
+                compact: bool = False, debug: bool = False):
     """
     Create a json model file
+
+    compact: write without indentation
     """
 
     print("create_json =", jsonfile)
-    data = entry(templates["model"], mdict, debug)
+    data = create_model(mdict, mmat, mpost, templates, method_data, debug)
 
-    # material section
+    jsonwriter.write(jsonfile, data, compact, debug)
+    pass
+
+def post_sections(mpost: dict, templates: dict, method_data: List[str]):
+    """
+    Return the statistics added to the PostProcess section of the model
+
+    as a list of (name, section, template, rdata), the rendered template
+    holding the statistics in its name entry
+    """
+    sections = []
+    if method_data[0] == 'cfpdes' and method_data[3] != 'mag':
+        if method_data[0] == "cfpdes":
+            section = "heat"
+        elif method_data[0] == "CG" or method_data[0] == "HDG":
+            section = "temperature"
+        sections.append(("Flux", section, templates["flux"], mpost["flux"]))
+        sections.append(("Stats_T", section, templates["stats"][0], mpost["meanT_H"])) # { "meanT_H": [] }
+
+        section = "electric"
+        if method_data[0] == "cfpdes" and method_data[2] == "Axi" and method_data[3] == 'thelec': section = "heat" 
+        elif method_data[0] == "cfpdes" and method_data[2] == "Axi" and method_data[3] != 'thelec': section = "magnetic"
+        # elif method_data[0] == "CG" or method_data[0] == "HDG" : section = "magnetic"
+        sections.append(("Stats_Power", section, templates["stats"][1], mpost["power_H"])) # { "Power_H": [] }
+    return sections
+
+def render_post(name: str, template: str, rdata: dict, debug: bool = False):
+    """
+    Return the statistics of post section name (see post_sections)
+    """
+    if debug: print(name)
+    return entry(template, rdata, debug)[name]
+
+def add_materials(data: dict, mmat: dict):
+    """
+    Add materials to the json model data
+    """
     if "Materials" in data:
         for key in mmat:
             data["Materials"][key] = mmat[key]
     else:
         data["Materials"] = mmat
+
+def add_post(data: dict, section: str, stats: dict):
+    """
+    Add stats to the Statistics of PostProcess section of the json model data
+    """
+    for md in stats:
+        data["PostProcess"][section]["Measures"]["Statistics"][md] = stats[md]
+
+@profiled()
+def create_model(mdict: dict, mmat: dict, mpost: dict, templates: dict, method_data: List[str], debug: bool = False):
+    """
+    Return the json model as a dict
+    """
+
+    data = entry(templates["model"], mdict, debug)
+
+    # material section
+    add_materials(data, mmat)
     
     # postprocess
-    if method_data[0] == 'cfpdes':
-        if method_data[3] != 'mag':
-            
-            if method_data[0] == "cfpdes":
-                section = "heat"
-            elif method_data[0] == "CG" or method_data[0] == "HDG":
-                section = "temperature"
-
-            if debug: print("flux")
-            flux_data = mpost["flux"]
-            add = data["PostProcess"][section]["Measures"]["Statistics"]
-            odata = entry(templates["flux"], flux_data, debug)
-            for md in odata["Flux"]:
-                data["PostProcess"][section]["Measures"]["Statistics"][md] = odata["Flux"][md]
-
-            if debug: print("meanT_H")
-            meanT_data = mpost["meanT_H"] # { "meanT_H": [] }
-            add = data["PostProcess"][section]["Measures"]["Statistics"]
-            odata = entry(templates["stats"][0], meanT_data, debug)
-            for md in odata["Stats_T"]:
-                data["PostProcess"][section]["Measures"]["Statistics"][md] = odata["Stats_T"][md]
-
-        if debug: print("power_H")
-        section = "electric"
-        if method_data[0] == "cfpdes" and method_data[2] == "Axi" and method_data[3] == 'thelec': section = "heat" 
-        elif method_data[0] == "cfpdes" and method_data[2] == "Axi" and method_data[3] != 'thelec': section = "magnetic"
-        # elif method_data[0] == "CG" or method_data[0] == "HDG" : section = "magnetic"
-        powerH_data = mpost["power_H"] # { "Power_H": [] }
-        add = data["PostProcess"][section]["Measures"]["Statistics"]
-        if method_data[3] != 'mag':
-            odata = entry(templates["stats"][1], powerH_data, debug)
-            for md in odata["Stats_Power"]:
-                data["PostProcess"][section]["Measures"]["Statistics"][md] = odata["Stats_Power"][md]
+    for (name, section, template, rdata) in post_sections(mpost, templates, method_data):
+        add_post(data, section, render_post(name, template, rdata, debug))
     
-    mdata = json.dumps(data, indent = 4)
-
-    # print("corrected data:", re.sub(r'},\n					    	}\n', '}\n}\n', data))
-    # data = re.sub(r'},\n					    	}\n', '}\n}\n', data)
-    with open(jsonfile, "x") as out:
-        out.write(mdata)
-    pass
+    return data
 
 def entry_cfg(template: str, rdata: dict, debug: bool = False):
-    import chevron
-
     if debug:
         print("entry/loading %s" % str(template), type(template))
         print("entry/rdata:", rdata)
-    with open(template, "r") as f:
-        jsonfile = chevron.render(f, rdata)
+    jsonfile = render(template, rdata, debug=debug)
     jsonfile = jsonfile.replace("\'", "\"")
     return jsonfile
 
-def entry(template: str, rdata: dict, debug: bool = False):
-    import chevron
-    import re
-    
+@profiled()
+def entry(template: str, rdata: dict, debug: bool = False, structured: bool = True):
+    """
+    Render a json template into a dict
+
+    structured: substitute rdata directly into the template tree,
+    falls back to text rendering for templates that are not json trees
+    """
     if debug:
         print("entry/loading %s" % str(template), type(template))
         print("entry/rdata:", rdata)
-    with open(template, "r") as f:
-        jsonfile = chevron.render(f, rdata)
+
+    if structured:
+        try:
+            mdata = jsontemplate.render(template, rdata, debug)
+            if debug:
+                print("entry/data (structured):\n", mdata)
+            return mdata
+        except jsontemplate.TemplateSyntaxError as e:
+            if debug:
+                print("entry/%s: %s, fallback to text rendering" % (template, e))
+
+    jsonfile = render(template, rdata, debug=debug)
     jsonfile = jsonfile.replace("\'", "\"")
     
     if debug:
@@ -616,6 +708,430 @@ def entry(template: str, rdata: dict, debug: bool = False):
    
     return mdata
     
+@profiled()
+def load_geometry(yamlfile: str, geom: str, basedir: str = "", debug: bool = False, cache: bool = True):
+    """
+    Load insert geometry from yamlfile
+
+    cache: restore the geometry from the on-disk cache when the yaml files are unchanged
+
+    returns cad, gdata (a Geometry) and the helices insulators (3D only)
+    """
+    from .geometry import GeometryDiskCache, load_yaml, load_insulators, main_characteristics
+    from .model import Geometry
+
+    store = GeometryDiskCache(debug=debug) if cache else None
+    if store is not None:
+        with stage("geometry_cache"):
+            data = store.get(yamlfile, geom, basedir)
+        if data is not None:
+            (cad, gdata, insulators) = data
+            return (cad, Geometry.from_tuple(gdata), insulators)
+
+    from python_magnetgeo import Insert
+
+    with stage("yaml"):
+        cad = load_yaml(os.path.join(basedir, yamlfile))
+    if not isinstance(cad, Insert):
+        raise Exception("expected Insert yaml file")
+
+    with stage("get_main_characteristics"):
+        gdata = Geometry.from_tuple(main_characteristics(cad, basedir))
+
+    insulators = []
+    if geom == "3D":
+        with stage("yaml"):
+            insulators = load_insulators(cad, basedir)
+
+    if store is not None:
+        with stage("geometry_cache"):
+            files = [os.path.relpath(f, basedir) if basedir else f for f in geometry_files(cad, yamlfile, basedir)]
+            store.put(yamlfile, geom, (cad, gdata, insulators), files, basedir)
+
+    return (cad, gdata, insulators)
+
+def geometry_files(cad, yamlfile: str, basedir: str = ""):
+    """
+    Return the yaml files defining the insert
+    """
+    files = [os.path.join(basedir, yamlfile)]
+    for parts in ["Helices", "Rings", "CurrentLeads"]:
+        for part in getattr(cad, parts, []):
+            filename = os.path.join(basedir, str(part) + ".yaml")
+            if isinstance(part, str) and os.path.isfile(filename):
+                files.append(filename)
+    return files
+
+def template_files(templates: dict):
+    """
+    Return the template files used by templates
+    """
+    files = []
+    for key in templates:
+        if key == "material_def":
+            continue
+        if isinstance(templates[key], str):
+            files.append(templates[key])
+        elif isinstance(templates[key], list):
+            files += templates[key]
+    return files
+
+@profiled()
+def create_markers(cad, gdata: tuple, geom: str, debug: bool = False):
+    """
+    Return a dict holding the parts, indices and boundaries markers
+    """
+
+    (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
+
+    part_thermic = []
+    part_electric = []
+    index_electric = []
+    index_Helices = []
+    index_Insulators = []
+
+    boundary_meca = []
+    boundary_maxwell = []
+    boundary_electric = []
+    boundary_Therm_Neu = []
+    boundary_Electric_Neu = []
+
+    for i in range(NHelices):
+        part_electric.append("H{}_Cu".format(i+1))
+        if geom == "Axi":
+            for j in range(Nsections[i]+2):
+                part_thermic.append("H{}_Cu{}".format(i+1,j))
+            for j in range(Nsections[i]):
+                index_electric.append( [str(i+1),str(j+1)] )
+            index_Helices.append(["0:{}".format(Nsections[i]+2)])
+
+        else:
+            part_thermic.append("H{}_Cu".format(i+1))
+            #index_Insulators.append((insulator_name, insulator_number))        <--- !! WARNING !! Ignore the insulator for 3D geometry
+
+        boundary_Therm_Neu.append("H{}_Interface0".format(i+1))
+        boundary_Therm_Neu.append("H{}_Interface1".format(i+1))
+
+        boundary_Electric_Neu.append("H{}_Interface0".format(i+1))
+        boundary_Electric_Neu.append("H{}_Interface1".format(i+1))
+
+    for i in range(1,NRings+1):
+        part_thermic.append("R{}".format(i))
+        part_electric.append("R{}".format(i))
+
+        if i % 2 == 1 :
+            boundary_meca.append("R{}_BP".format(i))
+            boundary_Therm_Neu.append("R{}_BP".format(i))
+            boundary_Electric_Neu.append("R{}_BP".format(i))
+        else :
+            boundary_meca.append("R{}_HP".format(i))
+            boundary_Therm_Neu.append("R{}_HP".format(i))
+            boundary_Electric_Neu.append("R{}_HP".format(i))
+
+    for i in range(NChannels):
+        boundary_Electric_Neu.append("Channel{}".format(i))
+
+    # Add currentLeads
+    if  geom == "3D" and len(cad.CurrentLeads):
+        part_thermic.append("iL1")
+        part_thermic.append("oL2")
+        part_electric.append("iL1")
+        part_electric.append("oL2")
+        boundary_electric.append(["Inner1_LV0", "iL1", "0"])
+        boundary_electric.append(["OuterL2_LV0", "oL2", "V0:V0"])
+
+        boundary_meca.append("Inner1_LV0")
+        boundary_meca.append("OuterL2_LV0")
+
+        boundary_maxwell.append("InfV00")
+        boundary_maxwell.append("InfV01")
+
+        boundary_Therm_Neu.append("Inner1_R0n")
+        boundary_Therm_Neu.append("Inner1_R1n")
+        boundary_Therm_Neu.append("Inner1_LV0")
+        boundary_Therm_Neu.append("Inner1_FixingHoles")
+        boundary_Therm_Neu.append("OuterL2_R0n")
+        boundary_Therm_Neu.append("OuterL2_R1n")
+        boundary_Therm_Neu.append("OuterL2_LV0")
+        boundary_Therm_Neu.append("OuterL2_CooledSurfaces")
+        boundary_Therm_Neu.append("OuterL2_Others")
+
+        boundary_Electric_Neu.append("Inner1_R0n")
+        boundary_Electric_Neu.append("Inner1_R1n")
+        boundary_Electric_Neu.append("Inner1_FixingHoles")
+        boundary_Electric_Neu.append("OuterL2_R0n")
+        boundary_Electric_Neu.append("OuterL2_R1n")
+        boundary_Electric_Neu.append("OuterL2_CooledSurfaces")
+        boundary_Electric_Neu.append("OuterL2_Others")
+
+    else:
+        boundary_electric.append(["H1_V0", "H1", "0"])
+        boundary_electric.append(["H%d_V0" % NHelices, "H%d" % NHelices, "V0:V0"])
+
+        boundary_meca.append("H1_HP")
+        boundary_meca.append("H_HP")
+
+    boundary_maxwell.append("InfV1")
+    boundary_maxwell.append("InfR1")
+
+    if debug:
+        print("part_electric:", part_electric)
+        print("part_thermic:", part_thermic)
+
+    return {
+        "part_thermic": part_thermic,
+        "part_electric": part_electric,
+        "index_electric": index_electric,
+        "index_Helices": index_Helices,
+        "index_Insulators": index_Insulators,
+        "boundary_meca": boundary_meca,
+        "boundary_maxwell": boundary_maxwell,
+        "boundary_electric": boundary_electric,
+        "boundary_Therm_Neu": boundary_Therm_Neu,
+        "boundary_Electric_Neu": boundary_Electric_Neu
+    }
+
+@profiled()
+def create_post(cad, gdata: tuple, markers: dict, geom: str):
+    """
+    Return mpost, the data for postprocess templates
+    """
+
+    (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
+    index_Helices = markers["index_Helices"]
+
+    powerH_data = { "Power_H": [] }
+    meanT_data = { "meanT_H": [] }
+    if geom == "Axi":
+        for i in range(NHelices) :
+            powerH_data["Power_H"].append( {"header": "Power_H{}".format(i+1), "name": "H{}_Cu%1%".format(i+1), "index": index_Helices[i]} )
+            meanT_data["meanT_H"].append( {"header": "MeanT_H{}".format(i+1), "name": "H{}_Cu%1%".format(i+1), "index": index_Helices[i]} )
+    else:
+        for i in range(NHelices) :
+            powerH_data["Power_H"].append( {"header": "Power_H{}".format(i+1), "name": "H{}_Cu".format(i+1)} )
+            meanT_data["meanT_H"].append( {"header": "MeanT_H{}".format(i+1), "name": "H{}_Cu".format(i+1)} )
+        # TODO add Glue/Kaptons
+        for i in range(NRings) :
+            powerH_data["Power_H"].append( {"header": "Power_R{}".format(i+1), "name": "R{}".format(i+1)} )
+            meanT_data["meanT_H"].append( {"header": "MeanT_R{}".format(i+1), "name": "R{}".format(i+1)} )
+
+        if len(cad.CurrentLeads):
+            powerH_data["Power_H"].append( {"header": "Power_iL1", "name": "iL1"} )
+            powerH_data["Power_H"].append( {"header": "Power_oL2", "name": "oL2"} )
+            meanT_data["meanT_H"].append( {"header": "MeanT_iL1", "name": "iL1"} )
+            meanT_data["meanT_H"].append( {"header": "MeanT_oL2", "name": "oL2"} )
+
+    return {
+        "flux": {'index_h': "0:%s" % str(NChannels)},
+        "meanT_H": meanT_data ,
+        "power_H": powerH_data
+    }
+
+def setup_name(basename: str, method_data: List[str], nonlinear: bool, suffix: str = ""):
+    """
+    Return the name of the json model file
+    """
+    jsonfile = basename
+    jsonfile += "-" + method_data[0]
+    jsonfile += "-" + method_data[3]
+    if nonlinear:
+        jsonfile += "-nonlinear"
+    jsonfile += "-" + method_data[2]
+    jsonfile += suffix
+    jsonfile += "-sim.json"
+    return jsonfile
+
+def material_files(MyEnv: appenv, AppCfg: dict, method_data: List[str], templates: dict, debug: bool = False):
+    """
+    Return the list of (src, dst) additional material json files
+    """
+    [method, time, geom, model, cooling] = method_data
+
+    files = []
+    if method == "cfpdes":
+        for mfile in templates["material_def"]:
+            filename = AppCfg[method][time][geom][model]["filename"][mfile]
+            src = os.path.join(MyEnv.template_path(), method, geom, model, filename)
+            dst = mfile + "-" + method + "-" + model + "-" + geom + ".json"
+            if debug:
+                print(mfile, "filename=", filename, "src=%s" % src, "dst=%s" % dst)
+            files.append((src, dst))
+    return files
+
+def setup_data(MyEnv: appenv, AppCfg: dict, method_data: List[str], nonlinear: bool,
+               cad, yamlfile: str, gdata: tuple, confdata: dict, h: float, mu0: float,
+               jsonfile: str, templates: Optional[dict] = None, debug: bool = False, shared: bool = False,
+               optimize: Optional[List[str]] = None, constants: Optional[List[str]] = None, production: bool = False,
+               np: Optional[int] = None, init: Optional[Dict[str, str]] = None, dofs: Optional[int] = None):
+    """
+    Return the setup for method_data, without writing any file
+
+    gdata, confdata, h and mu0 are expected to be already converted
+    (see convert_data)
+    shared: define one material per helix in Axi (see create_materials)
+    optimize: passes of the expressions optimizer to apply, all if empty (see expressions),
+    constants: Parameters to fold into the expressions
+    production: solver options without monitors (see solver_data)
+    np: number of MPI processes (see resources.estimate)
+    init: init files of the fields (see warmstart)
+    dofs: number of dofs for the choice of the solver (see resources.estimate), estimated from gdata if None
+
+    returns a dict with:
+    cfgfile, cfg: name and content of the cfg file
+    jsonfile, model: name of the json model file and the model dict
+    materials: list of (src, dst) additional material json files
+    optimize: statistics of the expressions optimizer (None without optimize)
+    """
+
+    if templates is None:
+        templates = loadtemplates(MyEnv, AppCfg, method_data, (not nonlinear) )
+
+    (markers, mdict, mpost) = setup_inputs(cad, gdata, confdata, h, mu0, templates, method_data, debug, init)
+    mmat = create_materials(gdata, markers["index_Insulators"], confdata, templates, method_data, debug, shared)
+
+    # cfg
+    cfgfile = jsonfile.replace(".json", ".cfg")
+    name = yamlfile.replace(".yaml","")
+    if debug:
+        print("create_cfg %s from %s" % (cfgfile, templates["cfg"]) )
+    [method, time, geom, model, cooling] = method_data
+    solver = solver_data(method_data, nonlinear, gdata, AppCfg[method][time][geom][model].get("solver", {}),
+                         production, dofs, debug)
+    cfg = render_cfg(name, nonlinear, jsonfile, templates["cfg"], method_data, debug, solver, np)
+
+    # json
+    if debug:
+        print("create_json =", jsonfile)
+    mdata = create_model(mdict, mmat, mpost, templates, method_data, debug)
+    stats = None
+    if optimize is not None:
+        from .expressions import optimize_model, passes
+        with stage("optimize"):
+            stats = optimize_model(mdata, constants or [], optimize or passes, debug)
+
+    return {
+        "cfgfile": cfgfile,
+        "cfg": cfg,
+        "jsonfile": jsonfile,
+        "model": mdata,
+        "materials": material_files(MyEnv, AppCfg, method_data, templates, debug),
+        "optimize": stats
+    }
+
+def setup_inputs(cad, gdata: tuple, confdata: dict, h: float, mu0: float, templates: dict, method_data: List[str],
+                 debug: bool = False, init: Optional[Dict[str, str]] = None):
+    """
+    Return the markers, the data of the model template and the data of
+    the post-processing templates
+
+    init: init files of the fields (see warmstart), Tinit is used without temperature
+    """
+    [method, time, geom, model, cooling] = method_data
+    if init is None:
+        init = {}
+
+    markers = create_markers(cad, gdata, geom, debug)
+
+    # params section
+    params_data = create_params(gdata, h, mu0, method_data, debug)
+
+    # bcs section
+    bcs_data = create_bcs(markers["boundary_meca"],
+                          markers["boundary_maxwell"],
+                          markers["boundary_electric"],
+                          markers["boundary_Therm_Neu"],
+                          markers["boundary_Electric_Neu"],
+                          gdata, confdata, templates, method_data, debug) # merge all bcs dict
+
+    # build dict from geom for templates
+    main_data = {
+        "part_thermic": markers["part_thermic"],
+        "part_electric": markers["part_electric"],
+        "index_electric": markers["index_electric"],
+        "index_V0": markers["boundary_electric"],
+        "temperature_initfile": init.get("temperature", "tini.h5"),
+        "V_initfile": init.get("V", "Vini.h5"),
+        "temperature_init": "temperature" in init,
+        "V_init": "V" in init
+    }
+    mdict = Merge( Merge(main_data, params_data), bcs_data)
+
+    mpost = create_post(cad, gdata, markers, geom)
+    return (markers, mdict, mpost)
+
+def write_setup(setup: dict, wd: str = "", compact: bool = False, debug: bool = False):
+    """
+    Write setup (see setup_data) in wd
+
+    returns the list of created files
+    """
+    from shutil import copyfile
+
+    with stage("write_cfg"), open(os.path.join(wd, setup["cfgfile"]), "w") as out:
+        out.write(setup["cfg"])
+    with stage("write_json"):
+        jsonwriter.write(os.path.join(wd, setup["jsonfile"]), setup["model"], compact, debug)
+    files = [setup["cfgfile"], setup["jsonfile"]]
+
+    # copy some additional json file
+    with stage("copy_materials"):
+        for (src, dst) in setup["materials"]:
+            copyfile(src, os.path.join(wd, dst))
+            files.append(dst)
+    return files
+
+def create_setup(MyEnv: appenv, AppCfg: dict, method_data: List[str], nonlinear: bool,
+                 cad, yamlfile: str, gdata: tuple, confdata: dict, h: float, mu0: float,
+                 jsonfile: str, wd: str = "", debug: bool = False, cache = None, sources: Optional[List[str]] = None,
+                 compact: bool = False, shared: bool = False, optimize: Optional[List[str]] = None,
+                 constants: Optional[List[str]] = None, production: bool = False, np: Optional[int] = None,
+                 init: Optional[Dict[str, str]] = None, dofs: Optional[int] = None):
+    """
+    Create cfg, json model and material files for method_data in wd
+
+    gdata, confdata, h and mu0 are expected to be already converted
+    (see convert_data)
+
+    cache: OutputCache, files are restored from the cache when
+    the sources (insert yaml files), templates and data are unchanged
+    compact: write the json model without indentation
+    shared: define one material per helix in Axi (see create_materials)
+    optimize, constants, production, np, init, dofs: see setup_data
+
+    returns the list of created files
+    """
+
+    templates = loadtemplates(MyEnv, AppCfg, method_data, (not nonlinear) )
+    [method, time, geom, model, cooling] = method_data
+
+    if cache is not None:
+        with stage("output_cache"):
+            mfiles = material_files(MyEnv, AppCfg, method_data, templates)
+            key = cache.key((sources or []) + template_files(templates) + [src for (src, dst) in mfiles],
+                            [AppCfg[method][time][geom][model], method_data, nonlinear, jsonfile, yamlfile,
+                             confdata, gdata, h, mu0, compact, shared, optimize, constants or [], production, np, init or {}, dofs])
+            files = cache.restore(key, wd)
+        if files is not None:
+            print("create_setup: %s restored from cache" % jsonfile)
+            return files
+
+    setup = setup_data(MyEnv, AppCfg, method_data, nonlinear, cad, yamlfile, gdata, confdata, h, mu0,
+                       jsonfile, templates, debug, shared, optimize, constants, production, np, init, dofs)
+    if setup["optimize"] is not None:
+        print("optimize_json:", ", ".join("%s=%d" % item for item in setup["optimize"].items()))
+    files = write_setup(setup, wd, compact, debug)
+
+    if cache is not None:
+        with stage("output_cache"):
+            cache.store(key, files, wd)
+
+    if debug:
+        print("template cache:", template_cache.stats())
+        if cache is not None:
+            print("output cache:", cache.stats())
+
+    return files
+
 def main():
     """
     """
@@ -643,12 +1159,42 @@ def main():
     parser.add_argument("--distance_unit", help="distance's unit", type=str,
                     choices=['meter','millimeter'], default='meter')
 
+    parser.add_argument("--no-cache", help="do not use the cache of geometries and generated setups", dest="cache", action='store_false')
+    parser.add_argument("--compact", help="write json model without indentation", action='store_true')
+    parser.add_argument("--shared-materials", help="define one material per helix for all its sections (Axi)",
+                    dest="shared", action='store_true')
+    parser.add_argument("--optimize", help="optimize the expressions of the json model (default: all passes)",
+                    type=str, nargs='*', choices=["fold", "compare", "cse", "prune"], default=None)
+    parser.add_argument("--constants", help="Parameters to fold into the expressions (with --optimize)",
+                    type=str, nargs='+', default=[])
+    parser.add_argument("--mesh", help="mesh file, to estimate resources and check markers (default: look for <insert>.med, in Axi <insert>-Axi_withAir.msh or _p.json in wd)",
+                    type=str, default=None)
+    parser.add_argument("--cores", help="number of cores for the run (default: cores of this machine)", type=int, default=None)
+    parser.add_argument("--production", help="solver options for production runs (no monitors)", action='store_true')
+    parser.add_argument("--init-from", help="results directory of a previous run, its saved temperature and V are used as init files",
+                    dest="init_from", type=str, default=None)
+    parser.add_argument("--incremental", help="only render the parts of the setup whose templates or data changed",
+                    action='store_true')
+    parser.add_argument("--watch", help="update the setup incrementally when the inputs or templates change",
+                    action='store_true')
+    parser.add_argument("--profile", help="print time and memory per stage and save a chrome trace (default: magnetsetup-trace.json)",
+                    type=str, nargs='?', const="magnetsetup-trace.json", default=None)
+    parser.add_argument("--cprofile", help="save cProfile stats of stage (ex. entry) to <stage>.prof", type=str,
+                    action='append', default=[])
+
     parser.add_argument("--debug", help="activate debug", action='store_true')
     parser.add_argument("--verbose", help="activate verbose", action='store_true')
     args = parser.parse_args()
 
     if args.debug:
         print(args)
+    if args.optimize is not None and (args.incremental or args.watch):
+        parser.error("--optimize is not supported with --incremental or --watch")
+
+    if args.profile:
+        from .profiling import Profiler, enable
+        profiler = Profiler(cprofile=args.cprofile, debug=args.debug)
+        enable(profiler)
     
     # TODO make datafile/magnet exclusive one or the other
     
@@ -659,234 +1205,124 @@ def main():
     # loadconfig
     AppCfg = loadconfig()
 
-    # Get current dir
-    cwd = os.getcwd()
-    if args.wd:
-        os.chdir(args.wd)
-    
-    # load appropriate templates
     method_data = [args.method, args.time, args.geom, args.model, args.cooling]
-    templates = loadtemplates(MyEnv, AppCfg, method_data, (not args.nonlinear) )
 
-    # Get Object
-    if args.datafile != None:
-        confdata = load_object(MyEnv, args.datafile, args.debug)
-        jsonfile = args.datafile.replace(".json","")
-
-    if args.magnet != None:
-        confdata = load_object_from_db(MyEnv, "magnet", args.magnet, args.debug)
-        jsonfile = args.magnet
+    def generate():
+        """
+        load the inputs and create (or update) the setup
+        """
+        # Get Object
+        if args.datafile != None:
+            confdata = load_object(MyEnv, os.path.join(args.wd, args.datafile), args.debug)
+            basename = args.datafile.replace("-data.json","")
+
+        if args.magnet != None:
+            confdata = load_object_from_db(MyEnv, "magnet", args.magnet, args.debug)
+            basename = args.magnet
     
-    # load geom: yamlfile = confdata["geom"]
-    part_thermic = []
-    part_electric = []
-    index_electric = []
-    index_Helices = []
-    index_Insulators = []
-
-    boundary_meca = []
-    boundary_maxwell = []
-    boundary_electric = []
-    boundary_Therm_Neu = []
-    boundary_Electric_Neu = []
-
-    yamlfile = confdata["geom"]
-    with open(yamlfile, 'r') as cfgdata:
-        cad = yaml.load(cfgdata, Loader = yaml.FullLoader)
-        if isinstance(cad, Insert):
-            gdata = python_magnetgeo.get_main_characteristics(cad)
-            (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
-            mu0 = 4*math.pi*1e-7                                                                    # TODO : better manage of mu0
-            h = 58222.1                                                                             # TODO : better manage of h
-
-            print("Insert: %s" % cad.name, "NHelices=%d NRings=%d NChannels=%d" % (NHelices, NRings, NChannels))
-
-            for i in range(NHelices):
-                part_electric.append("H{}_Cu".format(i+1))
-                if args.geom == "Axi":
-                    for j in range(Nsections[i]+2):
-                        part_thermic.append("H{}_Cu{}".format(i+1,j))
-                    for j in range(Nsections[i]):
-                        index_electric.append( [str(i+1),str(j+1)] )
-                    index_Helices.append(["0:{}".format(Nsections[i]+2)])
-
-                else:
-                    part_thermic.append("H{}_Cu".format(i+1))
-                    with open(cad.Helices[i]+".yaml", "r") as f:
-                        hhelix = yaml.load(f, Loader = yaml.FullLoader)
-                        (insulator_name, insulator_number) = hhelix.insulators()
-                        #index_Insulators.append((insulator_name, insulator_number))        <--- !! WARNING !! Ignore the insulator for 3D geometry
-                
-                boundary_Therm_Neu.append("H{}_Interface0".format(i+1))
-                boundary_Therm_Neu.append("H{}_Interface1".format(i+1))
-
-                boundary_Electric_Neu.append("H{}_Interface0".format(i+1))
-                boundary_Electric_Neu.append("H{}_Interface1".format(i+1))
-
-            for i in range(1,NRings+1):
-                part_thermic.append("R{}".format(i))
-                part_electric.append("R{}".format(i))
-
-                if i % 2 == 1 :
-                    boundary_meca.append("R{}_BP".format(i))
-                    boundary_Therm_Neu.append("R{}_BP".format(i))
-                    boundary_Electric_Neu.append("R{}_BP".format(i))
-                else :
-                    boundary_meca.append("R{}_HP".format(i))
-                    boundary_Therm_Neu.append("R{}_HP".format(i))
-                    boundary_Electric_Neu.append("R{}_HP".format(i))
-
-            for i in range(NChannels):
-                boundary_Electric_Neu.append("Channel{}".format(i))
-
-            # Add currentLeads
-            if  args.geom == "3D" and len(cad.CurrentLeads):
-                part_thermic.append("iL1")
-                part_thermic.append("oL2")
-                part_electric.append("iL1")
-                part_electric.append("oL2")
-                boundary_electric.append(["Inner1_LV0", "iL1", "0"])
-                boundary_electric.append(["OuterL2_LV0", "oL2", "V0:V0"])
-                
-                boundary_meca.append("Inner1_LV0")
-                boundary_meca.append("OuterL2_LV0")
-
-                boundary_maxwell.append("InfV00")
-                boundary_maxwell.append("InfV01")
-
-                boundary_Therm_Neu.append("Inner1_R0n")
-                boundary_Therm_Neu.append("Inner1_R1n")
-                boundary_Therm_Neu.append("Inner1_LV0")
-                boundary_Therm_Neu.append("Inner1_FixingHoles")
-                boundary_Therm_Neu.append("OuterL2_R0n")
-                boundary_Therm_Neu.append("OuterL2_R1n")
-                boundary_Therm_Neu.append("OuterL2_LV0")
-                boundary_Therm_Neu.append("OuterL2_CooledSurfaces")
-                boundary_Therm_Neu.append("OuterL2_Others")
-
-                boundary_Electric_Neu.append("Inner1_R0n")
-                boundary_Electric_Neu.append("Inner1_R1n")
-                boundary_Electric_Neu.append("Inner1_FixingHoles")
-                boundary_Electric_Neu.append("OuterL2_R0n")
-                boundary_Electric_Neu.append("OuterL2_R1n")
-                boundary_Electric_Neu.append("OuterL2_CooledSurfaces")
-                boundary_Electric_Neu.append("OuterL2_Others")
-
-            else:
-                boundary_electric.append(["H1_V0", "H1", "0"])
-                boundary_electric.append(["H%d_V0" % NHelices, "H%d" % NHelices, "V0:V0"])
-                
-                boundary_meca.append("H1_HP")
-                boundary_meca.append("H_HP")    
-                
-            boundary_maxwell.append("InfV1")
-            boundary_maxwell.append("InfR1")
-
-            # TODO : manage the scale
-            #for i in range(NChannels):
-            #     Zmin[i] *= args.scale
-            #     Zmax[i] *= args.scale
-            #     Dh[i] *= args.scale
-            #     Sh[i] *= args.scale
-
-            confdata, gdata, h, mu0 = convert_data(args.distance_unit, confdata, gdata, h, mu0)
-
-            if args.debug:
-                print("part_electric:", part_electric)
-                print("part_thermic:", part_thermic)
-
-            # params section
-            params_data = create_params(gdata, h, mu0, method_data, args.debug)
-            
-            # bcs section
-            bcs_data = create_bcs(args,
-                                  boundary_meca, 
-                                  boundary_maxwell,
-                                  boundary_electric,
-                                  boundary_Therm_Neu,
-                                  boundary_Electric_Neu,
-                                  gdata, confdata, templates, method_data, args.debug) # merge all bcs dict
-
-            # build dict from geom for templates
-            # TODO fix initfile name (see create_cfg for the name of output / see directory entry)
-            # eg: $home/feelppdb/$directory/cfppdes-heat.save
-
-            main_data = {
-                "part_thermic": part_thermic,
-                "part_electric": part_electric,
-                "index_electric": index_electric,
-                "index_V0": boundary_electric,
-                "temperature_initfile": "tini.h5",
-                "V_initfile": "Vini.h5"
-            }
-            mdict = Merge( Merge(main_data, params_data), bcs_data)
-        
-            powerH_data = { "Power_H": [] }
-            meanT_data = { "meanT_H": [] }
+        # load geom: yamlfile = confdata["geom"]
+        yamlfile = confdata["geom"]
+        (cad, gdata, insulators) = load_geometry(yamlfile, args.geom, basedir=args.wd, debug=args.debug, cache=args.cache)
+        (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
+        mu0 = units.mu0
+        h = units.h
+
+        print("Insert: %s" % cad.name, "NHelices=%d NRings=%d NChannels=%d" % (NHelices, NRings, NChannels))
+
+        # TODO : manage the scale
+        #for i in range(NChannels):
+        #     Zmin[i] *= args.scale
+        #     Zmax[i] *= args.scale
+        #     Dh[i] *= args.scale
+        #     Sh[i] *= args.scale
+
+        confdata, gdata, h, mu0 = convert_data(args.distance_unit, magnet_data(confdata), gdata, h, mu0)
+
+        jsonfile = setup_name(basename, method_data, args.nonlinear)
+        cfgfile = jsonfile.replace(".json", ".cfg")
+
+        # resources: mesh vertices from the mesh if already generated
+        from .resources import estimate, summary
+        template = os.path.join(MyEnv.template_path(), args.method, args.geom, args.model,
+                                AppCfg[args.method][args.time][args.geom][args.model]["model"])
+        if args.mesh != None:
+            meshfile = os.path.join(args.wd, args.mesh)
+        else:
+            meshfiles = [yamlfile.replace(".yaml", ".med")]
             if args.geom == "Axi":
-                for i in range(NHelices) :
-                    powerH_data["Power_H"].append( {"header": "Power_H{}".format(i+1), "name": "H{}_Cu%1%".format(i+1), "index": index_Helices[i]} )
-                    meanT_data["meanT_H"].append( {"header": "MeanT_H{}".format(i+1), "name": "H{}_Cu%1%".format(i+1), "index": index_Helices[i]} )
-            else:
-                for i in range(NHelices) :
-                    powerH_data["Power_H"].append( {"header": "Power_H{}".format(i+1), "name": "H{}_Cu".format(i+1)} )
-                    meanT_data["meanT_H"].append( {"header": "MeanT_H{}".format(i+1), "name": "H{}_Cu".format(i+1)} )
-                # TODO add Glue/Kaptons
-                for i in range(NRings) :
-                    powerH_data["Power_H"].append( {"header": "Power_R{}".format(i+1), "name": "R{}".format(i+1)} )
-                    meanT_data["meanT_H"].append( {"header": "MeanT_R{}".format(i+1), "name": "R{}".format(i+1)} )
-
-                if len(cad.CurrentLeads):
-                    powerH_data["Power_H"].append( {"header": "Power_iL1", "name": "iL1"} )
-                    powerH_data["Power_H"].append( {"header": "Power_oL2", "name": "oL2"} )
-                    meanT_data["meanT_H"].append( {"header": "MeanT_iL1", "name": "iL1"} )
-                    meanT_data["meanT_H"].append( {"header": "MeanT_oL2", "name": "oL2"} )
-
-            mpost = { 
-                "flux": {'index_h': "0:%s" % str(NChannels)},
-                "meanT_H": meanT_data ,
-                "power_H": powerH_data 
-            }
-            mmat = create_materials(gdata, index_Insulators, confdata, templates, method_data, args.debug)
-
-            # create cfg
-            if args.datafile: 
-                jsonfile = args.datafile.replace("-data.json","")
-            if args.magnet: 
-                jsonfile = args.magnet
-            jsonfile += "-" + args.method
-            jsonfile += "-" + args.model
-            if args.nonlinear:
-                jsonfile += "-nonlinear"
-            jsonfile += "-" + args.geom
-            jsonfile += "-sim.json"
-            cfgfile = jsonfile.replace(".json", ".cfg")
-
-            name = yamlfile.replace(".yaml","")
-            create_cfg(cfgfile, name, args.nonlinear, jsonfile, templates["cfg"], method_data, args.debug)
-            
-            # create json
-            create_json(jsonfile, mdict, mmat, mpost, templates, method_data, args.debug)
-
-            # copy some additional json file 
-            material_generic_def = ["conductor", "insulator"]
-
-            if args.time == "transient":
-                material_generic_def.append("conductor-nosource") # only for transient with mqs
-
-            if args.method == "cfpdes":
-                if args.debug: print("cwd=", cwd)
-                from shutil import copyfile
-                for jsonfile in material_generic_def:
-                    filename = AppCfg[args.method][args.time][args.geom][args.model]["filename"][jsonfile]
-                    src = os.path.join(MyEnv.template_path(), args.method, args.geom, args.model, filename)
-                    dst = os.path.join(jsonfile + "-" + args.method + "-" + args.model + "-" + args.geom + ".json")
-                    if args.debug:
-                        print(jsonfile, "filename=", filename, "src=%s" % src, "dst=%s" % dst)
-                    copyfile(src, dst)
-     
+                meshfiles += [cad.name + "-Axi_withAir.msh", cad.name + "-Axi_withAir_p.json"]
+            meshfiles = [os.path.join(args.wd, f) for f in meshfiles]
+            meshfile = ([f for f in meshfiles if os.path.isfile(f)] + [None])[0]
+        resources = estimate(method_data, gdata, template, meshfile, args.cores, args.debug)
+        print("Resources:", summary(resources))
+
+        # warm start from the fields saved by a previous run
+        init = {}
+        if args.init_from != None:
+            from .warmstart import init_files
+            rundir = os.path.abspath(os.path.join(args.wd, args.init_from))
+            init = init_files(rundir, args.debug)
+            print("Init files:", ", ".join("%s=%s" % item for item in init.items()))
+
+        cache = MyEnv.output_cache(args.debug) if args.cache else None
+        if args.incremental or args.watch:
+            from .incremental import update_setup
+            (files, stale) = update_setup(MyEnv, AppCfg, method_data, args.nonlinear, cad, yamlfile, gdata, confdata,
+                                          h, mu0, jsonfile, args.wd, compact=args.compact, shared=args.shared,
+                                          production=args.production, np=resources["np"], init=init,
+                                          dofs=resources["dofs"], debug=args.debug)
+            print("updated: %s (stale: %s)" % (", ".join(files) or "none", ", ".join(stale) or "none"))
         else:
-            raise Exception("expected Insert yaml file")
+            create_setup(MyEnv, AppCfg, method_data, args.nonlinear, cad, yamlfile, gdata, confdata, h, mu0, jsonfile,
+                         wd=args.wd, debug=args.debug, cache=cache, sources=geometry_files(cad, yamlfile, args.wd),
+                         compact=args.compact, shared=args.shared, optimize=args.optimize, constants=args.constants,
+                         production=args.production, np=resources["np"], init=init, dofs=resources["dofs"])
+
+        if init:
+            from .warmstart import cfg_directory, record
+            with open(os.path.join(args.wd, cfgfile), "r") as f:
+                directory = cfg_directory(f.read())
+            record(os.path.join(args.wd, "warmstart.json"),
+                   {"jsonfile": jsonfile, "directory": directory, "init_from": rundir, "init": init})
+
+        # check the markers against the mesh
+        if meshfile is not None:
+            from .meshcheck import check_setup, report
+            try:
+                with stage("check_markers"):
+                    res = check_setup(os.path.join(args.wd, jsonfile), meshfile, args.debug)
+                print(report(res, meshfile))
+            except (RuntimeError, ValueError, OSError) as e:
+                print("warning: markers not checked: %s" % e)
+        return (cad, yamlfile, cfgfile, resources)
+
+    (cad, yamlfile, cfgfile, resources) = generate()
+
+    if args.profile:
+        from .profiling import disable
+        disable()
+        profiler.summary()
+        profiler.save_trace(os.path.join(args.wd, args.profile))
+        print("profile trace saved to %s" % os.path.join(args.wd, args.profile))
+        for filename in profiler.save_profiles(os.path.join(args.wd, "")):
+            print("cProfile stats saved to %s" % filename)
+
+    if args.watch:
+        from .incremental import watch
+        template_dir = os.path.join(MyEnv.template_path(), args.method, args.geom, args.model)
+
+        def paths():
+            files = geometry_files(cad, yamlfile, args.wd) + [template_dir]
+            if args.datafile != None:
+                files.append(os.path.join(args.wd, args.datafile))
+            return files
+
+        def update():
+            nonlocal cad, yamlfile, cfgfile, resources
+            (cad, yamlfile, cfgfile, resources) = generate()
+
+        print("\nwatching %s (Ctrl-C to stop)" % ", ".join(paths()))
+        watch(paths, update)
 
     # Print command to run
     print("\n\n=== Commands to run (ex pour cfpdes/Axi) ===")
@@ -908,9 +1344,10 @@ def main():
         #meshfile = xaofile.replace(".xao", ".med")
         
         h5file = xaofile.replace(".xao", "_p.json")
-        partcmd = "feelpp_mesh_partition --ifile %s --ofile %s [--part NP] [--mesh.scale=0.001]" % (meshfile, h5file)
-        feelcmd = "[mpirun -np NP] %s --config-file %s" % (exec, cfgfile)
-        pyfeelcmd = "[mpirun -np NP] python %s" % pyfeel
+        NP = resources["np"]
+        partcmd = "feelpp_mesh_partition --ifile %s --ofile %s --part %d [--mesh.scale=0.001]" % (meshfile, h5file, NP)
+        feelcmd = "mpirun -np %d %s --config-file %s" % (NP, exec, cfgfile)
+        pyfeelcmd = "mpirun -np %d python %s" % (NP, pyfeel)
     
         print("Guidelines for running a simu")
         print("export HIFIMAGNET=/opt/SALOME-9.7.0-UB20.04/INSTALL/HIFIMAGNET/bin/salome")
@@ -921,7 +1358,7 @@ def main():
         # print("Mesh:", "singularity exec -B /opt/DISTENE:/opt/DISTENE:ro %s %s" % (salome,meshcmd))
         print("Partition:", "singularity exec %s %s" % (feelpp, partcmd) )
         print("Feel:", "singularity exec %s %s" % (feelpp, feelcmd) )
-        print("pyfeel:", "singularity exec %s %s" % (feelpp, pyfeel))
+        print("pyfeel:", "singularity exec %s %s" % (feelpp, pyfeelcmd))
     pass
 
 if __name__ == "__main__":
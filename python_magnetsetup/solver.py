@@ -0,0 +1,145 @@
+"""
+Solver presets for the cfg files
+
+The solver options are picked from the problem:
+
+* the equations solved by the model (one fieldsplit block per equation
+  for coupled models),
+* the number of dofs of the resources estimate (see resources.estimate,
+  from the mesh when available, from gdata otherwise): small problems
+  use a direct solver, large ones gamg,
+* linear or nonlinear materials: Picard iterations for coupled nonlinear
+  models, Newton otherwise,
+* production runs: no monitors nor solver timers.
+
+Presets are overridden by the "solver" entry of the model in
+magnetsetup.json, eg:
+
+"thmagel": {
+    "cfg": "cfg.mustache",
+    ...
+    "solver": {
+        "snes-maxit": 60,
+        "fieldsplit-2": {"pc-type": "lu"},
+        "nonlinear": {"solver": "Newton"},
+        "production": {"snes-monitor": 1, "ksp-rtol": null}
+    }
+}
+
+"nonlinear" and "production" entries only apply to nonlinear and
+production setups, a null value removes the option.
+"""
+
+from typing import List, Optional
+
+from .resources import fields, estimate
+
+# size limit (estimated dofs) for direct solvers
+direct_max_dofs = 200000
+
+
+def estimate_dofs(method_data: List[str], gdata: Optional[tuple] = None):
+    """
+    Return an estimate of the number of dofs, None if gdata is not given
+    """
+    if gdata is None:
+        return None
+    return estimate(method_data, gdata, cores=1)["dofs"]
+
+
+def preconditioner(direct: bool):
+    if direct:
+        return {"pc-type": "lu", "pc-factor-mat-solver-package-type": "mumps"}
+    return {"pc-type": "gamg"}
+
+
+def presets(method_data: List[str], nonlinear: bool, gdata: Optional[tuple] = None, production: bool = False,
+            dofs: Optional[int] = None):
+    """
+    Return the default solver options for the problem
+
+    dofs: number of dofs (see resources.estimate), estimated from gdata if None
+    options of fieldsplit blocks are given as "fieldsplit-<i>": dict
+    """
+    if dofs is None:
+        dofs = estimate_dofs(method_data, gdata)
+    direct = dofs is not None and dofs <= direct_max_dofs
+    blocks = fields(method_data)
+
+    options = {
+        "solver": "Picard" if (nonlinear and len(blocks) > 1) else "Newton",
+        "verbose_solvertimer": 0 if production else 1,
+        "ksp-monitor": 0 if production else 1,
+        "snes-monitor": 0 if production else 1,
+        "snes-maxit": 100 if (nonlinear and len(blocks) > 1) else 40,
+        "snes-rtol": "1e-6" if nonlinear else "1e-8",
+    }
+    if not direct:
+        options["ksp-rtol"] = "1e-8"
+
+    if len(blocks) > 1:
+        options["pc-type"] = "fieldsplit"
+        options["fieldsplit-type"] = "additive"
+        for (i, block) in enumerate(blocks):
+            options["fieldsplit-%d" % i] = preconditioner(direct)
+    else:
+        options.update(preconditioner(direct))
+    return options
+
+
+def merge(options: dict, overrides: dict):
+    """
+    Return options updated by overrides (a None value removes the option)
+    """
+    res = dict(options)
+    for (key, value) in overrides.items():
+        if value is None:
+            res.pop(key, None)
+        elif isinstance(value, dict) and isinstance(res.get(key), dict):
+            res[key] = merge(res[key], value)
+        else:
+            res[key] = value
+    return res
+
+
+def _format(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def solver_data(method_data: List[str], nonlinear: bool, gdata: Optional[tuple] = None,
+                overrides: Optional[dict] = None, production: bool = False, dofs: Optional[int] = None,
+                debug: bool = False):
+    """
+    Return the solver data of the cfg template
+
+    overrides: "solver" entry of the model in magnetsetup.json
+    dofs: number of dofs (see resources.estimate), estimated from gdata if None
+
+    returns a dict with:
+    options: list of {key, value}
+    fieldsplit: list of {index, options}
+    """
+    if overrides is None:
+        overrides = {}
+    options = presets(method_data, nonlinear, gdata, production, dofs)
+    options = merge(options, {key: value for (key, value) in overrides.items()
+                              if not key in ["nonlinear", "production"]})
+    if nonlinear:
+        options = merge(options, overrides.get("nonlinear", {}))
+    if production:
+        options = merge(options, overrides.get("production", {}))
+    if debug:
+        print("solver_data: dofs=%s options=%s" % (dofs if dofs is not None else estimate_dofs(method_data, gdata),
+                                                   options))
+
+    data = {"options": [], "fieldsplit": []}
+    for (key, value) in options.items():
+        if isinstance(value, dict) and key.startswith("fieldsplit-"):
+            data["fieldsplit"].append({"index": int(key.replace("fieldsplit-", "")),
+                                       "options": [{"key": k, "value": _format(v)} for (k, v) in value.items()]})
+        else:
+            data["options"].append({"key": key, "value": _format(value)})
+    data["fieldsplit"].sort(key=lambda block: block["index"])
+    return data
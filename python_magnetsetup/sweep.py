@@ -0,0 +1,457 @@
+"""
+Parameter sweeps over one setup
+
+A sweep spec (json) defines the members of an ensemble built from a
+base setup by changing Parameters entries (see create_params) and/or
+material fields of the insert data:
+
+{
+    "sampling": "lhs",              # grid, list, lhs or sobol
+    "samples": 32, "seed": 1,       # for lhs and sobol
+    "parameters": {
+        "Tw": {"min": 285, "max": 295},
+        "dTw[0-9]*": {"min": 10, "max": 15},
+        "Helix.material.ElectricalConductivity": {"min": 50.e+6, "max": 58.e+6},
+        "Helix[0].material.alpha": {"min": 3.4e-3, "max": 3.8e-3}
+    }
+}
+
+grid takes the cartesian product of lists of values, list takes the
+i-th value of every list, lhs (Latin hypercube) and sobol draw samples
+within [min, max] (sobol requires scipy).
+
+Parameters are matched by name or by pattern (fnmatch) and their values
+are written as given, in the distance unit of the setup. Material fields
+are given as in the datafile (SI) and converted with the data. Helix[0]
+is H1, a part without index stands for all the parts.
+
+Members are generated in a pool of -j worker processes, each loading
+the geometry and the templates once. Each member is written to its own
+directory (and gets its own Feel++ results directory) and a manifest
+(sweep.json) maps the member ids to their values and files.
+
+With --overlay, the base setup is written once in output/base and each
+member only holds a JSON Patch of the base model, its cfg and links to
+the base material files (see overlay).
+
+With --chain, each member is initialized with the temperature (and V)
+saved by the run of its nearest preceding member (see warmstart), the
+manifest giving the predecessor of each member (init_from).
+
+python -m python_magnetsetup.sweep --datafile HL-34-data.json --model thelec --spec sweep-spec.json -j 4
+"""
+
+from typing import List, Optional
+
+import os
+import re
+import sys
+import json
+import time
+import fnmatch
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from .setup import appenv, loadconfig, load_object, load_object_from_db, load_geometry, setup_name
+from .generator import SetupGenerator
+from .model import magnet_data
+from . import overlay
+from .resources import fields
+from .warmstart import cfg_directory, predicted_files, chain
+
+samplings = ["grid", "list", "lhs", "sobol"]
+
+material_path = re.compile(r"^(Helix|Ring|Lead)(?:\[(\d+)\])?\.(material|insulator)\.(\w+)$")
+
+
+def load_spec(filename: str):
+    """
+    Return the sweep spec defined in json filename
+    """
+    with open(filename, "r") as f:
+        spec = json.load(f)
+    check_spec(spec)
+    return spec
+
+
+def check_spec(spec: dict):
+    """
+    Check sweep spec, raise ValueError if invalid
+    """
+    sampling = spec.get("sampling", "grid")
+    if not sampling in samplings:
+        raise ValueError("unknown sampling %s (expected one of %s)" % (sampling, ", ".join(samplings)))
+    if not spec.get("parameters"):
+        raise ValueError("no parameters to sweep")
+
+    for (name, values) in spec["parameters"].items():
+        if sampling in ["grid", "list"]:
+            if not isinstance(values, list) or not values:
+                raise ValueError("%s: expected a list of values for %s sampling" % (name, sampling))
+        else:
+            bounds(name, values)
+
+    if sampling == "list":
+        sizes = set(len(values) for values in spec["parameters"].values())
+        if len(sizes) > 1:
+            raise ValueError("list sampling expects lists of the same size")
+    if sampling in ["lhs", "sobol"] and int(spec.get("samples", 0)) <= 0:
+        raise ValueError("%s sampling expects a number of samples" % sampling)
+
+
+def bounds(name: str, values):
+    """
+    Return (min, max) of values, given as {"min": a, "max": b} or [a, b]
+    """
+    if isinstance(values, dict) and "min" in values and "max" in values:
+        (vmin, vmax) = (values["min"], values["max"])
+    elif isinstance(values, list) and len(values) == 2:
+        (vmin, vmax) = values
+    else:
+        raise ValueError("%s: expected {\"min\": a, \"max\": b}" % name)
+    if not vmin <= vmax:
+        raise ValueError("%s: min > max" % name)
+    return (float(vmin), float(vmax))
+
+
+def unit_samples(sampling: str, samples: int, dim: int, seed: Optional[int] = None):
+    """
+    Return samples points in [0, 1)^dim as a numpy array
+    """
+    import numpy as np
+
+    if sampling == "lhs":
+        rng = np.random.default_rng(seed)
+        points = np.empty((samples, dim))
+        for j in range(dim):
+            points[:, j] = (rng.permutation(samples) + rng.random(samples)) / samples
+        return points
+
+    if sampling == "sobol":
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise RuntimeError("sobol sampling requires scipy")
+        import warnings
+
+        sampler = qmc.Sobol(d=dim, scramble=True, seed=seed)
+        with warnings.catch_warnings():
+            # balance properties need a power of 2 samples
+            warnings.simplefilter("ignore")
+            return sampler.random(samples)
+
+    raise ValueError("unknown sampling %s" % sampling)
+
+
+def members(spec: dict):
+    """
+    Return the list of members values (dicts of name: value) of spec
+    """
+    sampling = spec.get("sampling", "grid")
+    names = list(spec["parameters"])
+
+    if sampling == "grid":
+        return [dict(zip(names, values)) for values in itertools.product(*spec["parameters"].values())]
+    if sampling == "list":
+        return [dict(zip(names, values)) for values in zip(*spec["parameters"].values())]
+
+    limits = [bounds(name, spec["parameters"][name]) for name in names]
+    points = unit_samples(sampling, int(spec["samples"]), len(names), spec.get("seed"))
+    return [{name: vmin + x * (vmax - vmin) for (name, (vmin, vmax), x) in zip(names, limits, point.tolist())}
+            for point in points]
+
+
+def set_material(confdata, path: str, value):
+    """
+    Return confdata (a Record, see magnet_data) with material field path set to value
+
+    ex: Helix.material.alpha, Helix[0].insulator.ThermalConductivity, Lead[1].material.Young
+    """
+    m = material_path.match(path)
+    if m is None:
+        raise ValueError("%s: not a material field" % path)
+    (part, index, kind, field) = m.groups()
+
+    parts = list(confdata[part])
+    indices = range(len(parts)) if index is None else [int(index)]
+    for i in indices:
+        if i >= len(parts):
+            raise ValueError("%s: no %s[%d] in data" % (path, part, i))
+        material = parts[i][kind]
+        if not field in material:
+            raise ValueError("%s: unknown field %s" % (path, field))
+        parts[i] = parts[i].derive(**{kind: material.derive(**{field: value})})
+    return confdata.derive(**{part: tuple(parts)})
+
+
+def set_parameters(model: dict, values: dict):
+    """
+    Set Parameters of the json model to values (name or pattern: value)
+    """
+    parameters = model["Parameters"]
+    for (pattern, value) in values.items():
+        names = [pattern] if pattern in parameters else fnmatch.filter(parameters, pattern)
+        if not names:
+            raise ValueError("%s: no such parameter" % pattern)
+        for name in names:
+            parameters[name] = value if isinstance(value, str) else str(value)
+
+
+def member_cfg(cfg: str, member_id: str):
+    """
+    Return cfg with the results directory of member_id
+    """
+    return re.sub(r"^(directory=.*)$", lambda m: "%s/%s" % (m.group(1), member_id), cfg, count=1, flags=re.M)
+
+
+def split(values: dict):
+    """
+    Return (parameters, materials) values
+    """
+    parameters = {name: value for (name, value) in values.items() if not material_path.match(name)}
+    materials = {name: value for (name, value) in values.items() if material_path.match(name)}
+    return (parameters, materials)
+
+
+class Sweep():
+    """
+    Base setup of a sweep, shared by the members
+
+    cad, gdata: insert geometry (see load_geometry), confdata: insert data (SI)
+    overlay: write members as overlays of the base setup
+    chain: initialize members from the results of their predecessor
+    np: number of MPI processes of the runs
+    """
+
+    def __init__(self, method_data: List[str], nonlinear: bool, cad, gdata, confdata, yamlfile: str, basename: str,
+                 distance_unit: str = "meter", shared: bool = False, compact: bool = False, overlay: bool = False,
+                 chain: bool = False, np: Optional[int] = None, debug: bool = False):
+        self.method_data = method_data
+        self.nonlinear = nonlinear
+        self.cad = cad
+        self.gdata = gdata
+        self.confdata = magnet_data(confdata)
+        self.yamlfile = yamlfile
+        self.basename = basename
+        self.distance_unit = distance_unit
+        self.shared = shared
+        self.compact = compact
+        self.overlay = overlay
+        self.chain = chain
+        self.np = np
+        self.debug = debug
+        self.base = None
+        self.basedir = None
+        self.directory = None
+        self._generator = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_generator"] = None
+        return state
+
+    def generator(self):
+        if self._generator is None:
+            self._generator = SetupGenerator(distance_unit=self.distance_unit, debug=self.debug)
+        return self._generator
+
+    def init_files(self, member_id: str):
+        """
+        Return the init files saved by the run of member_id
+        """
+        if self.directory is None:
+            self.directory = cfg_directory(self.setup({})["cfg"])
+        return predicted_files("%s/%s" % (self.directory, member_id), fields(self.method_data), self.np)
+
+    def setup(self, values: dict, member_id: Optional[str] = None, init_from: Optional[str] = None):
+        """
+        Return the setup (see setup_data) of the member with values
+
+        init_from: id of the member whose results are used as init files
+        """
+        (parameters, materials) = split(values)
+        confdata = self.confdata
+        for (path, value) in materials.items():
+            confdata = set_material(confdata, path, value)
+
+        suffix = "" if self.method_data[3] == "mag" else "-" + self.method_data[4]
+        init = self.init_files(init_from) if init_from is not None else {}
+        setup = self.generator().generate(self.method_data, self.nonlinear, confdata, self.cad, self.yamlfile,
+                                          self.basename, self.gdata, suffix=suffix, shared=self.shared,
+                                          np=self.np, init=init)
+        set_parameters(setup["model"], parameters)
+        if member_id is not None:
+            setup["cfg"] = member_cfg(setup["cfg"], member_id)
+        return setup
+
+    def write_base(self, outdir: str):
+        """
+        Write the base setup in outdir, members being then written as overlays
+        """
+        self.base = self.setup({}, "base")
+        self.basedir = outdir
+        os.makedirs(outdir, exist_ok=True)
+        return self.generator().write(self.base, outdir, self.compact)
+
+    def member(self, member_id: str, values: dict, outdir: str, init_from: Optional[str] = None):
+        """
+        Write member in outdir, returns its manifest entry
+        """
+        start = time.perf_counter()
+        result = {"id": member_id, "values": values, "outdir": outdir, "files": [], "status": "ok", "error": None}
+        if self.chain:
+            result["init_from"] = init_from
+        try:
+            setup = self.setup(values, member_id, init_from)
+            os.makedirs(outdir, exist_ok=True)
+            if self.base is not None:
+                result["files"] = overlay.write_variant(setup, self.base, self.basedir, outdir, self.debug)
+            else:
+                result["files"] = self.generator().write(setup, outdir, self.compact)
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+        result["time"] = time.perf_counter() - start
+        return result
+
+
+_sweep = None
+
+
+def _init_worker(sweep: Sweep):
+    global _sweep
+    _sweep = sweep
+
+
+def _run_member(member_id: str, values: dict, outdir: str, init_from: Optional[str] = None):
+    return _sweep.member(member_id, values, outdir, init_from)
+
+
+def run(sweep: Sweep, spec: dict, output: str, jobs: int = 1):
+    """
+    Generate the members of spec in output, returns the manifest
+
+    the manifest is saved as output/sweep.json, chained members
+    have to be run in its order
+    """
+    check_spec(spec)
+    values = members(spec)
+
+    # check the spec against the first member before spawning the workers
+    sweep.directory = cfg_directory(sweep.setup(values[0])["cfg"])
+
+    os.makedirs(output, exist_ok=True)
+    base = None
+    if sweep.overlay:
+        basedir = os.path.join(output, "base")
+        base = {"outdir": basedir, "files": sweep.write_base(basedir)}
+    predecessors = chain(values) if sweep.chain else [None] * len(values)
+    tasks = [("%04d" % i, member, os.path.join(output, "%04d" % i), None if p is None else "%04d" % p)
+             for (i, (member, p)) in enumerate(zip(values, predecessors))]
+
+    if jobs <= 1:
+        _init_worker(sweep)
+        results = [_run_member(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(sweep,)) as pool:
+            futures = [pool.submit(_run_member, *task) for task in tasks]
+            results = []
+            for (task, future) in zip(tasks, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # eg. worker killed
+                    results.append({"id": task[0], "values": task[1], "outdir": task[2], "files": [],
+                                    "status": "failed", "error": "%s: %s" % (type(e).__name__, e), "time": 0})
+                    if sweep.chain:
+                        results[-1]["init_from"] = task[3]
+
+    manifest = {
+        "basename": sweep.basename,
+        "variant": ":".join(sweep.method_data) + (":nonlinear" if sweep.nonlinear else ""),
+        "distance_unit": sweep.distance_unit,
+        "spec": spec,
+        "base": base,
+        "members": results
+    }
+    with open(os.path.join(output, "sweep.json"), "w") as f:
+        json.dump(manifest, f, indent=4)
+    return manifest
+
+
+def main():
+    """
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create a parameter sweep of json model files for Feelpp/HiFiMagnet simu")
+    parser.add_argument("--datafile", help="input data file (ex. HL-34-data.json)", default=None)
+    parser.add_argument("--wd", help="set a working directory", type=str, default="")
+    parser.add_argument("--magnet", help="Magnet name from magnetdb (ex. HL-34)", default=None)
+    parser.add_argument("--spec", help="sweep spec (json)", type=str, required=True)
+    parser.add_argument("--output", help="output directory (default is wd/<basename>-sweep)", type=str, default=None)
+    parser.add_argument("-j", "--jobs", help="number of worker processes", type=int, default=1)
+
+    parser.add_argument("--method", help="choose method (default is cfpdes", type=str,
+                    choices=['cfpdes', 'CG', 'HDG', 'CRB'], default='cfpdes')
+    parser.add_argument("--time", help="choose time type", type=str,
+                    choices=['static', 'transient'], default='static')
+    parser.add_argument("--geom", help="choose geom type", type=str,
+                    choices=['Axi', '3D'], default='Axi')
+    parser.add_argument("--model", help="choose model type", type=str,
+                    choices=['thelec', 'mag', 'thmag', 'thmagel'], default='thmagel')
+    parser.add_argument("--nonlinear", help="force non-linear", action='store_true')
+    parser.add_argument("--cooling", help="choose cooling type", type=str,
+                    choices=['mean', 'grad'], default='mean')
+    parser.add_argument("--distance_unit", help="distance's unit", type=str,
+                    choices=['meter','millimeter'], default='meter')
+
+    parser.add_argument("--no-cache", help="do not use the cache of geometries", dest="cache", action='store_false')
+    parser.add_argument("--compact", help="write json models without indentation", action='store_true')
+    parser.add_argument("--overlay", help="write the base setup once and members as patches of the base model",
+                    action='store_true')
+    parser.add_argument("--shared-materials", help="define one material per helix for all its sections (Axi)",
+                    dest="shared", action='store_true')
+    parser.add_argument("--chain", help="initialize each member with the fields saved by its nearest preceding member",
+                    action='store_true')
+    parser.add_argument("--np", help="number of MPI processes of the runs (default: 1)", type=int, default=None)
+    parser.add_argument("--debug", help="activate debug", action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        print(args)
+
+    spec = load_spec(os.path.join(args.wd, args.spec))
+    MyEnv = appenv()
+    method_data = [args.method, args.time, args.geom, args.model, args.cooling]
+
+    if args.datafile != None:
+        confdata = load_object(MyEnv, os.path.join(args.wd, args.datafile), args.debug)
+        basename = args.datafile.replace("-data.json","")
+    elif args.magnet != None:
+        confdata = load_object_from_db(MyEnv, "magnet", args.magnet, args.debug)
+        basename = args.magnet
+    else:
+        print("expected --datafile or --magnet")
+        return 1
+
+    yamlfile = confdata["geom"]
+    (cad, gdata, insulators) = load_geometry(yamlfile, args.geom, basedir=args.wd, debug=args.debug, cache=args.cache)
+    print("Insert: %s" % cad.name, "NHelices=%d NRings=%d NChannels=%d" % tuple(gdata[:3]))
+
+    output = args.output if args.output is not None else os.path.join(args.wd, basename + "-sweep")
+    sweep = Sweep(method_data, args.nonlinear, cad, gdata, confdata, yamlfile, basename, args.distance_unit,
+                  args.shared, args.compact, args.overlay, args.chain, args.np, args.debug)
+    manifest = run(sweep, spec, output, args.jobs)
+
+    failed = [member for member in manifest["members"] if member["status"] != "ok"]
+    print("\n\n=== Sweep %s: %d members ===" % (setup_name(basename, method_data, args.nonlinear),
+                                                len(manifest["members"])))
+    for member in failed:
+        print("%s failed: %s" % (member["id"], member["error"]))
+    print("manifest saved to %s" % os.path.join(output, "sweep.json"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
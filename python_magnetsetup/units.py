@@ -0,0 +1,190 @@
+"""
+Unit conversion of setup data
+
+Input data are given in SI units, except the geometry which is in mm.
+Conversion to a distance_unit ('meter' or 'millimeter') only amounts
+to scaling each quantity by a factor depending on its dimension.
+
+The factors are computed once per distance_unit. Values are then
+converted as numpy array operations over all the parts.
+
+For the distance units listed in lengths, the factors only depend on
+the power of length of each quantity and pint is not needed. For other
+units, a pint UnitRegistry is created once, on first use.
+"""
+
+from typing import Dict
+
+import math
+import threading
+import functools
+
+from .profiling import profiled
+
+# property: (input unit, converted unit, power of length) with {unit} the distance_unit
+material_units = {
+    "ThermalConductivity": ("watt / meter / kelvin", "watt / {unit} / kelvin", -1),
+    "Young": ("kilogram / meter / second", "kilogram / {unit} / second", -1),
+    "VolumicMass": ("kilogram / meter**3", "kilogram / {unit}**3", -3),
+    "ElectricalConductivity": ("siemens / meter", "siemens / {unit}", -1),
+    "Rpe": ("kilogram / meter / second", "kilogram / {unit} / second", -1),
+}
+
+geometry_units = {
+    "length": ("millimeter", "{unit}", 1),
+    "surface": ("millimeter**2", "{unit}**2", 2),
+}
+
+physical_units = {
+    "mu0": ("henry / meter", "henry / {unit}", -1),
+    "h": ("watt / meter**2 / kelvin", "watt / {unit}**2 / kelvin", -2),
+}
+
+# default values of the physical constants, in SI units
+mu0 = 4*math.pi*1e-7
+h = 58222.1
+
+# size of length units in meter
+lengths = {
+    "meter": 1.,
+    "millimeter": 1.e-3,
+}
+
+_ureg = None
+_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Return the module UnitRegistry, created on first call
+    """
+    global _ureg
+    with _lock:
+        if _ureg is None:
+            import warnings
+            from pint import UnitRegistry
+
+            ureg = UnitRegistry()
+            ureg.default_system = 'SI'
+            ureg.autoconvert_offset_to_baseunit = True
+
+            # Ignore warning for pint
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                ureg.Quantity([])
+            _ureg = ureg
+    return _ureg
+
+
+@functools.lru_cache(maxsize=None)
+def factor(src: str, dst: str) -> float:
+    """
+    Return the scaling factor from src to dst units
+    """
+    if src == dst:
+        return 1.
+    ureg = get_registry()
+    return ureg.Quantity(1., ureg.parse_units(src)).to(ureg.parse_units(dst)).magnitude
+
+
+@functools.lru_cache(maxsize=None)
+def factors(distance_unit: str) -> Dict[str, float]:
+    """
+    Return the table of factors (property -> factor) for distance_unit
+    """
+    table = {}
+    for (units, src_length) in [(material_units, "meter"), (geometry_units, "millimeter"), (physical_units, "meter")]:
+        for (key, (src, dst, power)) in units.items():
+            if distance_unit in lengths:
+                table[key] = (lengths[src_length] / lengths[distance_unit]) ** power
+            else:
+                table[key] = factor(src, dst.format(unit=distance_unit))
+    return table
+
+
+def scale(values, f: float):
+    """
+    Return values scaled by f as python objects
+
+    values are returned unchanged (as a new list) when f is 1
+    """
+    if f == 1.:
+        return list(values) if isinstance(values, (list, tuple)) else values
+
+    import numpy as np
+    return (np.asarray(values, dtype=float) * f).tolist()
+
+
+def convert_record(confdata, table: Dict[str, float]):
+    """
+    Return converted confdata (a Record, see model.magnet_data)
+
+    each distinct material is converted once
+    """
+    converted = {}
+
+    def convert(material):
+        if not material in converted:
+            changes = { prop: material[prop] * table[prop] for prop in material_units
+                        if prop in material and table[prop] != 1. }
+            converted[material] = material.derive(**changes) if changes else material
+        return converted[material]
+
+    changes = {}
+    for mtype in ["Helix", "Ring", "Lead"]:
+        if mtype in confdata:
+            changes[mtype] = tuple( part.derive(material=convert(part["material"])) for part in confdata[mtype] )
+    return confdata.derive(**changes)
+
+
+@profiled()
+def convert_data(distance_unit, confdata, gdata, h, mu0):
+    """
+    Convert the input in distance_unit ('meter' or millimeter).
+
+    confdata and gdata are not modified, converted copies are returned.
+    confdata may be a dict or a Record, gdata a tuple or a Geometry (see model).
+    """
+    from .model import Geometry, Record
+
+    table = factors(distance_unit)
+
+    if isinstance(confdata, Record):
+        confdata_convert = convert_record(confdata, table)
+    else:
+        # copy parts and materials (the other items are shared)
+        confdata_convert = dict(confdata)
+        parts = []
+        for mtype in ["Helix", "Ring", "Lead"]:
+            if mtype in confdata:
+                confdata_convert[mtype] = [ dict(part, material=dict(part["material"])) for part in confdata[mtype] ]
+                parts += [ part["material"] for part in confdata_convert[mtype] ]
+
+        # convert each property for all parts at once
+        for prop in material_units:
+            owners = [ material for material in parts if prop in material ]
+            if owners and table[prop] != 1.:
+                values = scale([ material[prop] for material in owners ], table[prop])
+                for (material, value) in zip(owners, values):
+                    material[prop] = value
+
+    # Distances : mm -> distance_unit, Surfaces : mm2 -> distance_unit2
+    if isinstance(gdata, Geometry):
+        gdata_convert = gdata.scaled(table["length"], table["surface"])
+    else:
+        (NHelices, NRings, NChannels, Nsections, R1, R2, Z1, Z2, Zmin, Zmax, Dh, Sh) = gdata
+        (R1_convert, R2_convert, Z1_convert, Z2_convert, Zmin_convert, Zmax_convert) = [
+            scale(values, table["length"]) for values in [R1, R2, Z1, Z2, Zmin, Zmax] ]
+        Dh_convert = scale(Dh, table["surface"])
+        Sh_convert = scale(Sh, table["surface"])
+
+        gdata_convert = (NHelices, NRings, NChannels, Nsections, R1_convert, R2_convert,
+                        Z1_convert, Z2_convert, Zmin_convert, Zmax_convert, Dh_convert, Sh_convert)
+
+    # MagnetPermeability of vacuum : H/m --> H/distance_unit
+    mu0_convert = mu0 * table["mu0"]
+
+    # Convection coefficients : W/m2/K --> W/distance_unit**2/K
+    h_convert = h * table["h"]
+
+    return confdata_convert, gdata_convert, h_convert, mu0_convert
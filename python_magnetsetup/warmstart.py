@@ -0,0 +1,132 @@
+"""
+Warm start of a setup from the fields saved by a previous run
+
+The temperature (heat) and the electric potential V (electric) saved by a
+run (see the Save sections of the json models) are used as initial
+conditions instead of the default Tinit expression:
+
+* from the results directory of a previous run (eg. thelec before thmag,
+  or a previous operating point), the saved fields being looked up in the
+  directory,
+* in an ordered sweep, from the results of the nearest preceding member,
+  the paths of its saved fields being predicted from its cfg directory
+  (see save_path), so the members have to be run in the manifest order.
+
+The chain is recorded in a manifest: warmstart.json in the working
+directory of setup, the "init_from" entries of sweep.json for sweeps.
+
+python -m python_magnetsetup.setup --datafile HL-34-data.json --model thmag \
+   --init-from ~/feelppdb/cfpdes-thelecAxi-static/HL-34
+"""
+
+from typing import Dict, List, Optional
+
+import os
+import re
+import json
+import math
+
+# fields used as initial conditions and the equation saving them
+init_fields = {"temperature": "heat", "V": "electric"}
+
+# fields saved by Feel++ (relative to the feelppdb repository, see the cfg directory)
+save_path = "$repository/{directory}/np_{np}/cfpdes.{equation}.save/{field}.h5"
+
+
+def saved_fields(rundir: str, fields: Dict[str, str] = init_fields):
+    """
+    Return the fields saved in the results directory rundir (field: path)
+
+    a field is saved as <field>.h5, preferably in a directory named after its
+    equation (eg. cfpdes.heat.save/temperature.h5), the most recent file is taken
+    """
+    found = {}
+    for (root, dirs, files) in os.walk(rundir):
+        for filename in files:
+            for (field, equation) in fields.items():
+                if filename != field + ".h5" and not filename.endswith("." + field + ".h5"):
+                    continue
+                path = os.path.join(root, filename)
+                rank = (equation in os.path.basename(root), os.path.getmtime(path))
+                if not field in found or rank > found[field][0]:
+                    found[field] = (rank, path)
+    return {field: os.path.abspath(path) for (field, (rank, path)) in found.items()}
+
+
+def init_files(rundir: str, debug: bool = False):
+    """
+    Return the init files (field: path) from the results directory of a previous run
+    """
+    if not os.path.isdir(rundir):
+        raise RuntimeError("%s: no such results directory" % rundir)
+    files = saved_fields(rundir)
+    if not files:
+        raise RuntimeError("%s: no saved %s field (.h5)" % (rundir, " or ".join(init_fields)))
+    if debug:
+        print("warmstart/init_files: %s" % files)
+    return files
+
+
+def cfg_directory(cfg: str):
+    """
+    Return the results directory of cfg (directory entry), None if not defined
+    """
+    m = re.search(r"^directory=(.*)$", cfg, flags=re.M)
+    return m.group(1).strip() if m is not None else None
+
+
+def predicted_files(directory: str, equations: List[str], np: Optional[int] = None):
+    """
+    Return the init files (field: path) saved by a run in directory, not run yet
+
+    equations: equations solved by the run (see resources.fields)
+    """
+    return {field: save_path.format(directory=directory, np=np or 1, equation=equation, field=field)
+            for (field, equation) in init_fields.items() if equation in equations}
+
+
+def _distance(a: dict, b: dict, scales: dict):
+    d = 0
+    for name in a:
+        if isinstance(a[name], (int, float)) and isinstance(b.get(name), (int, float)):
+            d += ((a[name] - b[name]) / scales[name]) ** 2
+        elif a[name] != b.get(name):
+            d += 1
+    return math.sqrt(d)
+
+
+def chain(values: List[dict]):
+    """
+    Return the predecessor of each member (index or None) of an ordered sweep
+
+    the predecessor of a member is the nearest preceding member, values being
+    scaled by their range in the sweep (the latest one for equal distances)
+    """
+    scales = {}
+    for name in (values[0] if values else {}):
+        numbers = [v[name] for v in values if isinstance(v.get(name), (int, float))]
+        scales[name] = (max(numbers) - min(numbers)) if numbers else 0
+        scales[name] = scales[name] or 1
+
+    res = [None]
+    for k in range(1, len(values)):
+        distances = [_distance(values[k], values[i], scales) for i in range(k)]
+        best = min(distances)
+        res.append(max(i for i in range(k) if distances[i] == best))
+    return res[:len(values)]
+
+
+def record(manifest: str, entry: dict):
+    """
+    Add entry (a dict with jsonfile, init_from, init) to the manifest file
+
+    a previous entry of the same jsonfile is replaced
+    """
+    entries = []
+    if os.path.isfile(manifest):
+        with open(manifest, "r") as f:
+            entries = json.load(f)
+    entries = [e for e in entries if e.get("jsonfile") != entry["jsonfile"]] + [entry]
+    with open(manifest, "w") as f:
+        json.dump(entries, f, indent=4)
+    return entries
@@ -0,0 +1,41 @@
+"""
+Tests of the batch variants
+"""
+
+import os
+
+from python_magnetsetup.batch import supported, output_dirs
+
+AppCfg = {"cfpdes": {"static": {"3D": {"thelec": {
+    "cfg": "M19061901-thelec.cfg", "model": "thelec.json", "model-nonlinear": "thelec-nonlinear.json",
+    "conductor-linear": "conductor.json", "conductor-nonlinear": "conductor-nonlinear.json",
+    "insulator": "insulator.json", "cooling": {"mean": "cooling.json"}, "cooling-post": {"mean": "flux.json"},
+    "stats_T": "stats_T.json", "stats_Power": "stats_Power.json"}}}}}
+
+
+def test_supported(tmp_path):
+    method_data = ["cfpdes", "static", "3D", "thelec", "mean"]
+    assert supported(AppCfg, method_data, False)
+    assert supported(AppCfg, method_data, True)
+    assert not supported(AppCfg, ["cfpdes", "static", "3D", "thelec", "grad"], False)
+    assert not supported(AppCfg, ["cfpdes", "static", "Axi", "thelec", "mean"], False)
+
+    # the nonlinear templates are missing
+    directory = tmp_path / "cfpdes" / "3D" / "thelec"
+    directory.mkdir(parents=True)
+    cfg = AppCfg["cfpdes"]["static"]["3D"]["thelec"]
+    for name in ["cfg", "model", "conductor-linear", "insulator", "stats_T", "stats_Power"]:
+        (directory / cfg[name]).write_text("")
+    for name in ["cooling", "cooling-post"]:
+        (directory / cfg[name]["mean"]).write_text("")
+    assert supported(AppCfg, method_data, False, str(tmp_path))
+    assert not supported(AppCfg, method_data, True, str(tmp_path))
+    os.remove(str(directory / cfg["cooling-post"]["mean"]))
+    assert not supported(AppCfg, method_data, False, str(tmp_path))
+
+
+def test_output_dirs():
+    inputs = [("datafile", "HL-34-data.json"), ("datafile", "old/HL-34-data.json"), ("magnet", "HL-34"),
+              ("magnet", "M9Bitters"), ("datafile", "HL-34-2-data.json")]
+    assert output_dirs(inputs, "setups") == [os.path.join("setups", name)
+                                             for name in ["HL-34", "HL-34-2", "HL-34-3", "M9Bitters", "HL-34-2-2"]]
@@ -0,0 +1,126 @@
+"""
+Tests of the expressions optimizer
+"""
+
+import pytest
+
+from python_magnetsetup import expressions
+from python_magnetsetup.expressions import (parse, to_string, evaluate, symbols, fold, equivalent,
+                                            optimize_model, ExpressionError)
+
+env = {"a": 1.3, "b": 1.7, "c": 0.4, "x": 1.1, "y": 0.9, "Z": 1.2, "U": 3., "phi": 0.2, "mu0": 1.25e-6}
+
+
+@pytest.mark.parametrize("text", [
+    "1*mu0", "a-(b-c)", "-(a/x)", "a^b^c", "(a^b)^c", "-x^2", "(a+b)*c", "a/(b*c)", "a-b-c", "a/b/c",
+    "2e-3*x", "2*pi*phi/x*(U/2/pi)", "sqrt(x^2+y^2)", "atan2(y,x)", "(y<Z)*a+(y>=Z)*b", "{x,y}",
+])
+def test_round_trip(text):
+    node = parse(text)
+    assert to_string(parse(to_string(node))) == to_string(node)
+    assert evaluate(parse(to_string(node)), env) == pytest.approx(evaluate(node, env))
+
+
+def test_to_string():
+    assert to_string(parse("-(a/x)")) == "-a/x"
+    assert to_string(parse("-(a+x)")) == "-(a+x)"
+    assert to_string(parse("a-(b-c)")) == "a-(b-c)"
+    assert to_string(parse("a^b^c")) == "a^(b^c)"
+
+
+def test_symbols():
+    assert sorted(symbols(parse("sqrt(x^2+y^2)*pi+H1_Cu%1%"))) == ["H1_Cu%1%", "x", "y"]
+
+
+def test_parse_error():
+    for text in ["a+", "(a", "a b", "f(a"]:
+        with pytest.raises(ExpressionError):
+            parse(text)
+
+
+@pytest.mark.parametrize("text, folded", [
+    ("1*mu0", "mu0"),
+    ("2*pi*phi/x*(U/2/pi)", "phi/x*U"),
+    ("a-(b-c)", "a-b+c"),
+    ("x+0", "x"),
+])
+def test_fold(text, folded):
+    node = fold(parse(text))
+    assert to_string(node) == folded
+    assert equivalent(parse(text), node, symbols(parse(text)))
+
+
+@pytest.mark.parametrize("text, canonical", [
+    ("a>b", "b<a"),
+    ("x>=2", "2<=x"),
+    ("(a<b)*(a<b)", "a<b"),
+    ("1-(y<Z)", "Z<=y"),
+    ("1-(y<=Z)", "Z<y"),
+])
+def test_compare(text, canonical):
+    assert to_string(fold(parse(text), compare=True)) == canonical
+    assert to_string(fold(parse(text), compare=False)) != canonical
+
+
+def test_equivalent():
+    assert equivalent(parse("(a+b)*c"), parse("a*c+b*c"), ["a", "b", "c"])
+    assert not equivalent(parse("x+1"), parse("x+2"), ["x"])
+    assert not equivalent(parse("x/y"), parse("y/x"), ["x", "y"])
+
+
+def model():
+    return {
+        "Parameters": {"Tw1": "290", "dTw1": "12", "mu0": "4*pi*1e-7", "x": "1"},
+        "Materials": {
+            "H1": {"markers": ["H1_Cu%1%"], "index1": "0:6", "mu": "1*mu0:mu0:x",
+                   "T": "Tw1+dTw1*(y<Z)*(y<Z):Tw1:dTw1:y:Z"},
+            "H2": {"T": "(Tw1+dTw1)/2+r:Tw1:dTw1:r"},
+        },
+    }
+
+
+def test_optimize_model():
+    data = model()
+    stats = optimize_model(data)
+    assert data["Materials"]["H1"]["mu"] == "mu0:mu0"
+    assert data["Materials"]["H1"]["index1"] == "0:6"
+    assert data["Materials"]["H1"]["T"] == "Tw1+dTw1*(y<Z):Tw1:dTw1:y:Z"
+    assert data["Materials"]["H2"]["T"] == "cse0+r:r:cse0"
+    assert data["Parameters"]["cse0"] == "0.5*(Tw1+dTw1):Tw1:dTw1"
+    assert stats["rejected"] == 0
+    assert stats["parameters_added"] == 1
+
+
+def test_optimize_constants():
+    data = model()
+    optimize_model(data, constants=["mu0"], passes=["fold", "prune"])
+    # folded to a number, without symbols
+    assert data["Materials"]["H1"]["mu"] == to_string(fold(parse("4*pi*1e-7")))
+
+
+def test_optimize_rejected(monkeypatch):
+    # a wrong rewrite is detected and the original expression is kept
+    original = expressions.fold
+    monkeypatch.setattr(expressions, "fold",
+                        lambda node, compare=True: ("add", ((1, original(node, compare)), (1, expressions.num(1.)))))
+    data = model()
+    expected = model()
+    stats = optimize_model(data, passes=["fold"])
+    assert stats["rejected"] == stats["expressions"]
+    assert stats["rewritten"] == 0
+    assert data == expected
+
+
+def test_optimize_undeclared():
+    # a typo in the symbols ("," instead of ":") is kept and the rewrite is rejected
+    text = "1*Tw%1%+dTw%1%*(y<Zmin%1%)*(y<Zmax%1%):Tw%1%:dTw%1%:y:Zmin%1%,Zmax%1%"
+    data = {"Materials": {"H1": {"markers": ["H1_Cu%1%"], "T": text}}}
+    stats = optimize_model(data, passes=["fold", "prune"])
+    assert data["Materials"]["H1"]["T"] == text
+    assert stats["rejected"] == 1
+
+    # built-in symbols do not need to be declared
+    data = {"Materials": {"H1": {"T": "1*Tw+x*t:Tw:x:y"}}}
+    stats = optimize_model(data, passes=["fold", "prune"])
+    assert data["Materials"]["H1"]["T"] == "Tw+x*t:Tw:x"
+    assert stats["rejected"] == 0
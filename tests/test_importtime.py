@@ -0,0 +1,13 @@
+"""
+Test of the cold start import time of the setup CLI
+"""
+
+from python_magnetsetup.importtime import check
+
+
+def test_budget():
+    # best of 3 runs of python -X importtime -c "import python_magnetsetup.setup"
+    (elapsed, errors) = min(check("python_magnetsetup.setup", budget=0.15) for i in range(3))
+    assert elapsed <= 0.15
+    # none of the heavy dependencies is imported at startup
+    assert errors == [], errors
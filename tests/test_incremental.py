@@ -0,0 +1,80 @@
+"""
+Tests of the incremental regeneration of a setup
+"""
+
+import os
+import json
+import shutil
+
+from python_magnetsetup import units
+from python_magnetsetup.setup import appenv, loadconfig, create_setup, convert_data
+from python_magnetsetup.model import magnet_data
+from python_magnetsetup.incremental import update_setup
+from python_magnetsetup.benchmark import synthetic_insert
+
+method_data = ["cfpdes", "static", "Axi", "thelec", "mean"]
+jsonfile = "bench-cfpdes-thelec-Axi-sim.json"
+
+
+def env(tmp_path):
+    """
+    returns an appenv using a copy of the templates
+    """
+    MyEnv = appenv()
+    templates = str(tmp_path / "templates")
+    shutil.copytree(MyEnv.template_path(), templates)
+    MyEnv.template_path = lambda debug=False: templates
+    return MyEnv
+
+
+def edit(filename: str, old: str, new: str):
+    with open(filename, "r") as f:
+        text = f.read()
+    assert old in text
+    with open(filename, "w") as f:
+        f.write(text.replace(old, new))
+    # a new mtime for the template cache
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def load(filename: str):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def test_update_setup(tmp_path):
+    MyEnv = env(tmp_path)
+    AppCfg = loadconfig()
+    (cad, gdata, confdata) = synthetic_insert(2, 3)
+    yamlfile = confdata["geom"]
+
+    def update(confdata, wd):
+        (cconfdata, cgdata, h, mu0) = convert_data("meter", magnet_data(confdata), gdata, units.h, units.mu0)
+        os.makedirs(wd, exist_ok=True)
+        os.makedirs(wd + "-full", exist_ok=True)
+        (files, stale) = update_setup(MyEnv, AppCfg, method_data, False, cad, yamlfile, cgdata, cconfdata, h, mu0,
+                                      jsonfile, wd)
+        create_setup(MyEnv, AppCfg, method_data, False, cad, yamlfile, cgdata, cconfdata, h, mu0,
+                     jsonfile, wd + "-full")
+        # same setup as a full generation
+        assert load(os.path.join(wd, jsonfile)) == load(os.path.join(wd + "-full", jsonfile))
+        cfgfile = jsonfile.replace(".json", ".cfg")
+        with open(os.path.join(wd, cfgfile), "r") as f, open(os.path.join(wd + "-full", cfgfile), "r") as g:
+            assert f.read() == g.read()
+        return stale
+
+    wd = str(tmp_path / "setup")
+    assert set(update(confdata, wd)) >= {"cfg", "model", "Materials", "Stats_T", "Stats_Power"}
+    assert update(confdata, wd) == []
+
+    # a material field
+    confdata["Helix"][0]["material"]["ElectricalConductivity"] = 50.e+6
+    assert update(confdata, wd) == ["Materials"]
+
+    # a post template
+    edit(os.path.join(MyEnv.template_path(), "cfpdes", "Axi", "thelec", "stats_T.mustache"),
+         '["min", "max", "mean"]', '["min", "max"]')
+    assert update(confdata, wd) == ["Stats_T"]
+    stats = load(os.path.join(wd, jsonfile))["PostProcess"]["heat"]["Measures"]["Statistics"]
+    assert all(stats[key]["type"] == ["min", "max"] for key in stats if key.startswith("MeanT_H"))
@@ -0,0 +1,112 @@
+"""
+Tests of the magnetdb client against a local stand-in server
+"""
+
+import json
+import socket
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from python_magnetsetup.magnetdb import MagnetDBClient, MagnetDBError, get_client
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    /api/magnet/mdata/<name>: json object with an ETag, 304 on revalidation
+    /api/fail/mdata/<name>: 503
+    """
+
+    def do_GET(self):
+        self.server.hits.append((self.path, self.headers.get("If-None-Match")))
+        if self.path.startswith("/api/fail"):
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        etag = '"v%d"' % self.server.version
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps({"name": self.path.split("/")[-1], "version": self.server.version}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    httpd.hits = []
+    httpd.version = 1
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def client(server, tmp_path, **kwargs):
+    url = "http://127.0.0.1:%d/api" % server.server_address[1]
+    return MagnetDBClient(url, retries=1, backoff=0, cache_dir=str(tmp_path), **kwargs)
+
+
+def test_cache_hit(server, tmp_path):
+    db = client(server, tmp_path)
+    assert db.mdata("magnet", "HL-34") == {"name": "HL-34", "version": 1}
+    assert db.mdata("magnet", "HL-34") == {"name": "HL-34", "version": 1}
+    assert len(server.hits) == 1
+    assert (db.requests, db.hits) == (1, 1)
+
+
+def test_revalidation(server, tmp_path):
+    db = client(server, tmp_path, ttl=0)
+    assert db.mdata("magnet", "HL-34")["version"] == 1
+
+    # unchanged: 304, the cached data is returned
+    assert db.mdata("magnet", "HL-34")["version"] == 1
+    assert server.hits[-1] == ("/api/magnet/mdata/HL-34", '"v1"')
+
+    # changed: new data
+    server.version = 2
+    assert db.mdata("magnet", "HL-34")["version"] == 2
+    assert len(server.hits) == 3
+
+
+def test_server_error(server, tmp_path):
+    db = client(server, tmp_path)
+    with pytest.raises(MagnetDBError) as e:
+        db.mdata("fail", "HL-34")
+    assert e.value.status is None
+    # first request and one retry
+    assert len(server.hits) == 2
+
+
+def test_connection_error(tmp_path):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    db = MagnetDBClient("http://127.0.0.1:%d/api" % port, retries=0, cache_dir=str(tmp_path))
+    with pytest.raises(MagnetDBError) as e:
+        db.mdata("magnet", "HL-34")
+    assert e.value.status is None
+    assert "ConnectionError" in str(e.value)
+
+
+def test_get_client(tmp_path):
+    url = "http://127.0.0.1:1/api"
+    db = get_client(url, cache_dir=str(tmp_path), ttl=10)
+    assert get_client(url, ttl=10, cache_dir=str(tmp_path)) is db
+    # other options, another client
+    other = get_client(url, cache_dir=str(tmp_path), ttl=0)
+    assert other is not db
+    assert (db.ttl, other.ttl) == (10, 0)
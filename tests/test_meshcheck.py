@@ -0,0 +1,46 @@
+"""
+Tests of the markers check
+"""
+
+import pytest
+
+from python_magnetsetup.meshcheck import msh_names, expand
+
+msh = """$MeshFormat
+4.1 0 8
+$EndMeshFormat
+$PhysicalNames
+3
+2 1 "H1_Cu1"
+2 2 "H1_Cu2"
+1 3 "Air boundary"
+$EndPhysicalNames
+$Entities
+0 0 0 0
+$EndEntities
+$Nodes
+$PhysicalNames
+"""
+
+
+def test_msh_names(tmp_path):
+    meshfile = tmp_path / "mesh.msh"
+    meshfile.write_text(msh)
+    assert msh_names(str(meshfile)) == {"H1_Cu1": (2, 1), "H1_Cu2": (2, 2), "Air boundary": (1, 3)}
+
+    # the mesh data sections are not read
+    meshfile.write_text("$MeshFormat\n4.1 0 8\n$EndMeshFormat\n$Nodes\n$PhysicalNames\n1\n2 1 \"H1\"\n")
+    assert msh_names(str(meshfile)) == {}
+
+    meshfile.write_text("$PhysicalNames\n2\n2 1 \"H1\"\n$EndPhysicalNames\n")
+    with pytest.raises(ValueError):
+        msh_names(str(meshfile))
+
+
+def test_expand():
+    assert expand("H1_Cu%1%", {"index1": "1:3"}) == ["H1_Cu1", "H1_Cu2"]
+    assert expand(["H%1_1%_Cu%1_2%"], {"index1": [["1", "1"], ["2", "3"]]}) == ["H1_Cu1", "H2_Cu3"]
+    assert expand({"name": "H1_Cu%1%", "index1": ["1", "2"]}) == ["H1_Cu1", "H1_Cu2"]
+    # no index
+    assert expand("H1_Cu%1%") == ["H1_Cu%1%"]
+    assert expand(["Air", {"name": "H1"}]) == ["Air"]
@@ -0,0 +1,69 @@
+"""
+Tests of the JSON Patch overlays
+"""
+
+import pytest
+
+from python_magnetsetup.overlay import diff, apply, pointer, overlay_cfg
+
+base = {
+    "Name": "HL-34",
+    "Parameters": {"Tw": "290", "dTw": "12", "U": "10"},
+    "Materials": {"H1_Cu1": {"markers": ["H1_Cu1"], "sigma": "53e+6"}},
+    "PostProcess": {"Exports": {"fields": ["heat.temperature", "electric.V"]}},
+}
+
+
+@pytest.mark.parametrize("data", [
+    # add, remove, replace
+    dict(base, Parameters={"Tw": "290", "dTw": "15", "I": "31000"}),
+    # nested values
+    dict(base, Materials={"H1_Cu1": {"markers": ["H1_Cu1"], "sigma": "58e+6", "alpha": "3.6e-3"},
+                          "H1_Cu2": {"markers": ["H1_Cu2"]}}),
+    # lists and changes of type
+    dict(base, PostProcess={"Exports": {"fields": ["heat.temperature"], "expr": {"U": "1"}}}),
+    dict(base, Name=["HL-34"]),
+    {"Name": "HL-34"},
+    # keys with ~ and /
+    dict(base, Parameters={"a/b": "1", "~c": "2", "~1d/~0": "3", "": "4"}),
+])
+def test_round_trip(data):
+    ops = diff(base, data)
+    assert apply(base, ops) == data
+    assert diff(data, data) == []
+
+
+def test_apply_does_not_modify():
+    data = dict(base, Parameters={"Tw": "285"})
+    apply(base, diff(base, data))
+    assert base["Parameters"] == {"Tw": "290", "dTw": "12", "U": "10"}
+
+
+def test_pointer():
+    assert pointer(["Parameters", "a/b", "~c"]) == "/Parameters/a~1b/~0c"
+    assert apply({"a/b": {"~c": 1}}, [{"op": "replace", "path": "/a~1b/~0c", "value": 2}]) == {"a/b": {"~c": 2}}
+
+
+def test_apply_lists():
+    data = {"fields": ["T", "V"]}
+    ops = [{"op": "add", "path": "/fields/-", "value": "B"},
+           {"op": "add", "path": "/fields/0", "value": "U"},
+           {"op": "remove", "path": "/fields/1"}]
+    assert apply(data, ops) == {"fields": ["U", "V", "B"]}
+
+
+def test_overlay_cfg():
+    cfg = "directory=cfpdes/HL-34\n[cfpdes]\nfilename=$cfgdir/HL-34-sim.json\nsolver=Newton\n"
+    ops = [{"op": "replace", "path": "/Parameters/Tw", "value": "285"}]
+    res = overlay_cfg(cfg, "HL-34-sim.json", "../base/HL-34-sim.json", ops)
+    assert res == ('directory=cfpdes/HL-34\n[cfpdes]\nfilename=$cfgdir/../base/HL-34-sim.json\n'
+                   'json.patch={"op":"replace","path":"/Parameters/Tw","value":"285"}\nsolver=Newton\n')
+
+
+def test_overlay_cfg_missing_filename():
+    cfg = "directory=cfpdes/HL-34\n[cfpdes]\nsolver=Newton\n"
+    with pytest.raises(ValueError):
+        overlay_cfg(cfg, "HL-34-sim.json", "../base/HL-34-sim.json", [])
+    # another model
+    with pytest.raises(ValueError):
+        overlay_cfg(cfg + "filename=$cfgdir/other.json\n", "HL-34-sim.json", "../base/HL-34-sim.json", [])
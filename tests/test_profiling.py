@@ -0,0 +1,46 @@
+"""
+Tests of the per stage profiler
+"""
+
+import pstats
+
+from python_magnetsetup.profiling import Profiler, profiling, stage, profiled
+
+
+def work():
+    return sum(i * i for i in range(1000))
+
+
+@profiled("inner")
+def inner():
+    return work()
+
+
+def calls(profile):
+    """
+    returns the number of calls of each function of profile
+    """
+    return {key[2]: value[1] for (key, value) in pstats.Stats(profile).stats.items()}
+
+
+def test_stages():
+    with profiling(Profiler(memory=False)) as profiler:
+        with stage("outer"):
+            inner()
+            inner()
+    assert profiler.stats["outer"]["calls"] == 1
+    assert profiler.stats["inner"]["calls"] == 2
+    assert profiler.stats["inner"]["time"] <= profiler.stats["outer"]["time"]
+    assert [event["name"] for event in profiler.events] == ["inner", "inner", "outer"]
+
+
+def test_nested_cprofile():
+    # only the outer stage is profiled, its profile includes the inner stage
+    with profiling(Profiler(memory=False, cprofile=["outer", "inner"])) as profiler:
+        with stage("outer"):
+            inner()
+        inner()
+    assert calls(profiler.profiles["outer"])["work"] == 1
+    # the second call only
+    assert calls(profiler.profiles["inner"])["work"] == 1
+    assert profiler.stats["inner"]["calls"] == 2
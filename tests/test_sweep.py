@@ -0,0 +1,97 @@
+"""
+Tests of the sweep specs and members
+"""
+
+import pytest
+
+from python_magnetsetup.model import magnet_data
+from python_magnetsetup.sweep import check_spec, members, set_material, set_parameters, member_cfg, split
+
+
+def test_grid():
+    spec = {"sampling": "grid", "parameters": {"Tw": [285, 290], "dTw": [10, 12, 15]}}
+    res = members(spec)
+    assert len(res) == 6
+    assert res[0] == {"Tw": 285, "dTw": 10}
+    assert res[-1] == {"Tw": 290, "dTw": 15}
+    # grid is the default
+    assert members({"parameters": spec["parameters"]}) == res
+
+
+def test_list():
+    spec = {"sampling": "list", "parameters": {"Tw": [285, 290], "dTw": [10, 12]}}
+    assert members(spec) == [{"Tw": 285, "dTw": 10}, {"Tw": 290, "dTw": 12}]
+
+
+def test_lhs():
+    spec = {"sampling": "lhs", "samples": 8, "seed": 1,
+            "parameters": {"Tw": {"min": 285, "max": 295}, "dTw": [10, 15]}}
+    res = members(spec)
+    assert len(res) == 8
+    assert members(spec) == res
+    # one sample per stratum of each parameter
+    assert sorted(int((v["Tw"] - 285) / 10 * 8) for v in res) == list(range(8))
+    assert sorted(int((v["dTw"] - 10) / 5 * 8) for v in res) == list(range(8))
+
+
+def test_sobol():
+    pytest.importorskip("scipy")
+    spec = {"sampling": "sobol", "samples": 8, "seed": 1, "parameters": {"Tw": {"min": 285, "max": 295}}}
+    res = members(spec)
+    assert len(res) == 8
+    assert members(spec) == res
+    assert all(285 <= v["Tw"] <= 295 for v in res)
+
+
+@pytest.mark.parametrize("spec", [
+    {"sampling": "random", "parameters": {"Tw": [285]}},
+    {"sampling": "grid", "parameters": {}},
+    {"sampling": "grid", "parameters": {"Tw": 285}},
+    {"sampling": "list", "parameters": {"Tw": [285, 290], "dTw": [10]}},
+    {"sampling": "lhs", "samples": 8, "parameters": {"Tw": {"min": 295, "max": 285}}},
+    {"sampling": "lhs", "samples": 8, "parameters": {"Tw": {"min": 285}}},
+    {"sampling": "lhs", "parameters": {"Tw": {"min": 285, "max": 295}}},
+])
+def test_check_spec(spec):
+    with pytest.raises(ValueError):
+        check_spec(spec)
+
+
+def confdata():
+    material = {"ElectricalConductivity": 53.e+6, "alpha": 3.6e-3}
+    return magnet_data({"geom": "HL-test.yaml",
+                        "Helix": [{"material": dict(material), "insulator": dict(material)} for i in range(2)],
+                        "Ring": [{"material": dict(material), "insulator": dict(material)}]})
+
+
+def test_set_material():
+    data = confdata()
+    res = set_material(data, "Helix.material.alpha", 3.8e-3)
+    assert [part["material"]["alpha"] for part in res["Helix"]] == [3.8e-3, 3.8e-3]
+    res = set_material(data, "Helix[1].insulator.ElectricalConductivity", 1.)
+    assert [part["insulator"]["ElectricalConductivity"] for part in res["Helix"]] == [53.e+6, 1.]
+    assert res["Ring"] == data["Ring"]
+    # data is not modified
+    assert [part["material"]["alpha"] for part in data["Helix"]] == [3.6e-3, 3.6e-3]
+
+    for path in ["Helix.alpha", "Helix[2].material.alpha", "Helix.material.unknown"]:
+        with pytest.raises(ValueError):
+            set_material(data, path, 1.)
+
+
+def test_set_parameters():
+    model = {"Parameters": {"Tw": "290", "dTw1": "12", "dTw2": "12", "dTw": "10", "U": "1"}}
+    set_parameters(model, {"Tw": 285, "dTw[0-9]*": 15.})
+    assert model["Parameters"] == {"Tw": "285", "dTw1": "15.0", "dTw2": "15.0", "dTw": "10", "U": "1"}
+    with pytest.raises(ValueError):
+        set_parameters(model, {"h*": 1})
+
+
+def test_split():
+    values = {"Tw": 285, "Helix[0].material.alpha": 3.8e-3}
+    assert split(values) == ({"Tw": 285}, {"Helix[0].material.alpha": 3.8e-3})
+
+
+def test_member_cfg():
+    cfg = "directory=cfpdes/HL-34\n[cfpdes]\nfilename=$cfgdir/HL-34-sim.json\n"
+    assert member_cfg(cfg, "0003") == "directory=cfpdes/HL-34/0003\n[cfpdes]\nfilename=$cfgdir/HL-34-sim.json\n"
@@ -0,0 +1,76 @@
+"""
+Tests of the warm start from saved fields
+"""
+
+import os
+import json
+
+import pytest
+
+from python_magnetsetup.warmstart import saved_fields, init_files, predicted_files, cfg_directory, chain, record
+
+
+def touch(path, mtime: float):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_saved_fields(tmp_path):
+    run = tmp_path / "HL-34" / "np_2"
+    touch(run / "cfpdes.heat.save" / "temperature.h5", 100)
+    # newer, but not in the directory of the heat equation
+    touch(run / "cfpdes.save" / "temperature.h5", 200)
+    touch(run / "cfpdes.electric.save" / "V.h5", 100)
+    touch(run / "cfpdes.electric.save" / "cfpdes.V.h5", 300)
+    touch(run / "cfpdes.electric.save" / "U.h5", 400)
+
+    files = saved_fields(str(tmp_path))
+    assert files == {"temperature": str(run / "cfpdes.heat.save" / "temperature.h5"),
+                     "V": str(run / "cfpdes.electric.save" / "cfpdes.V.h5")}
+    assert init_files(str(tmp_path)) == files
+
+
+def test_init_files_errors(tmp_path):
+    with pytest.raises(RuntimeError):
+        init_files(str(tmp_path / "missing"))
+    touch(tmp_path / "cfpdes.heat.save" / "U.h5", 100)
+    with pytest.raises(RuntimeError):
+        init_files(str(tmp_path))
+
+
+def test_predicted_files():
+    cfg = "directory=cfpdes/HL-34/0002\n[cfpdes]\nfilename=$cfgdir/HL-34-sim.json\n"
+    directory = cfg_directory(cfg)
+    assert directory == "cfpdes/HL-34/0002"
+    assert predicted_files(directory, ["heat"], 4) == {
+        "temperature": "$repository/cfpdes/HL-34/0002/np_4/cfpdes.heat.save/temperature.h5"}
+    assert predicted_files(directory, ["heat", "electric"]) == {
+        "temperature": "$repository/cfpdes/HL-34/0002/np_1/cfpdes.heat.save/temperature.h5",
+        "V": "$repository/cfpdes/HL-34/0002/np_1/cfpdes.electric.save/V.h5"}
+    assert predicted_files(directory, ["magnetic"]) == {}
+    assert cfg_directory("[cfpdes]\n") is None
+
+
+def test_chain():
+    assert chain([]) == []
+    assert chain([{"Tw": 285}]) == [None]
+    # nearest preceding member
+    assert chain([{"Tw": 285}, {"Tw": 295}, {"Tw": 286}, {"Tw": 294}]) == [None, 0, 0, 1]
+    # values are scaled by their range (nearest to 0 without scaling)
+    values = [{"Tw": 285, "dTw": 10}, {"Tw": 295, "dTw": 15}, {"Tw": 287, "dTw": 14.5}]
+    assert chain(values) == [None, 0, 1]
+    # the latest one for equal distances
+    assert chain([{"Tw": 285}, {"Tw": 295}, {"Tw": 290}]) == [None, 0, 1]
+    # non numeric values
+    assert chain([{"m": "a"}, {"m": "b"}, {"m": "a"}]) == [None, 0, 0]
+
+
+def test_record(tmp_path):
+    manifest = str(tmp_path / "warmstart.json")
+    record(manifest, {"jsonfile": "a.json", "init_from": "run1", "init": {}})
+    record(manifest, {"jsonfile": "b.json", "init_from": "run1", "init": {}})
+    entries = record(manifest, {"jsonfile": "a.json", "init_from": "run2", "init": {}})
+    assert [(e["jsonfile"], e["init_from"]) for e in entries] == [("b.json", "run1"), ("a.json", "run2")]
+    with open(manifest, "r") as f:
+        assert json.load(f) == entries